@@ -68,6 +68,8 @@ __all__ = [
     "UserTestExecutable",
     # printjob
     "PrintJob",
+    # compilationcache
+    "CompilationCacheEntry",
     # init
     "init_db",
     # drop
@@ -75,13 +77,14 @@ __all__ = [
     # util
     "test_db_connection", "get_contest_list", "is_contest_id",
     "ask_for_contest", "get_submissions", "get_submission_results",
-    "get_datasets_to_judge", "enumerate_files"
+    "invalidate_submission_results", "get_datasets_to_judge",
+    "enumerate_files"
 ]
 
 
 # Instantiate or import these objects.
 
-version = 42
+version = 44
 
 engine = create_engine(config.database, echo=config.database_debug,
                        pool_timeout=60, pool_recycle=120)
@@ -104,13 +107,14 @@ from .submission import Submission, File, Token, SubmissionResult, \
 from .usertest import UserTest, UserTestFile, UserTestManager, \
     UserTestResult, UserTestExecutable
 from .printjob import PrintJob
+from .compilationcache import CompilationCacheEntry
 
 from .init import init_db
 from .drop import drop_db
 
 from .util import test_db_connection, get_contest_list, is_contest_id, \
     ask_for_contest, get_submissions, get_submission_results, \
-    get_datasets_to_judge, enumerate_files
+    invalidate_submission_results, get_datasets_to_judge, enumerate_files
 
 
 configure_mappers()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+# Copyright © 2026 agent <agent@local>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compilation-cache-related database interface for SQLAlchemy.
+
+"""
+
+import hashlib
+import json
+
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB
+from sqlalchemy.schema import Column
+from sqlalchemy.types import Boolean, DateTime, Integer, String, Unicode
+
+from . import Base
+
+
+class CompilationCacheEntry(Base):
+    """Class to store the result of a compilation, to be reused by
+    compilations of the same files with the same commands.
+
+    """
+    __tablename__ = 'compilation_cache'
+
+    # Auto increment primary key.
+    id = Column(
+        Integer,
+        primary_key=True)
+
+    # Hash of the language, the commands and the files of the
+    # compilation (see make_key).
+    key = Column(
+        String,
+        nullable=False,
+        unique=True)
+
+    # Name of the language of the compilation (for information).
+    language = Column(
+        Unicode,
+        nullable=False)
+
+    # Time the entry was created.
+    timestamp = Column(
+        DateTime,
+        nullable=False)
+
+    # The result of the compilation, as in the CompilationJob.
+    compilation_success = Column(
+        Boolean,
+        nullable=False)
+    text = Column(
+        ARRAY(String),
+        nullable=False,
+        default=[])
+    stats = Column(
+        JSONB,
+        nullable=False,
+        default={})
+
+    # The executables produced, as a dict from filename to digest.
+    executables = Column(
+        JSONB,
+        nullable=False,
+        default={})
+
+    @staticmethod
+    def make_key(language, commands, files):
+        """Compute the key of a compilation.
+
+        language (str): the name of the language.
+        commands ([[str]]): the compilation commands.
+        files ({str: str}): the digests of the files put in the
+            sandbox, indexed by filename.
+
+        return (str): the key of the entry for the compilation.
+
+        """
+        data = json.dumps([language, commands, sorted(files.items())])
+        return hashlib.sha1(data.encode("utf-8")).hexdigest()
@@ -25,23 +25,215 @@
 """
 
 import atexit
+import fcntl
 import io
 import logging
 import os
+import struct
 import tempfile
+import zlib
 from abc import ABCMeta, abstractmethod
 
 import gevent
 from sqlalchemy.exc import IntegrityError
 
 from cms import config, mkdir, rmtree
-from cms.db import SessionGen, Digest, FSObject, LargeObject
+from cms.db import SessionGen, Digest, FSObject, LargeObject, \
+    custom_psycopg2_connection
 from cmscommon.digest import Digester
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 
 logger = logging.getLogger(__name__)
 
 
+# Objects stored compressed in the backend start with this marker,
+# followed by the id of the codec (one byte) and the size of the
+# uncompressed content (eight bytes, big-endian). Objects without the
+# marker are stored as they are.
+COMPRESSION_MAGIC = b"\x89CMS\r\n\x1a\n"
+COMPRESSION_HEADER = struct.Struct(">BQ")
+COMPRESSION_HEADER_SIZE = len(COMPRESSION_MAGIC) + COMPRESSION_HEADER.size
+# The ids of the codecs; "none" is only used for contents that
+# happen to start with the marker.
+CODECS = {"none": 0, "zlib": 1, "zstd": 2}
+
+
+class _NoneCodec:
+    """A (de)compressor that doesn't change the data."""
+
+    eof = True
+
+    def compress(self, data):
+        return data
+
+    def decompress(self, data):
+        return data
+
+    def flush(self):
+        return b""
+
+
+def _get_compressor(codec):
+    """Return a streaming compressor for the given codec.
+
+    codec (str): the name of the codec, a key of CODECS.
+
+    return (object): an object with methods compress(data) and
+        flush(), both returning compressed bytes.
+
+    raise (ValueError): if the codec is not known or not available.
+
+    """
+    if codec == "none":
+        return _NoneCodec()
+    elif codec == "zlib":
+        return zlib.compressobj()
+    elif codec == "zstd":
+        if zstandard is None:
+            raise ValueError("Codec zstd requires the zstandard module.")
+        return zstandard.ZstdCompressor().compressobj()
+    raise ValueError("Unknown codec %s." % codec)
+
+
+def _get_decompressor(codec_id):
+    """Return a streaming decompressor for the given codec.
+
+    codec_id (int): the id of the codec, a value of CODECS.
+
+    return (object): an object with a method decompress(data),
+        returning decompressed bytes.
+
+    raise (ValueError): if the codec is not known or not available.
+
+    """
+    if codec_id == CODECS["none"]:
+        return _NoneCodec()
+    elif codec_id == CODECS["zlib"]:
+        return zlib.decompressobj()
+    elif codec_id == CODECS["zstd"]:
+        if zstandard is None:
+            raise ValueError("Codec zstd requires the zstandard module.")
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise ValueError("Unknown codec id %d." % codec_id)
+
+
+def _write_all(destination_fobj, buffer):
+    """Write a whole buffer to a file object, yielding often."""
+    while len(buffer) > 0:
+        gevent.sleep(0)
+        written = destination_fobj.write(buffer)
+        if written is None:
+            break
+        buffer = buffer[written:]
+
+
+def compress_fileobj(source_fobj, destination_fobj, codec, size,
+                     buffer_size=io.DEFAULT_BUFFER_SIZE):
+    """Write the content of a file in the storage format.
+
+    The content is compressed and prefixed by the compression header
+    if codec is not None, or if the content starts with the marker
+    (which would make it ambiguous); otherwise it is copied as it is.
+
+    source_fobj (fileobj): a binary file object open for reading,
+        positioned at the beginning.
+    destination_fobj (fileobj): a binary file object open for writing.
+    codec (str|None): the name of the codec, or None to store the
+        content uncompressed.
+    size (int): the size of the content.
+    buffer_size (int): the size of the read buffer.
+
+    """
+    buffer = source_fobj.read(len(COMPRESSION_MAGIC))
+    if codec is None:
+        if buffer != COMPRESSION_MAGIC:
+            _write_all(destination_fobj, buffer)
+            copyfileobj(source_fobj, destination_fobj, buffer_size)
+            return
+        codec = "none"
+
+    compressor = _get_compressor(codec)
+    _write_all(destination_fobj, COMPRESSION_MAGIC
+               + COMPRESSION_HEADER.pack(CODECS[codec], size))
+    while len(buffer) > 0:
+        _write_all(destination_fobj, compressor.compress(buffer))
+        buffer = source_fobj.read(buffer_size)
+    _write_all(destination_fobj, compressor.flush())
+
+
+def decompress_fileobj(source_fobj, destination_fobj,
+                       buffer_size=io.DEFAULT_BUFFER_SIZE):
+    """Write the original content of a file in the storage format.
+
+    Inverse of compress_fileobj.
+
+    source_fobj (fileobj): a binary file object open for reading, with
+        the content as stored in a backend.
+    destination_fobj (fileobj): a binary file object open for writing.
+    buffer_size (int): the size of the read buffer.
+
+    return (int): the size of the (uncompressed) content.
+
+    raise (ValueError): if the content is compressed with an unknown
+        codec or is corrupted.
+
+    """
+    buffer = source_fobj.read(COMPRESSION_HEADER_SIZE)
+    if not buffer.startswith(COMPRESSION_MAGIC) \
+            or len(buffer) < COMPRESSION_HEADER_SIZE:
+        _write_all(destination_fobj, buffer)
+        size = len(buffer)
+        while True:
+            buffer = source_fobj.read(buffer_size)
+            if len(buffer) == 0:
+                return size
+            _write_all(destination_fobj, buffer)
+            size += len(buffer)
+
+    codec_id, expected_size = COMPRESSION_HEADER.unpack(
+        buffer[len(COMPRESSION_MAGIC):])
+    decompressor = _get_decompressor(codec_id)
+    size = 0
+    while True:
+        buffer = source_fobj.read(buffer_size)
+        if len(buffer) == 0:
+            break
+        data = decompressor.decompress(buffer)
+        _write_all(destination_fobj, data)
+        size += len(data)
+    data = decompressor.flush()
+    _write_all(destination_fobj, data)
+    size += len(data)
+    if not decompressor.eof:
+        raise ValueError("Stored file is corrupted: truncated.")
+    if size != expected_size:
+        raise ValueError("Stored file is corrupted: expected %d bytes, "
+                         "got %d." % (expected_size, size))
+    return size
+
+
+def read_stored_size(source_fobj):
+    """Return the original size of a compressed file, if known.
+
+    source_fobj (fileobj): a binary file object open for reading, with
+        the content as stored in a backend.
+
+    return (int|None): the size of the uncompressed content, or None
+        if the content is stored uncompressed.
+
+    """
+    buffer = source_fobj.read(COMPRESSION_HEADER_SIZE)
+    if len(buffer) < COMPRESSION_HEADER_SIZE \
+            or not buffer.startswith(COMPRESSION_MAGIC):
+        return None
+    return COMPRESSION_HEADER.unpack(buffer[len(COMPRESSION_MAGIC):])[1]
+
+
 def copyfileobj(source_fobj, destination_fobj,
                 buffer_size=io.DEFAULT_BUFFER_SIZE):
     """Read all content from one file object and write it to another.
@@ -80,6 +272,14 @@ class TombstoneError(RuntimeError):
     pass
 
 
+class _DigesterWriter(Digester):
+    """A Digester that can be used as a writable file object."""
+
+    def write(self, data):
+        self.update(data)
+        return len(data)
+
+
 class FileCacherBackend(metaclass=ABCMeta):
     """Abstract base class for all FileCacher backends.
 
@@ -99,6 +299,28 @@ class FileCacherBackend(metaclass=ABCMeta):
         """
         pass
 
+    def get_files(self, digests):
+        """Retrieve many files from the storage.
+
+        This generic implementation just calls get_file() for each
+        digest; backends should override it if they can do better.
+
+        digests ([unicode]): the digests of the files to retrieve.
+
+        return (iterator): an iterator over pairs (digest, fobj), one
+            for each file that can be found, in no particular order;
+            fobj is a readable binary file-like object, valid only
+            until the iterator advances.
+
+        """
+        for digest in digests:
+            try:
+                fobj = self.get_file(digest)
+            except KeyError:
+                continue
+            with fobj:
+                yield digest, fobj
+
     @abstractmethod
     def create_file(self, digest):
         """Create an empty file that will live in the storage.
@@ -320,6 +542,28 @@ class DBBackend(FileCacherBackend):
 
             return fso.get_lobject(mode='rb')
 
+    def get_files(self, digests):
+        """See FileCacherBackend.get_files().
+
+        The FSObjects are looked up with a single query, and the large
+        objects are read one after the other on the same connection.
+
+        """
+        digests = list(digests)
+        if len(digests) == 0:
+            return
+        with SessionGen() as session:
+            loids = session.query(FSObject.digest, FSObject.loid)\
+                .filter(FSObject.digest.in_(digests)).all()
+
+        conn = custom_psycopg2_connection()
+        try:
+            for digest, loid in loids:
+                with LargeObject(loid, mode='rb', conn=conn) as fobj:
+                    yield digest, fobj
+        finally:
+            conn.close()
+
     def create_file(self, digest):
         """See FileCacherBackend.create_file().
 
@@ -484,6 +728,15 @@ class FileCacher:
     # CHUNK_SIZE should be a multiple of these values.
     CHUNK_SIZE = 16 * 1024  # 16 KiB
 
+    # When the cache exceeds its maximum size, files are evicted until
+    # its size goes below this fraction of the maximum size, so that
+    # the (expensive) scan of the cache directory doesn't happen at
+    # every new file.
+    EVICTION_TARGET_RATIO = 0.9
+
+    # Name of the cache directory shared by all services on a host.
+    SHARED_CACHE_DIR_NAME = "fs-cache-shared"
+
     def __init__(self, service=None, path=None, null=False):
         """Initialize.
 
@@ -503,9 +756,41 @@ class FileCacher:
             that just discards every file it receives. This setting
             takes priority over path.
 
+        If the configuration asks for a shared cache, all the services
+        on the same host use the same cache directory; since files are
+        named after their digest, they can be safely shared. If the
+        configuration sets a maximum size for the cache, the least
+        recently used files are evicted when the size is exceeded.
+
+        Files are stored in the backend compressed with the codec given
+        in the configuration, if any, but the local cache always holds
+        them uncompressed.
+
+        raise (ValueError): if the configured codec is not available.
+
         """
         self.service = service
 
+        # The codec to compress files with before storing them in the
+        # backend; files are read correctly regardless of this value.
+        self.compression = config.file_compression
+        if self.compression is not None:
+            _get_compressor(self.compression)
+
+        self.max_size = None
+        if config.file_cache_max_size_mib is not None:
+            self.max_size = config.file_cache_max_size_mib * 1024 * 1024
+
+        # Statistics on the usage of the local cache.
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+        # Our estimate of the size of the local cache (None if not
+        # computed yet): it is recomputed exactly at every eviction,
+        # and in between we only add the files stored by ourselves.
+        self._cache_size = None
+
         if null:
             self.backend = NullBackend()
         elif path is None:
@@ -522,6 +807,9 @@ class FileCacher:
             # Delete this directory on exit since it has a random name and
             # won't be used again.
             atexit.register(lambda: rmtree(self.file_dir))
+        elif config.shared_file_cache:
+            self.file_dir = os.path.join(
+                config.cache_dir, FileCacher.SHARED_CACHE_DIR_NAME)
         else:
             self.file_dir = os.path.join(
                 config.cache_dir,
@@ -553,6 +841,9 @@ class FileCacher:
         if_needed (bool): only load the file if it is not present in
             the local cache.
 
+        return (int|None): the size of the file copied into the cache,
+            or None if it wasn't loaded because already present.
+
         raise (KeyError): if the backend cannot find the file.
         raise (TombstoneError): if the digest is the tombstone
 
@@ -561,17 +852,69 @@ class FileCacher:
             raise TombstoneError()
         cache_file_path = os.path.join(self.file_dir, digest)
         if if_needed and os.path.exists(cache_file_path):
-            return
+            return None
+
+        with self.backend.get_file(digest) as fobj:
+            return self._load_from_fobj(digest, fobj)
+
+    def load_many(self, digests, if_needed=False):
+        """Load many files into the cache.
+
+        Like load(), but ask the backend for all the files at once,
+        which can be much faster than asking for them one at a time.
+
+        digests ([unicode]): the digests of the files to load.
+        if_needed (bool): only load the files that are not present in
+            the local cache.
+
+        return ({unicode: int}): the sizes of the files copied into the
+            cache, indexed by digest; files that weren't loaded because
+            already present, or that the backend cannot find, are
+            missing.
+
+        raise (TombstoneError): if one of the digests is the tombstone
+
+        """
+        to_load = set()
+        for digest in digests:
+            if digest == Digest.TOMBSTONE:
+                raise TombstoneError()
+            if if_needed and \
+                    os.path.exists(os.path.join(self.file_dir, digest)):
+                continue
+            to_load.add(digest)
+
+        sizes = dict()
+        for digest, fobj in self.backend.get_files(sorted(to_load)):
+            sizes[digest] = self._load_from_fobj(digest, fobj)
+        return sizes
+
+    def _load_from_fobj(self, digest, fobj):
+        """Copy the content of a file into the cache.
+
+        digest (unicode): the digest of the file.
+        fobj (fileobj): a readable binary file-like object with the
+            content of the file.
+
+        return (int): the size of the file.
+
+        """
+        cache_file_path = os.path.join(self.file_dir, digest)
 
         ftmp_handle, temp_file_path = tempfile.mkstemp(dir=self.temp_dir,
                                                        text=False)
-        with open(ftmp_handle, 'wb') as ftmp, \
-                self.backend.get_file(digest) as fobj:
-            copyfileobj(fobj, ftmp, self.CHUNK_SIZE)
+        try:
+            with open(ftmp_handle, 'wb') as ftmp:
+                size = decompress_fileobj(fobj, ftmp, self.CHUNK_SIZE)
+        except ValueError:
+            os.unlink(temp_file_path)
+            raise
 
         # Then move it to its real location (this operation is atomic
         # by POSIX requirement)
         os.rename(temp_file_path, cache_file_path)
+        self._file_added(cache_file_path, size)
+        return size
 
     def get_file(self, digest):
         """Retrieve a file from the storage.
@@ -599,7 +942,10 @@ class FileCacher:
 
         logger.debug("Getting file %s.", digest)
 
-        if not os.path.exists(cache_file_path):
+        try:
+            fobj = self._open_cached_file(cache_file_path)
+        except FileNotFoundError:
+            self.misses += 1
             logger.debug("File %s not in cache, downloading "
                          "from database.", digest)
 
@@ -607,7 +953,36 @@ class FileCacher:
 
             logger.debug("File %s downloaded.", digest)
 
-        return open(cache_file_path, 'rb')
+            return self._open_cached_file(cache_file_path)
+
+        self.hits += 1
+        return fobj
+
+    @staticmethod
+    def _open_cached_file(cache_file_path):
+        """Open a file of the local cache, protecting it from eviction.
+
+        The returned file object holds a shared lock on the file, which
+        prevents any FileCacher (even in other processes using the same
+        cache directory) from evicting it until the file is closed.
+        The modification time of the file is updated, as it is used to
+        decide which files are the least recently used.
+
+        cache_file_path (str): the path of the file in the cache.
+
+        return (fileobj): the file opened in read binary mode.
+
+        raise (FileNotFoundError): if the file is not in the cache.
+
+        """
+        fobj = open(cache_file_path, 'rb')
+        try:
+            fcntl.flock(fobj, fcntl.LOCK_SH)
+            os.utime(fobj.fileno())
+        except OSError:
+            fobj.close()
+            raise
+        return fobj
 
     def get_file_content(self, digest):
         """Retrieve a file from the storage.
@@ -689,7 +1064,9 @@ class FileCacher:
             return
 
         with open(cache_file_path, 'rb') as src:
-            copyfileobj(src, fobj, self.CHUNK_SIZE)
+            compress_fileobj(src, fobj, self.compression,
+                             os.fstat(src.fileno()).st_size,
+                             self.CHUNK_SIZE)
 
         self.backend.commit_file(fobj, digest, desc)
 
@@ -743,8 +1120,10 @@ class FileCacher:
 
             if not os.path.exists(cache_file_path):
                 os.rename(dst.name, cache_file_path)
+                added_size = dst.tell()
             else:
                 os.unlink(dst.name)
+                added_size = None
 
         # Store the file in the backend. We do that even if the file
         # was already in the cache (that is, we ignore the check above)
@@ -752,6 +1131,11 @@ class FileCacher:
         # from the backend but somehow remained in the cache.
         self.save(digest, desc)
 
+        # Only now that the file is safe in the backend we can risk
+        # evicting it from the cache.
+        if added_size is not None:
+            self._file_added(cache_file_path, added_size)
+
         return digest
 
     def put_file_content(self, content, desc=""):
@@ -815,7 +1199,11 @@ class FileCacher:
         """
         if digest == Digest.TOMBSTONE:
             raise TombstoneError()
-        return self.backend.get_size(digest)
+        with self.backend.get_file(digest) as fobj:
+            size = read_stored_size(fobj)
+        if size is None:
+            size = self.backend.get_size(digest)
+        return size
 
     def delete(self, digest):
         """Delete a file from the backend and the local cache.
@@ -843,6 +1231,108 @@ class FileCacher:
         except OSError:
             pass
 
+    def _file_added(self, path, size):
+        """Account for a new file in the cache, evicting if needed.
+
+        path (str): the path of the file just added to the cache, which
+            will not be evicted.
+        size (int): the size of the file.
+
+        """
+        if self.max_size is None:
+            return
+        if self._cache_size is None:
+            self._cache_size = self._scan_cache()[1]
+        else:
+            self._cache_size += size
+        if self._cache_size > self.max_size:
+            self.evict(int(self.max_size * self.EVICTION_TARGET_RATIO),
+                       keep=[path])
+
+    def _scan_cache(self):
+        """List the files in the local cache.
+
+        return ([(float, int, str)], int): the list of the files in the
+            cache, as tuples (last access time, size, path) sorted from
+            the least recently used, and their total size.
+
+        """
+        entries = []
+        total_size = 0
+        with os.scandir(self.file_dir) as it:
+            for entry in it:
+                # Skip temporary files and directories.
+                if entry.name.startswith((".", "_")):
+                    continue
+                try:
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    stat = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total_size += stat.st_size
+        entries.sort()
+        return entries, total_size
+
+    def evict(self, target_size, keep=()):
+        """Remove files from the local cache until it is small enough.
+
+        Files are removed starting from the least recently used. Files
+        currently opened through get_file (by any FileCacher using the
+        same cache directory) are never removed.
+
+        target_size (int): the size in bytes the cache should be
+            reduced to.
+        keep ([str]): paths of files that must not be removed.
+
+        return (int): the size of the cache after the eviction.
+
+        """
+        entries, total_size = self._scan_cache()
+        for _, size, path in entries:
+            if total_size <= target_size:
+                break
+            if path in keep:
+                continue
+            try:
+                with open(path, 'rb') as fobj:
+                    # Readers hold a shared lock, so if we cannot get
+                    # an exclusive one the file is in use.
+                    fcntl.flock(fobj, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    os.unlink(path)
+            except BlockingIOError:
+                continue
+            except FileNotFoundError:
+                # Someone else evicted it in the meantime.
+                total_size -= size
+                continue
+            total_size -= size
+            self.evictions += 1
+            self.evicted_bytes += size
+        logger.info("Cache evicted to %d bytes (target %d bytes).",
+                    total_size, target_size)
+        self._cache_size = total_size
+        return total_size
+
+    def get_cache_stats(self):
+        """Return statistics on the usage of the local cache.
+
+        return ({str: int|None}): the number of cache hits and misses,
+            the number and total size of evicted files, and the current
+            and maximum size of the cache (the latter None if the cache
+            is unbounded).
+
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "evicted_bytes": self.evicted_bytes,
+            "size": self._scan_cache()[1],
+            "max_size": self.max_size,
+        }
+
     def purge_cache(self):
         """Empty the local cache.
 
@@ -886,12 +1376,17 @@ class FileCacher:
         """
         clean = True
         for digest, _ in self.list():
-            d = Digester()
+            d = _DigesterWriter()
             with self.backend.get_file(digest) as fobj:
-                buf = fobj.read(self.CHUNK_SIZE)
-                while len(buf) > 0:
-                    d.update(buf)
-                    buf = fobj.read(self.CHUNK_SIZE)
+                try:
+                    decompress_fileobj(fobj, d, self.CHUNK_SIZE)
+                except ValueError as error:
+                    logger.error("File with hash %s cannot be read: %s",
+                                 digest, error)
+                    if delete:
+                        self.delete(digest)
+                    clean = False
+                    continue
             computed_digest = d.digest()
             if digest != computed_digest:
                 logger.error("File with hash %s actually has hash %s",
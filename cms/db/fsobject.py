@@ -68,13 +68,17 @@ class LargeObject(io.RawIOBase):
     INV_READ = 0x40000
     INV_WRITE = 0x20000
 
-    def __init__(self, loid, mode='rb'):
+    def __init__(self, loid, mode='rb', conn=None):
         """Open a large object, creating it if required.
 
         loid (int): the large object ID.
         mode (string): how to open the file (`r' -> read, `w' -> write,
             `b' -> binary, which must be always specified). If not
             given, `rb' is used.
+        conn (connection|None): the connection to use; if not given, a
+            new one is created. A connection can be shared by many
+            large objects, as long as each of them is closed before
+            the next one is opened.
 
         """
         io.RawIOBase.__init__(self)
@@ -93,7 +97,8 @@ class LargeObject(io.RawIOBase):
         self._readable = 'r' in mode
         self._writable = 'w' in mode
 
-        self._conn = custom_psycopg2_connection()
+        self._conn = conn if conn is not None \
+            else custom_psycopg2_connection()
         cursor = self._conn.cursor()
 
         # If the loid is 0, create the large object.
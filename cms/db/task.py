@@ -403,6 +403,15 @@ class Dataset(Base):
         JSONB,
         nullable=False)
 
+    # Whether to skip the evaluation of the testcases that cannot
+    # change the score anymore, for score types that support it (for
+    # example, the other testcases of a subtask after one failed, with
+    # GroupMin).
+    skip_doomed_subtasks = Column(
+        Boolean,
+        nullable=False,
+        default=False)
+
     # Name of the ScoreType child class suited for the task.
     score_type = Column(
         String,
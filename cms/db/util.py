@@ -26,14 +26,14 @@
 import sys
 import logging
 
-from sqlalchemy import union
+from sqlalchemy import or_, tuple_, union
 from sqlalchemy.exc import OperationalError
 
 from cms import ConfigError
 from . import SessionGen, Digest, Contest, Participation, Statement, \
     Attachment, Task, Manager, Dataset, Testcase, Submission, File, \
-    SubmissionResult, Executable, UserTest, UserTestFile, UserTestManager, \
-    UserTestResult, UserTestExecutable, PrintJob
+    SubmissionResult, Executable, Evaluation, UserTest, UserTestFile, \
+    UserTestManager, UserTestResult, UserTestExecutable, PrintJob
 
 
 logger = logging.getLogger(__name__)
@@ -249,6 +249,62 @@ def get_submission_results(session, contest_id=None, participation_id=None,
     return query
 
 
+def invalidate_submission_results(session, submission_results, level):
+    """Invalidate many submission results with a few SQL statements.
+
+    This has the same effect as calling invalidate_compilation or
+    invalidate_evaluation on each of the submission results, without
+    loading them. Objects already in the session are not updated.
+
+    session (Session): the database session to use.
+    submission_results (Query): a query for the submission results to
+        invalidate (e.g., from get_submission_results).
+    level (str): "compilation" or "evaluation".
+
+    return (int): the number of submission results invalidated.
+
+    """
+    if level not in ("compilation", "evaluation"):
+        raise ValueError("Unexpected invalidation level `%s'." % level)
+
+    keys = submission_results.with_entities(
+        SubmissionResult.submission_id, SubmissionResult.dataset_id)\
+        .subquery()
+
+    def key_filter(cls):
+        return tuple_(cls.submission_id, cls.dataset_id).in_(
+            session.query(keys.c.submission_id, keys.c.dataset_id))
+
+    values = {
+        SubmissionResult.score: None,
+        SubmissionResult.score_details: None,
+        SubmissionResult.public_score: None,
+        SubmissionResult.public_score_details: None,
+        SubmissionResult.ranking_score_details: None,
+        SubmissionResult.evaluation_outcome: None,
+        SubmissionResult.evaluation_tries: 0,
+    }
+    session.query(Evaluation).filter(key_filter(Evaluation))\
+        .delete(synchronize_session=False)
+    if level == "compilation":
+        values.update({
+            SubmissionResult.compilation_outcome: None,
+            SubmissionResult.compilation_text: [],
+            SubmissionResult.compilation_tries: 0,
+            SubmissionResult.compilation_time: None,
+            SubmissionResult.compilation_wall_clock_time: None,
+            SubmissionResult.compilation_memory: None,
+            SubmissionResult.compilation_shard: None,
+            SubmissionResult.compilation_sandbox: None,
+        })
+        session.query(Executable).filter(key_filter(Executable))\
+            .delete(synchronize_session=False)
+
+    return session.query(SubmissionResult)\
+        .filter(key_filter(SubmissionResult))\
+        .update(values, synchronize_session=False)
+
+
 def get_datasets_to_judge(task):
     """Determine the datasets that ES and SS have to judge.
 
@@ -275,10 +331,14 @@ def get_datasets_to_judge(task):
 def enumerate_files(
         session, contest=None,
         skip_submissions=False, skip_user_tests=False, skip_print_jobs=False,
-        skip_generated=False):
+        skip_generated=False, skip_unjudged_datasets=False):
     """Enumerate all the files (by digest) referenced by the
     contest.
 
+    skip_unjudged_datasets (bool): if True, consider only the managers
+        and testcases of the datasets that are automatically judged
+        (see get_datasets_to_judge).
+
     return (set): a set of strings, the digests of the file
                   referenced in the contest.
 
@@ -295,6 +355,9 @@ def enumerate_files(
                    .with_entities(Attachment.digest))
 
     dataset_q = task_q.join(Task.datasets)
+    if skip_unjudged_datasets:
+        dataset_q = dataset_q.filter(or_(Task.active_dataset_id == Dataset.id,
+                                         Dataset.autojudge.is_(True)))
     queries.append(dataset_q.join(Dataset.managers)
                    .with_entities(Manager.digest))
     queries.append(dataset_q.join(Dataset.testcases)
@@ -19,6 +19,7 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import fcntl
 import io
 import logging
 import os
@@ -30,9 +31,11 @@ from abc import ABCMeta, abstractmethod
 from functools import wraps, partial
 
 import gevent
+import gevent.local
 from gevent import subprocess
 
 from cms import config, rmtree
+from cms.db.filecacher import FileCacher, copyfileobj
 from cmscommon.commands import pretty_print_cmdline
 from cmscommon.datetime import monotonic_time
 
@@ -40,6 +43,47 @@ from cmscommon.datetime import monotonic_time
 logger = logging.getLogger(__name__)
 
 
+# Settings for the sandboxes created by the current greenlet.
+_local = gevent.local.local()
+
+
+def set_sandbox_cpus(cpus):
+    """Pin the sandboxes created by the current greenlet to some CPUs.
+
+    Only affects sandboxes created afterwards, and only by the calling
+    greenlet: this allows several jobs to run concurrently, each in a
+    greenlet with its own CPUs.
+
+    cpus ({int}|None): the CPUs the sandboxed processes can run on, or
+        None not to restrict them.
+
+    """
+    _local.cpus = cpus
+
+
+def collect_provisioning_stats():
+    """Start accumulating the provisioning stats of the current greenlet.
+
+    The sandboxes created afterwards by the calling greenlet add the
+    bytes they provision to the returned dictionary (besides their own
+    provisioning_stats), so that they can be reported for a whole job.
+
+    return ({str: int}): the bytes copied, hard-linked and reflinked
+        into the sandboxes, updated as they are provisioned.
+
+    """
+    _local.provisioning_stats = {
+        "copied_bytes": 0,
+        "linked_bytes": 0,
+        "reflinked_bytes": 0,
+    }
+    return _local.provisioning_stats
+
+
+# ioctl request to clone (reflink) a file on Linux, from linux/fs.h.
+FICLONE = 0x40049409
+
+
 class SandboxInterfaceException(Exception):
     pass
 
@@ -186,6 +230,11 @@ class SandboxBase(metaclass=ABCMeta):
     EXIT_TIMEOUT_WALL = 'wall timeout'
     EXIT_NONZERO_RETURN = 'nonzero return'
 
+    # Whether files provided to the sandbox can be hard links to the
+    # files in the cache of the FileCacher. This is safe only if the
+    # sandboxed processes run as a user that cannot write to them.
+    HARDLINKS_ALLOWED = False
+
     def __init__(self, file_cacher, name=None, temp_dir=None):
         """Initialization.
 
@@ -221,6 +270,22 @@ class SandboxBase(metaclass=ABCMeta):
         # packages.
         self.set_env["HOME"] = "./"
 
+        # Bytes of the files from storage that have been put in the
+        # sandbox by copying, hard-linking or reflinking them.
+        self.provisioning_stats = {
+            "copied_bytes": 0,
+            "linked_bytes": 0,
+            "reflinked_bytes": 0,
+        }
+        # Real paths of the files that are hard links to the cache.
+        self._hardlinked_paths = set()
+        # Stats of the whole job, if the greenlet is collecting them.
+        self._job_provisioning_stats = \
+            getattr(_local, "provisioning_stats", None)
+
+        # CPUs the sandboxed processes are pinned to (None for any).
+        self.cpus = getattr(_local, "cpus", None)
+
     def set_multiprocess(self, multiprocess):
         """Set the sandbox to (dis-)allow multiple threads and processes.
 
@@ -360,13 +425,99 @@ class SandboxBase(metaclass=ABCMeta):
     def create_file_from_storage(self, path, digest, executable=False):
         """Write a file taken from FS in the sandbox.
 
+        According to the sandbox_file_provisioning configuration, the
+        file is copied from the cache of the FileCacher, or it is a
+        hard link or a reflink (copy-on-write clone) to it; if linking
+        is not possible (e.g., the cache is on another file system),
+        the file is copied.
+
         path (string): relative path of the file inside the sandbox.
         digest (string): digest of the file in FS.
         executable (bool): to set permissions.
 
         """
-        with self.create_file(path, executable) as dest_fobj:
-            self.file_cacher.get_file_to_fobj(digest, dest_fobj)
+        mode = config.sandbox_file_provisioning
+        if mode == "copy":
+            with self.create_file(path, executable) as dest_fobj:
+                self.file_cacher.get_file_to_fobj(digest, dest_fobj)
+                self._add_provisioned("copied_bytes", dest_fobj.tell())
+            return
+
+        # Keeping the file open prevents the cache from evicting it.
+        with self.file_cacher.get_file(digest) as src_fobj:
+            size = os.fstat(src_fobj.fileno()).st_size
+            if mode == "hardlink" and self.HARDLINKS_ALLOWED \
+                    and self._link_file(path, src_fobj.name, executable):
+                self._add_provisioned("linked_bytes", size)
+                return
+            with self.create_file(path, executable) as dest_fobj:
+                try:
+                    fcntl.ioctl(dest_fobj.fileno(), FICLONE,
+                                src_fobj.fileno())
+                except OSError:
+                    # Not supported by the file system, or different
+                    # file systems.
+                    copyfileobj(src_fobj, dest_fobj, FileCacher.CHUNK_SIZE)
+                    self._add_provisioned("copied_bytes", size)
+                else:
+                    self._add_provisioned("reflinked_bytes", size)
+
+    def _add_provisioned(self, key, size):
+        """Account for some bytes provisioned into the sandbox.
+
+        key (str): the key of the stat to update, e.g. "copied_bytes".
+        size (int): the number of bytes to add (negative to remove).
+
+        """
+        self.provisioning_stats[key] += size
+        if self._job_provisioning_stats is not None:
+            self._job_provisioning_stats[key] += size
+
+    def _link_file(self, path, source_path, executable=False):
+        """Create a read-only hard link in the sandbox.
+
+        path (string): relative path of the file inside the sandbox.
+        source_path (string): the path of the file to link to.
+        executable (bool): to set permissions.
+
+        return (bool): whether the link was created.
+
+        """
+        real_path = self.relative_path(path)
+        try:
+            os.link(source_path, real_path)
+        except OSError:
+            # Typically because they are on different file systems.
+            return False
+        logger.debug("Linked file %s in sandbox.", path)
+        mod = stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH
+        if executable:
+            mod |= stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
+        os.chmod(real_path, mod)
+        self._hardlinked_paths.add(real_path)
+        return True
+
+    def _unlink_from_cache(self, real_path):
+        """Replace a hard link to the cache with a copy of the file.
+
+        To be called before making the file writable, so that the
+        sandboxed processes cannot modify the cache.
+
+        real_path (string): the system path of the file.
+
+        """
+        if real_path not in self._hardlinked_paths:
+            return
+        self._hardlinked_paths.discard(real_path)
+        temp_path = real_path + ".copy"
+        with open(real_path, "rb") as src_fobj, \
+                open(temp_path, "wb") as dest_fobj:
+            copyfileobj(src_fobj, dest_fobj, FileCacher.CHUNK_SIZE)
+        os.chmod(temp_path, stat.S_IMODE(os.stat(real_path).st_mode))
+        os.rename(temp_path, real_path)
+        size = os.stat(real_path).st_size
+        self._add_provisioned("linked_bytes", -size)
+        self._add_provisioned("copied_bytes", size)
 
     def create_file_from_string(self, path, content, executable=False):
         """Write some data to a file in the sandbox.
@@ -718,6 +869,9 @@ class StupidSandbox(SandboxBase):
             if self.chdir:
                 os.chdir(self.chdir)
 
+            if self.cpus:
+                os.sched_setaffinity(0, self.cpus)
+
             # TODO - We're not checking that setrlimit() returns
             # successfully (they may try to set to higher limits than
             # allowed to); anyway, this is just for testing
@@ -844,6 +998,12 @@ class IsolateSandbox(SandboxBase):
 
     """
     next_id = 0
+    # Ids of the boxes of the sandboxes not yet cleaned up.
+    box_ids_in_use = set()
+
+    # Sandboxed processes run as a different user, that can only read
+    # files with the permissions we give to them.
+    HARDLINKS_ALLOWED = True
 
     # If the command line starts with this command name, we are just
     # going to execute it without sandboxing, and with all permissions
@@ -859,18 +1019,29 @@ class IsolateSandbox(SandboxBase):
         SandboxBase.__init__(self, file_cacher, name, temp_dir)
 
         # Isolate only accepts ids between 0 and 999 (by default). We assign
-        # the range [(shard+1)*10, (shard+2)*10) to each Worker and keep the
-        # range [0, 10) for other uses (command-line scripts like cmsMake or
-        # direct console users of isolate). Inside each range ids are assigned
-        # sequentially, with a wrap-around.
+        # the range [(shard+1)*R, (shard+2)*R) to each Worker, where R is
+        # 10 times the number of jobs a Worker executes concurrently, and
+        # keep the range [0, R) for other uses (command-line scripts like
+        # cmsMake or direct console users of isolate). Inside each range ids
+        # are assigned sequentially, with a wrap-around, skipping those of
+        # the sandboxes still in use.
         # FIXME This is the only use of FileCacher.service, and it's an
         # improper use! Avoid it!
+        range_size = 10 * config.worker_parallel_jobs
         if file_cacher is not None and file_cacher.service is not None:
-            box_id = ((file_cacher.service.shard + 1) * 10
-                      + (IsolateSandbox.next_id % 10)) % 1000
+            range_start = (file_cacher.service.shard + 1) * range_size
+        else:
+            range_start = 0
+        for _ in range(range_size):
+            box_id = (range_start
+                      + IsolateSandbox.next_id % range_size) % 1000
+            IsolateSandbox.next_id += 1
+            if box_id not in IsolateSandbox.box_ids_in_use:
+                break
         else:
-            box_id = IsolateSandbox.next_id % 10
-        IsolateSandbox.next_id += 1
+            logger.warning("All the sandbox ids are in use, reusing %d.",
+                           box_id)
+        IsolateSandbox.box_ids_in_use.add(box_id)
 
         # We create a directory "home" inside the outer temporary directory,
         # that will be bind-mounted to "/tmp" inside the sandbox (some
@@ -933,6 +1104,8 @@ class IsolateSandbox(SandboxBase):
         # worker was interrupted in the middle of an execution, so we issue an
         # idempotent cleanup.
         self.cleanup()
+        # The cleanup released the box id, but it is still ours.
+        IsolateSandbox.box_ids_in_use.add(self.box_id)
         self.initialize_isolate()
 
     def add_mapped_directory(self, src, dest=None, options=None,
@@ -964,6 +1137,7 @@ class IsolateSandbox(SandboxBase):
         """
         os.chmod(self._home, 0o777)
         for filename in os.listdir(self._home):
+            self._unlink_from_cache(os.path.join(self._home, filename))
             os.chmod(os.path.join(self._home, filename), 0o777)
 
     def allow_writing_none(self):
@@ -1011,6 +1185,7 @@ class IsolateSandbox(SandboxBase):
         # Close everything, then open only the specified.
         self.allow_writing_none()
         for path in outer_paths:
+            self._unlink_from_cache(path)
             os.chmod(path, 0o722)
 
     def get_root_path(self):
@@ -1329,10 +1504,14 @@ class IsolateSandbox(SandboxBase):
         with open(self.cmd_file, 'at', encoding="utf-8") as commands:
             commands.write("%s\n" % (pretty_print_cmdline(args)))
         os.chmod(self._home, prev_permissions)
+        # Isolate and the sandboxed processes inherit the affinity.
+        preexec_fn = None
+        if self.cpus:
+            preexec_fn = partial(os.sched_setaffinity, 0, self.cpus)
         try:
             p = subprocess.Popen(args,
                                  stdin=stdin, stdout=stdout, stderr=stderr,
-                                 close_fds=close_fds)
+                                 preexec_fn=preexec_fn, close_fds=close_fds)
         except OSError:
             logger.critical("Failed to execute program in sandbox "
                             "with command: %s", pretty_print_cmdline(args),
@@ -1437,6 +1616,7 @@ class IsolateSandbox(SandboxBase):
         # Tell isolate to cleanup the sandbox.
         subprocess.call(exe + ["--cleanup"],
                         stdout=subprocess.DEVNULL, stderr=subprocess.STDOUT)
+        IsolateSandbox.box_ids_in_use.discard(self.box_id)
 
         if delete:
             logger.debug("Deleting sandbox in %s.", self._outer_dir)
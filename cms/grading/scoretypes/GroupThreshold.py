@@ -53,3 +53,7 @@ class GroupThreshold(ScoreTypeGroup):
             return 1.0
         else:
             return 0.0
+
+    def is_doomed(self, outcomes, parameter):
+        """See ScoreTypeGroup."""
+        return self.reduce(outcomes, parameter) == 0.0
@@ -168,6 +168,22 @@ class ScoreType(metaclass=ABCMeta):
         """
         pass
 
+    def get_doomed_testcases(self, unused_outcomes):
+        """Return the testcases that cannot change the score anymore.
+
+        Given the outcomes of the testcases evaluated so far, return
+        those not evaluated yet whose outcome cannot change the score
+        of the submission, so that their evaluation can be skipped
+        (and their outcome set to 0.0).
+
+        unused_outcomes ({str: float}): the outcomes of the testcases
+            evaluated so far, indexed by codename.
+
+        return ({str}): the codenames of the testcases to skip.
+
+        """
+        return set()
+
 
 class ScoreTypeAlone(ScoreType):
     """Intermediate class to manage tasks where the score of a
@@ -438,6 +454,42 @@ class ScoreTypeGroup(ScoreTypeAlone):
 
         return score, subtasks, public_score, public_subtasks, ranking_details
 
+    def get_doomed_testcases(self, outcomes):
+        """See ScoreType.get_doomed_testcases.
+
+        A testcase can be skipped if all the subtasks it belongs to are
+        doomed (see is_doomed). Public testcases are never skipped: the
+        contestants would see them as failed, and learn that a private
+        testcase of the subtask failed.
+
+        """
+        targets = self.retrieve_target_testcases()
+        doomed = set()
+        alive = set()
+        for st_idx, parameter in enumerate(self.parameters):
+            target = targets[st_idx]
+            if self.is_doomed([outcomes[tc_idx] for tc_idx in target
+                               if tc_idx in outcomes], parameter):
+                doomed.update(target)
+            else:
+                alive.update(target)
+        return set(tc_idx for tc_idx in doomed - alive
+                   if tc_idx not in outcomes
+                   and not self.public_testcases[tc_idx])
+
+    def is_doomed(self, unused_outcomes, unused_parameter):
+        """Return whether a subtask will score zero anyway.
+
+        unused_outcomes ([float]): the outcomes of the submission in
+            the testcases of the group evaluated so far.
+        unused_parameter (list): the parameters of the group.
+
+        return (bool): whether the score of the subtask is 0.0 whatever
+            the outcomes in the remaining testcases.
+
+        """
+        return False
+
     @abstractmethod
     def get_public_outcome(self, unused_outcome, unused_parameter):
         """Return a public outcome from an outcome.
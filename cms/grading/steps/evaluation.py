@@ -79,6 +79,11 @@ EVALUATION_MESSAGES = MessageCollection([
                  N_("Execution failed because the return code was nonzero"),
                  N_("Your submission failed because it exited with a return "
                     "code different from 0.")),
+    HumanMessage("skipped",
+                 N_("Not evaluated"),
+                 N_("The testcase was not evaluated, because the score of "
+                    "its subtask was already decided by a testcase that "
+                    "failed.")),
 ])
 
 
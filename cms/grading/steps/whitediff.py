@@ -39,34 +39,72 @@ logger = logging.getLogger(__name__)
 _WHITES = [b' ', b'\t', b'\n', b'\x0b', b'\x0c', b'\r']
 
 
-def _white_diff_canonicalize(string):
-    """Convert the input string to a canonical form for the white diff
-    algorithm; that is, the strings a and b are mapped to the same
-    string by _white_diff_canonicalize() if and only if they have to be
-    considered equivalent for the purposes of the white-diff
-    algorithm.
+# Size of the chunks in which the files are read and compared.
+_CHUNK_SIZE = 1024 * 1024
+
+
+def _white_diff_canonicalize(block):
+    """Convert a block of text to a canonical form for the white diff
+    algorithm; that is, two sequences of lines are mapped to the same
+    string if and only if they have to be considered equivalent for the
+    purposes of the white-diff algorithm (not counting trailing empty
+    lines).
 
     More specifically, this function strips all the leading and
-    trailing whitespaces from s and collapse all the runs of
-    consecutive whitespaces into just one copy of one specific
-    whitespace.
+    trailing whitespaces from each line and collapses all the runs of
+    consecutive whitespaces in a line into just one " ". The block must
+    not split tokens.
 
-    string (str): the string to canonicalize.
-    return (str): the canonicalized string.
+    block (bytes): the block to canonicalize.
+    return (bytes): the canonicalized block.
 
     """
-    # Replace all the whitespaces with copies of " ", making the rest
-    # of the algorithm simpler
-    for char in _WHITES[1:]:
-        string = string.replace(char, _WHITES[0])
+    # Without arguments, split() splits on the ASCII whitespaces, that
+    # are exactly _WHITES.
+    return b"\n".join([b" ".join(line.split())
+                       for line in block.split(b"\n")])
+
+
+def _white_diff_canonical_chunks(fobj):
+    """Read a file in chunks and canonicalize it.
 
-    # Split the string according to " ", filter out empty tokens and
-    # join again the string using just one copy of the first
-    # whitespace; this way, runs of more than one whitespaces are
-    # collapsed into just one copy.
-    string = _WHITES[0].join([x for x in string.split(_WHITES[0])
-                              if len(x) > 0])
-    return string
+    The concatenation of the chunks is the canonical form of the whole
+    file (see _white_diff_canonicalize). Chunks are cut at whitespaces,
+    so that no token is split.
+
+    fobj (file): the file to read, opened in binary mode.
+
+    yield (bytes): the chunks of the canonical form of the file.
+
+    """
+    buffer = bytearray()
+    # Whether the last chunk yielded ended in the middle of a line; if
+    # so, the next token on the same line needs a separator.
+    in_line = False
+    while True:
+        data = fobj.read(_CHUNK_SIZE)
+        if len(data) > 0:
+            # The buffer holds no whitespace before the new data (it
+            # was cut after the last one), so only the latter is
+            # searched, otherwise a long token would be scanned again
+            # at each read.
+            cut = max(data.rfind(char) for char in _WHITES) + 1
+            if cut > 0:
+                cut += len(buffer)
+            buffer += data
+            if cut == 0:
+                continue
+        else:
+            cut = len(buffer)
+        block = _white_diff_canonicalize(bytes(buffer[:cut]))
+        del buffer[:cut]
+        if len(block) > 0:
+            if in_line and not block.startswith(b"\n"):
+                yield b" "
+            yield block
+            in_line = not block.endswith(b"\n")
+        if len(data) == 0:
+            return
 
 
 def _white_diff(output, res):
@@ -80,34 +118,46 @@ def _white_diff(output, res):
     'sequence of characters ending with \n or EOF and beginning right
     after BOF or \n'. In particular, every line has *at most* one \n.
 
+    The files are read and compared in large chunks, stopping at the
+    first difference.
+
     output (file): the first file to compare.
     res (file): the second file to compare.
     return (bool): True if the two file are equal as explained above.
 
     """
+    output_chunks = _white_diff_canonical_chunks(output)
+    res_chunks = _white_diff_canonical_chunks(res)
+    lout = lres = b""
 
     while True:
-        lout = output.readline()
-        lres = res.readline()
-
-        # Both files finished: comparison succeded
-        if len(lres) == 0 and len(lout) == 0:
-            return True
-
-        # Only one file finished: ok if the other contains only blanks
-        elif len(lres) == 0 or len(lout) == 0:
-            lout = lout.strip(b''.join(_WHITES))
-            lres = lres.strip(b''.join(_WHITES))
-            if len(lout) > 0 or len(lres) > 0:
-                return False
-
-        # Both file still have lines to go: ok if they agree except
-        # for the number of whitespaces
-        else:
-            lout = _white_diff_canonicalize(lout)
-            lres = _white_diff_canonicalize(lres)
-            if lout != lres:
-                return False
+        if len(lout) == 0:
+            lout = next(output_chunks, None)
+        if len(lres) == 0:
+            lres = next(res_chunks, None)
+
+        # At least one file finished.
+        if lout is None or lres is None:
+            break
+
+        # Both files still have data to go: compare what they have in
+        # common and keep the rest for the next round.
+        length = min(len(lout), len(lres))
+        if lout[:length] != lres[:length]:
+            return False
+        lout = lout[length:]
+        lres = lres[length:]
+
+    # Comparison succeeded if the other file contains only blank lines.
+    if lout is None:
+        rest, rest_chunks = lres, res_chunks
+    else:
+        rest, rest_chunks = lout, output_chunks
+    while rest is not None:
+        if len(rest.strip(b"\n")) > 0:
+            return False
+        rest = next(rest_chunks, None)
+    return True
 
 
 def white_diff_fobj_step(output_fobj, correct_output_fobj):
@@ -30,7 +30,9 @@ from cms.grading.steps import compilation_step, evaluation_step, \
     human_evaluation_message
 from . import TaskType, \
     check_executables_number, check_files_number, check_manager_present, \
-    create_sandbox, delete_sandbox, eval_output, is_manager_for_compilation
+    create_sandbox, delete_sandbox, eval_output, is_manager_for_compilation, \
+    get_compilation_cache_key, load_cached_compilation, \
+    store_cached_compilation
 
 
 logger = logging.getLogger(__name__)
@@ -218,6 +220,12 @@ class Batch(TaskType):
         commands = language.get_compilation_commands(
             filenames_to_compile, executable_filename)
 
+        # Reuse the result of an identical compilation, if available.
+        cache_key = get_compilation_cache_key(
+            language, commands, filenames_and_digests_to_get)
+        if load_cached_compilation(job, cache_key):
+            return
+
         # Create the sandbox.
         sandbox = create_sandbox(file_cacher, name="compile")
         job.sandboxes.append(sandbox.get_root_path())
@@ -242,6 +250,8 @@ class Batch(TaskType):
             job.executables[executable_filename] = \
                 Executable(executable_filename, digest)
 
+        store_cached_compilation(job, cache_key)
+
         # Cleanup.
         delete_sandbox(sandbox, job.success, job.keep_sandbox)
 
@@ -277,6 +287,17 @@ class Batch(TaskType):
         else:
             files_allowing_write.append(self._actual_output)
 
+        # Fetch at once all the files we might need that are not in the
+        # cache yet, including those needed to check the output.
+        digests_to_load = list(executables_to_get.values()) \
+            + list(files_to_get.values())
+        if not job.only_execution:
+            digests_to_load.append(job.output)
+            if self._uses_checker() and self.CHECKER_CODENAME in job.managers:
+                digests_to_load.append(
+                    job.managers[self.CHECKER_CODENAME].digest)
+        file_cacher.load_many(digests_to_load, if_needed=True)
+
         # Create the sandbox
         sandbox = create_sandbox(file_cacher, name="evaluate")
         job.sandboxes.append(sandbox.get_root_path())
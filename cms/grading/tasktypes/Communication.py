@@ -35,7 +35,9 @@ from cms.grading.steps import compilation_step, evaluation_step_before_run, \
     human_evaluation_message, merge_execution_stats, trusted_step
 from cms.grading.tasktypes import check_files_number
 from . import TaskType, check_executables_number, check_manager_present, \
-    create_sandbox, delete_sandbox, is_manager_for_compilation
+    create_sandbox, delete_sandbox, is_manager_for_compilation, \
+    get_compilation_cache_key, load_cached_compilation, \
+    store_cached_compilation
 
 
 logger = logging.getLogger(__name__)
@@ -209,6 +211,12 @@ class Communication(TaskType):
         commands = language.get_compilation_commands(
             filenames_to_compile, executable_filename)
 
+        # Reuse the result of an identical compilation, if available.
+        cache_key = get_compilation_cache_key(
+            language, commands, filenames_and_digests_to_get)
+        if load_cached_compilation(job, cache_key):
+            return
+
         # Create the sandbox.
         sandbox = create_sandbox(file_cacher, name="compile")
         job.sandboxes.append(sandbox.get_root_path())
@@ -233,6 +241,8 @@ class Communication(TaskType):
             job.executables[executable_filename] = \
                 Executable(executable_filename, digest)
 
+        store_cached_compilation(job, cache_key)
+
         # Cleanup.
         delete_sandbox(sandbox, job.success, job.keep_sandbox)
 
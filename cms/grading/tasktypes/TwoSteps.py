@@ -33,7 +33,8 @@ from cms.grading.steps import compilation_step, evaluation_step_before_run, \
     evaluation_step_after_run, human_evaluation_message, merge_execution_stats
 from . import TaskType, \
     check_executables_number, check_files_number, check_manager_present, \
-    create_sandbox, delete_sandbox, eval_output
+    create_sandbox, delete_sandbox, eval_output, get_compilation_cache_key, \
+    load_cached_compilation, store_cached_compilation
 
 
 logger = logging.getLogger(__name__)
@@ -183,6 +184,12 @@ class TwoSteps(TaskType):
         commands = language.get_compilation_commands(
             source_filenames, executable_filename)
 
+        # Reuse the result of an identical compilation, if available.
+        cache_key = get_compilation_cache_key(
+            language, commands, files_to_get)
+        if load_cached_compilation(job, cache_key):
+            return
+
         # Create the sandbox and put the required files in it.
         sandbox = create_sandbox(file_cacher, name="compile")
         job.sandboxes.append(sandbox.get_root_path())
@@ -207,6 +214,8 @@ class TwoSteps(TaskType):
             job.executables[executable_filename] = \
                 Executable(executable_filename, digest)
 
+        store_cached_compilation(job, cache_key)
+
         # Cleanup
         delete_sandbox(sandbox, job.success, job.keep_sandbox)
 
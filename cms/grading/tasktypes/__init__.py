@@ -27,7 +27,8 @@ from .abc import TaskType
 from .util import create_sandbox, delete_sandbox, \
     is_manager_for_compilation, set_configuration_error, \
     check_executables_number, check_files_number, check_manager_present, \
-    eval_output
+    eval_output, get_compilation_cache_key, load_cached_compilation, \
+    store_cached_compilation
 
 
 logger = logging.getLogger(__name__)
@@ -41,7 +42,8 @@ __all__ = [
     "create_sandbox", "delete_sandbox",
     "is_manager_for_compilation", "set_configuration_error",
     "check_executables_number", "check_files_number", "check_manager_present",
-    "eval_output",
+    "eval_output", "get_compilation_cache_key", "load_cached_compilation",
+    "store_cached_compilation",
 ]
 
 
@@ -32,13 +32,19 @@ compilation and the evaluation are contained in the task type class.
 import logging
 import os
 import shutil
+from collections import OrderedDict
+
+from sqlalchemy.exc import IntegrityError
 
 from cms import config
+from cms.db import SessionGen, CompilationCacheEntry, Executable
 from cms.grading import JobException
 from cms.grading.Job import CompilationJob, EvaluationJob
 from cms.grading.Sandbox import Sandbox
 from cms.grading.steps import EVALUATION_MESSAGES, checker_step, \
     white_diff_fobj_step
+from cmscommon.datetime import make_datetime
+from cmscommon.digest import path_digest
 
 
 logger = logging.getLogger(__name__)
@@ -47,6 +53,16 @@ logger = logging.getLogger(__name__)
 EVAL_USER_OUTPUT_FILENAME = "user_output.txt"
 
 
+# Maximum number of checker outcomes remembered by each process.
+CHECKER_OUTCOME_CACHE_SIZE = 10000
+
+# Outcomes and texts of the successful checker runs, indexed by the
+# digests of the checker, input, correct output and user output, in
+# least recently used order. Checkers are assumed to be deterministic.
+# Type: OrderedDict {(str, str, str, str): (float, [str])}
+_checker_outcomes = OrderedDict()
+
+
 def create_sandbox(file_cacher, name=None):
     """Create a sandbox, and return it.
 
@@ -81,6 +97,13 @@ def delete_sandbox(sandbox, success=True, keep_sandbox=False):
         logger.warning("Sandbox %s kept around because job did not succeed.",
                        sandbox.get_root_path())
 
+    if config.sandbox_file_provisioning != "copy":
+        stats = sandbox.provisioning_stats
+        logger.info("Sandbox %s provisioned with %d bytes copied, %d "
+                    "hard-linked, %d reflinked.", sandbox.get_root_path(),
+                    stats["copied_bytes"], stats["linked_bytes"],
+                    stats["reflinked_bytes"])
+
     delete = success and not config.keep_sandbox and not keep_sandbox
     try:
         sandbox.cleanup(delete=delete)
@@ -109,6 +132,87 @@ def is_manager_for_compilation(filename, language):
                for obj in language.object_extensions))
 
 
+def get_compilation_cache_key(language, commands, files):
+    """Return the key of a compilation in the compilation cache.
+
+    language (Language): the language of the compilation.
+    commands ([[str]]): the compilation commands.
+    files ({str: str}): the digests of the files put in the
+        compilation sandbox, indexed by filename.
+
+    return (str|None): the key, or None if the compilation cache is
+        disabled.
+
+    """
+    if not config.compilation_cache:
+        return None
+    return CompilationCacheEntry.make_key(language.name, commands, files)
+
+
+def load_cached_compilation(job, cache_key):
+    """Fill a compilation job with the cached result of the same
+    compilation, if any.
+
+    job (CompilationJob): the job currently executing.
+    cache_key (str|None): the key of the compilation, as returned by
+        get_compilation_cache_key.
+
+    return (bool): whether the job was filled from the cache.
+
+    """
+    if cache_key is None:
+        return False
+    with SessionGen() as session:
+        entry = session.query(CompilationCacheEntry)\
+            .filter(CompilationCacheEntry.key == cache_key).first()
+        if entry is None:
+            return False
+        job.success = True
+        job.compilation_success = entry.compilation_success
+        job.text = list(entry.text)
+        job.plus = dict(entry.stats)
+        for filename, digest in entry.executables.items():
+            job.executables[filename] = Executable(filename, digest)
+    logger.info("Compilation result taken from the cache.",
+                extra={"operation": job.info})
+    return True
+
+
+def store_cached_compilation(job, cache_key):
+    """Store the result of a compilation job in the cache.
+
+    Only successful compilations are stored: a failure may depend on
+    the conditions of the worker (e.g., a timeout on a loaded machine),
+    and has to be run again when the submission is recompiled. Results
+    of jobs that failed (because of problems of the sandbox) are not
+    stored either.
+
+    job (CompilationJob): the job just executed.
+    cache_key (str|None): the key of the compilation, as returned by
+        get_compilation_cache_key.
+
+    """
+    if cache_key is None or not job.success \
+            or not job.compilation_success:
+        return
+    with SessionGen() as session:
+        session.add(CompilationCacheEntry(
+            key=cache_key,
+            language=job.language,
+            timestamp=make_datetime(),
+            compilation_success=job.compilation_success,
+            text=job.text,
+            stats=job.plus,
+            executables=dict((filename, executable.digest)
+                             for filename, executable
+                             in job.executables.items())))
+        try:
+            session.commit()
+        except IntegrityError:
+            # Another worker stored the same compilation meanwhile.
+            session.rollback()
+
+
 def set_configuration_error(job, msg, *args):
     """Log a configuration error and set the correct results in the job.
 
@@ -240,6 +344,21 @@ def eval_output(file_cacher, job, checker_codename,
         if not check_manager_present(job, checker_codename):
             return False, None, None
 
+        # The digest of the user output lets us reuse the outcome given
+        # by the checker to the same output.
+        if user_output_digest is None:
+            output_digest = path_digest(user_output_path)
+        else:
+            output_digest = user_output_digest
+
+        checker_digest = job.managers[checker_codename].digest \
+            if checker_codename in job.managers else None
+        cache_key = (checker_digest, job.input, job.output, output_digest)
+        if cache_key in _checker_outcomes:
+            _checker_outcomes.move_to_end(cache_key)
+            outcome, text = _checker_outcomes[cache_key]
+            return True, outcome, list(text)
+
         # Create a brand-new sandbox just for checking.
         sandbox = create_sandbox(file_cacher, name="check")
         job.sandboxes.append(sandbox.get_root_path())
@@ -252,22 +371,37 @@ def eval_output(file_cacher, job, checker_codename,
             sandbox.create_file_from_storage(EVAL_USER_OUTPUT_FILENAME,
                                              user_output_digest)
 
-        checker_digest = job.managers[checker_codename].digest \
-            if checker_codename in job.managers else None
         success, outcome, text = checker_step(
             sandbox, checker_digest, job.input, job.output,
             EVAL_USER_OUTPUT_FILENAME)
 
         delete_sandbox(sandbox, success, job.keep_sandbox)
+        if success:
+            _checker_outcomes[cache_key] = (outcome, list(text))
+            if len(_checker_outcomes) > CHECKER_OUTCOME_CACHE_SIZE:
+                _checker_outcomes.popitem(last=False)
         return success, outcome, text
 
     else:
+        # An output identical to the correct one needs no comparison.
+        if user_output_digest == job.output:
+            return True, 1.0, [EVALUATION_MESSAGES.get("success").message]
+
         if user_output_path is not None:
             user_output_fobj = open(user_output_path, "rb")
         else:
             user_output_fobj = file_cacher.get_file(user_output_digest)
         with user_output_fobj:
             with file_cacher.get_file(job.output) as correct_output_fobj:
+                # Hashing a file costs about as much as comparing it,
+                # hence it is done only when the sizes of the local
+                # copies match.
+                if user_output_path is not None \
+                        and os.fstat(user_output_fobj.fileno()).st_size \
+                        == os.fstat(correct_output_fobj.fileno()).st_size \
+                        and path_digest(user_output_path) == job.output:
+                    return True, 1.0, \
+                        [EVALUATION_MESSAGES.get("success").message]
                 outcome, text = white_diff_fobj_step(
                     user_output_fobj, correct_output_fobj)
         return True, outcome, text
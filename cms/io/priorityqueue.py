@@ -36,8 +36,21 @@ between entries with the same priority.
 The queue stores entries in the QueueEntry format, a class that stores
 together the three data point: item, priority, and timestamp.
 
+Optionally, the queue can be fair among groups of items (for example,
+the operations of each contestant): within each priority, the groups
+are served in turn, so that the items of a group that has many are
+interleaved with those of the others, instead of all coming first if
+they are older. This is implemented by giving each entry a "fair tag"
+(a virtual time, as in start-time fair queuing) that is compared right
+after the priority.
+
+The queue can also keep secondary indexes of its items (for example,
+by submission), so that all the items with a given key can be found
+and removed without looking at the others.
+
 """
 
+import heapq
 from functools import total_ordering
 
 from gevent.event import Event
@@ -65,13 +78,15 @@ class QueueEntry:
 
     """
 
-    def __init__(self, item, priority, timestamp, index):
+    def __init__(self, item, priority, timestamp, index, fair_tag=0):
         """Create a QueueEntry object.
 
         item (QueueItem): the payload.
         priority (int): the priority.
         timestamp (datetime): the timestamp of first request.
         index (int): used to enforce strict ordering.
+        fair_tag (int): the turn of the entry among those with the
+            same priority, if the queue is fair, otherwise 0.
 
         """
         # TODO: item is not actually necessary, as we store the whole
@@ -80,16 +95,17 @@ class QueueEntry:
         self.priority = priority
         self.timestamp = timestamp
         self.index = index
+        self.fair_tag = fair_tag
 
     def __eq__(self, other):
         """Return whether self and other have the same priority."""
-        return (self.priority, self.timestamp, self.index) \
-               == (other.priority, other.timestamp, other.index)
+        return (self.priority, self.fair_tag, self.timestamp, self.index) \
+            == (other.priority, other.fair_tag, other.timestamp, other.index)
 
     def __lt__(self, other):
         """Return whether self has higher priority than other."""
-        return (self.priority, self.timestamp, self.index) \
-               < (other.priority, other.timestamp, other.index)
+        return (self.priority, self.fair_tag, self.timestamp, self.index) \
+            < (other.priority, other.fair_tag, other.timestamp, other.index)
 
 
 class PriorityQueue:
@@ -111,8 +127,18 @@ class PriorityQueue:
     PRIORITY_LOW = 3
     PRIORITY_EXTRA_LOW = 4
 
-    def __init__(self):
-        """Create a priority queue."""
+    def __init__(self, group_of=None, index_keys=None):
+        """Create a priority queue.
+
+        group_of (function|None): if given, the queue is fair among
+            the groups of items; the function receives an item and
+            returns its (hashable) group.
+        index_keys ({str: function}|None): the secondary indexes to
+            keep; each function receives an item and returns its
+            (hashable) key in the index, or None to leave the item out
+            of the index.
+
+        """
         # The queue: a min-heap whose elements are of the form
         # (priority, timestamp, item), where item is the actual data.
         self._queue = []
@@ -127,6 +153,18 @@ class PriorityQueue:
         # Index of the next element that will be added to the queue.
         self._next_index = 0
 
+        # For fair queues: for each priority, the fair tag of the last
+        # extracted element and, for each group, the last fair tag
+        # assigned to an element of the group.
+        self._group_of = group_of
+        self._current_tag = {}
+        self._last_tags = {}
+
+        # Secondary indexes: for each name, a dictionary associating
+        # to each key the set of the items in the queue with that key.
+        self._index_keys = index_keys if index_keys is not None else {}
+        self._indexes = dict((name, {}) for name in self._index_keys)
+
     def __len__(self):
         return len(self._queue)
 
@@ -147,6 +185,14 @@ class PriorityQueue:
         for item, idx in self._reverse.items():
             if self._queue[idx].item != item:
                 return False
+        for name, key_of in self._index_keys.items():
+            expected = {}
+            for item in self._reverse:
+                key = key_of(item)
+                if key is not None:
+                    expected.setdefault(key, set()).add(item)
+            if self._indexes[name] != expected:
+                return False
         return True
 
     def __contains__(self, item):
@@ -172,6 +218,31 @@ class PriorityQueue:
         self._reverse[self._queue[idx1].item] = idx1
         self._reverse[self._queue[idx2].item] = idx2
 
+    def _index_add(self, item):
+        """Add an item to the secondary indexes.
+
+        item (QueueItem): the item to add.
+
+        """
+        for name, key_of in self._index_keys.items():
+            key = key_of(item)
+            if key is not None:
+                self._indexes[name].setdefault(key, set()).add(item)
+
+    def _index_remove(self, item):
+        """Remove an item from the secondary indexes.
+
+        item (QueueItem): the item to remove.
+
+        """
+        for name, key_of in self._index_keys.items():
+            key = key_of(item)
+            if key is not None:
+                items = self._indexes[name][key]
+                items.discard(item)
+                if len(items) == 0:
+                    del self._indexes[name][key]
+
     def _up_heap(self, idx):
         """Take the element in position idx up in the heap until its
         position is the right one.
@@ -249,9 +320,20 @@ class PriorityQueue:
         index = self._next_index
         self._next_index += 1
 
-        self._queue.append(QueueEntry(item, priority, timestamp, index))
+        fair_tag = 0
+        if self._group_of is not None:
+            # The entry comes after all others in its group, but not
+            # before the turn currently being served.
+            key = (priority, self._group_of(item))
+            fair_tag = max(self._current_tag.get(priority, 0),
+                           self._last_tags.get(key, 0)) + 1
+            self._last_tags[key] = fair_tag
+
+        self._queue.append(
+            QueueEntry(item, priority, timestamp, index, fair_tag))
         last = len(self._queue) - 1
         self._reverse[item] = last
+        self._index_add(item)
         self._up_heap(last)
 
         # Signal to listener greenlets that there might be something.
@@ -297,6 +379,7 @@ class PriorityQueue:
 
         del self._reverse[top.item]
         del self._queue[last]
+        self._index_remove(top.item)
 
         # last is 0 when the queue becomes empty.
         if last > 0:
@@ -304,8 +387,27 @@ class PriorityQueue:
         else:
             # Signal that there is nothing left for listeners.
             self._event.clear()
+
+        if self._group_of is not None:
+            self._advance_turn(top)
         return top
 
+    def _advance_turn(self, entry):
+        """Record that an entry has been served, for fair queues.
+
+        entry (QueueEntry): the entry extracted from the queue.
+
+        """
+        current = max(self._current_tag.get(entry.priority, 0),
+                      entry.fair_tag)
+        self._current_tag[entry.priority] = current
+        # Forget about the groups that have no entries after the
+        # current turn, as they would get the same tag anyway.
+        if len(self._last_tags) > 2 * len(self._queue) + 100:
+            self._last_tags = dict(
+                (key, tag) for key, tag in self._last_tags.items()
+                if tag > self._current_tag.get(key[0], 0))
+
     def remove(self, item):
         """Remove an item from the queue. Raise a KeyError if not present.
 
@@ -324,6 +426,7 @@ class PriorityQueue:
 
         del self._reverse[item]
         del self._queue[last]
+        self._index_remove(item)
         if pos != last:
             self._updown_heap(pos)
 
@@ -332,6 +435,77 @@ class PriorityQueue:
 
         return entry
 
+    def remove_matching(self, predicate):
+        """Remove all the items satisfying a condition.
+
+        The heap is rebuilt once, so this is much faster than removing
+        the items one by one when they are many.
+
+        predicate (function): receives an item, and returns whether to
+            remove it.
+
+        return ([QueueEntry]): the entries removed.
+
+        """
+        kept = []
+        removed = []
+        for entry in self._queue:
+            if predicate(entry.item):
+                removed.append(entry)
+            else:
+                kept.append(entry)
+        if len(removed) == 0:
+            return removed
+
+        heapq.heapify(kept)
+        self._queue = kept
+        self._reverse = dict(
+            (entry.item, idx) for idx, entry in enumerate(self._queue))
+        for entry in removed:
+            self._index_remove(entry.item)
+        if self.empty():
+            self._event.clear()
+
+        return removed
+
+    def items_by(self, name, key):
+        """Return the items with a given key in a secondary index.
+
+        name (str): the name of the index.
+        key (object): the key to look for.
+
+        return ({QueueItem}): the items in the queue with that key.
+
+        raise (KeyError): if there is no index with that name.
+
+        """
+        return set(self._indexes[name].get(key, ()))
+
+    def remove_by(self, name, key, predicate=None):
+        """Remove all the items with a given key in a secondary index.
+
+        The time needed is proportional to the number of items
+        removed, not to the length of the queue (unless the items
+        removed are a large part of the queue, in which case the heap
+        is rebuilt as in remove_matching).
+
+        name (str): the name of the index.
+        key (object): the key of the items to remove.
+        predicate (function|None): if given, only the items with the
+            key for which it returns true are removed.
+
+        return ([QueueEntry]): the entries removed.
+
+        raise (KeyError): if there is no index with that name.
+
+        """
+        items = self.items_by(name, key)
+        if predicate is not None:
+            items = set(item for item in items if predicate(item))
+        if len(items) > len(self._queue) // 4:
+            return self.remove_matching(lambda item: item in items)
+        return [self.remove(item) for item in items]
+
     def set_priority(self, item, priority):
         """Change the priority of an item inside the queue. Raises an
         exception if the item is not in the queue.
@@ -376,6 +550,27 @@ class PriorityQueue:
                  'timestamp': make_timestamp(entry.timestamp)}
                 for entry in self._queue]
 
+    def get_groups_status(self):
+        """Return the number of entries of each group, for fair queues.
+
+        return ({object: {str: object}}): for each group with entries
+            in the queue, their number (under "length") and the
+            timestamp of the oldest one (under "oldest_timestamp").
+
+        """
+        if self._group_of is None:
+            return {}
+        groups = {}
+        for entry in self._queue:
+            group = self._group_of(entry.item)
+            timestamp = make_timestamp(entry.timestamp)
+            if group not in groups:
+                groups[group] = {"length": 0, "oldest_timestamp": timestamp}
+            groups[group]["length"] += 1
+            groups[group]["oldest_timestamp"] = min(
+                groups[group]["oldest_timestamp"], timestamp)
+        return groups
+
 
 # Fake objects for testing follow.
 
@@ -48,18 +48,24 @@ class Executor(metaclass=ABCMeta):
 
     """
 
-    def __init__(self, batch_executions=False):
+    def __init__(self, batch_executions=False, group_of=None,
+                 index_keys=None):
         """Create an executor.
 
         batch_executions (bool): if True, the executor will receive a
             list of operations in the queue instead of one operation
             at a time.
+        group_of (function|None): if given, the queue is fair among
+            the groups of operations given by this function (see
+            PriorityQueue).
+        index_keys ({str: function}|None): the secondary indexes of
+            the queue (see PriorityQueue).
 
         """
         super().__init__()
 
         self._batch_executions = batch_executions
-        self._operation_queue = PriorityQueue()
+        self._operation_queue = PriorityQueue(group_of, index_keys)
 
     def __contains__(self, item):
         """Return whether the item is in the queue.
@@ -82,6 +88,15 @@ class Executor(metaclass=ABCMeta):
         """
         return self._operation_queue.get_status()
 
+    def get_groups_status(self):
+        """Return the status of the groups in the queue, if fair.
+
+        return ({object: {str: object}}): see
+            PriorityQueue.get_groups_status.
+
+        """
+        return self._operation_queue.get_groups_status()
+
     def enqueue(self, item, priority=None, timestamp=None):
         """Add an item to the queue.
 
@@ -103,6 +118,32 @@ class Executor(metaclass=ABCMeta):
         """
         self._operation_queue.remove(item)
 
+    def dequeue_matching(self, predicate):
+        """Remove all the items satisfying a condition from the queue.
+
+        predicate (function): receives an item, and returns whether to
+            remove it.
+
+        return ([QueueItem]): the items removed.
+
+        """
+        return [entry.item for entry
+                in self._operation_queue.remove_matching(predicate)]
+
+    def dequeue_by(self, name, key, predicate=None):
+        """Remove the items with a key in an index from the queue.
+
+        name (str): the name of the index.
+        key (object): the key of the items to remove.
+        predicate (function|None): if given, receives an item, and
+            returns whether to remove it.
+
+        return ([QueueItem]): the items removed.
+
+        """
+        return [entry.item for entry
+                in self._operation_queue.remove_by(name, key, predicate)]
+
     def run(self):
         """Monitor the queue, and dispatch operations when available.
 
@@ -120,7 +161,9 @@ class Executor(metaclass=ABCMeta):
                 max_operations = self.max_operations_per_batch()
                 while not self._operation_queue.empty() and (
                         max_operations == 0 or
-                        len(to_execute) < max_operations):
+                        len(to_execute) < max_operations) and \
+                        self.can_be_batched(to_execute,
+                                            self._operation_queue.top()):
                     to_execute.append(self._operation_queue.pop())
 
             assert len(to_execute) > 0, "Expected at least one element."
@@ -163,6 +206,22 @@ class Executor(metaclass=ABCMeta):
         """
         return 0
 
+    def can_be_batched(self, batch, entry):
+        """Return whether an entry can be added to a batch.
+
+        If the service has batch executions, this method is called for
+        each entry (in queue order) before adding it to the batch being
+        formed; the batch is closed at the first refusal.
+
+        batch ([QueueEntry]): the entries already in the batch (at
+            least one).
+        entry (QueueEntry): the next entry in the queue.
+
+        return (bool): whether to add the entry to the batch.
+
+        """
+        return True
+
     @abstractmethod
     def execute(self, entry):
         """Perform a single operation.
@@ -273,6 +332,36 @@ class TriggeredService(Service):
         for executor in self._executors:
             executor.dequeue(operation)
 
+    def dequeue_matching(self, predicate):
+        """Remove the operations satisfying a condition from each queue.
+
+        predicate (function): receives an operation, and returns
+            whether to remove it.
+
+        return ({QueueItem}): the operations removed from any queue.
+
+        """
+        removed = set()
+        for executor in self._executors:
+            removed.update(executor.dequeue_matching(predicate))
+        return removed
+
+    def dequeue_by(self, name, key, predicate=None):
+        """Remove the operations with a key in an index from each queue.
+
+        name (str): the name of the index.
+        key (object): the key of the operations to remove.
+        predicate (function|None): if given, receives an operation,
+            and returns whether to remove it.
+
+        return ({QueueItem}): the operations removed from any queue.
+
+        """
+        removed = set()
+        for executor in self._executors:
+            removed.update(executor.dequeue_by(name, key, predicate))
+        return removed
+
     def start_sweeper(self, timeout):
         """Start sweeper loop with given timeout.
 
@@ -31,6 +31,7 @@ from .contest import \
     AddContestHandler, \
     ContestHandler, \
     OverviewHandler, \
+    ClearCompilationCacheHandler, \
     ResourcesListHandler, \
     ContestListHandler, \
     RemoveContestHandler
@@ -113,6 +114,7 @@ HANDLERS = [
     (r"/resources/([0-9]+|all)/([0-9]+)", ResourcesHandler),
     (r"/notifications", NotificationsHandler),
     (r"/file/([a-f0-9]+)/([a-zA-Z0-9_.-]+)", FileFromDigestHandler),
+    (r"/compilation_cache/clear", ClearCompilationCacheHandler),
 
     # Contest
 
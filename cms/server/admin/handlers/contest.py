@@ -29,7 +29,8 @@
 """
 
 from cms import ServiceCoord, get_service_shards, get_service_address
-from cms.db import Contest, Participation, Submission
+from cms.db import CompilationCacheEntry, Contest, Participation, \
+    Submission
 from cmscommon.datetime import make_datetime
 
 from .base import BaseHandler, SimpleContestHandler, SimpleHandler, \
@@ -152,9 +153,27 @@ class OverviewHandler(BaseHandler):
             self.contest = self.safe_get_item(Contest, contest_id)
 
         self.r_params = self.render_params()
+        self.r_params["compilation_cache_size"] = \
+            self.sql_session.query(CompilationCacheEntry).count()
         self.render("overview.html", **self.r_params)
 
 
+class ClearCompilationCacheHandler(BaseHandler):
+    """Remove all the results in the compilation cache, so that the
+    next compilations are run again (e.g., after a compiler upgrade).
+
+    """
+    @require_permission(BaseHandler.PERMISSION_ALL)
+    def post(self):
+        count = self.sql_session.query(CompilationCacheEntry)\
+            .delete(synchronize_session=False)
+        if self.try_commit():
+            self.service.add_notification(
+                make_datetime(), "Compilation cache cleared",
+                "%d compilation results removed." % count)
+        self.write(self.url())
+
+
 class ResourcesListHandler(BaseHandler):
     @require_permission(BaseHandler.AUTHENTICATED)
     def get(self, contest_id=None):
@@ -176,6 +176,8 @@ class TaskHandler(BaseHandler):
                                    "TaskTypeOptions_%d_" % dataset.id)
                 self.get_score_type(attrs, "score_type_%d" % dataset.id,
                                     "score_type_parameters_%d" % dataset.id)
+                attrs["skip_doomed_subtasks"] = bool(self.get_argument(
+                    "skip_doomed_subtasks_%d" % dataset.id, False))
 
                 # Update the dataset.
                 dataset.set_attrs(attrs)
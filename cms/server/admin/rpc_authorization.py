@@ -29,6 +29,7 @@ RPCS_ALLOWED_FOR_AUTHENTICATED = [
     ("ResourceService", "get_resources"),
     ("EvaluationService", "workers_status"),
     ("EvaluationService", "queue_status"),
+    ("EvaluationService", "invalidation_status"),
     ("LogService", "last_messages"),
 ]
 
@@ -41,6 +42,7 @@ RPCS_ALLOWED_FOR_ALL = RPCS_ALLOWED_FOR_MESSAGING + [
     ("ResourceService", "toggle_autorestart"),
     ("EvaluationService", "enable_worker"),
     ("EvaluationService", "disable_worker"),
+    ("EvaluationService", "precache_files"),
     ("EvaluationService", "invalidate_submission"),
     ("ScoringService", "invalidate_submission"),
 ]
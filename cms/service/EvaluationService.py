@@ -31,25 +31,30 @@ the current ranking.
 """
 
 import logging
-from collections import defaultdict
+import os
+from collections import defaultdict, deque
 from datetime import timedelta
 from functools import wraps
 
+import gevent
 import gevent.lock
-from sqlalchemy import func
+from sqlalchemy import func, tuple_
 from sqlalchemy.exc import IntegrityError
 
-from cms import ServiceCoord, get_service_shards
+from cms import ConfigError, config, ServiceCoord, get_service_shards
 from cms.db import SessionGen, Digest, Dataset, Evaluation, Submission, \
     SubmissionResult, Testcase, UserTest, UserTestResult, get_submissions, \
-    get_submission_results, get_datasets_to_judge
-from cms.grading.Job import JobGroup
+    get_submission_results, get_datasets_to_judge, \
+    invalidate_submission_results
+from cms.grading.Job import Job, JobGroup
+from cms.grading.steps import EVALUATION_MESSAGES
 from cms.io import Executor, TriggeredService, rpc_method
-from .esoperations import ESOperation, get_relevant_operations, \
-    get_submissions_operations, get_user_tests_operations, \
-    submission_get_operations, submission_to_evaluate, \
-    user_test_get_operations
+from cmscommon.datetime import make_timestamp, monotonic_time
+from .esoperations import ESOperation, get_submissions_operations, \
+    get_user_tests_operations, submission_get_operations, \
+    submission_to_evaluate, user_test_get_operations
 from .flushingdict import FlushingDict
+from .operationjournal import OperationJournal
 from .workerpool import WorkerPool
 
 
@@ -60,6 +65,22 @@ class EvaluationExecutor(Executor):
 
     # Real maximum number of operations to be sent to a worker.
     MAX_OPERATIONS_PER_BATCH = 25
+    # The batches are formed so that their predicted duration is not
+    # longer than this (in seconds), unless they have one operation.
+    TARGET_BATCH_DURATION = 10.0
+    # How to group the operations for each fair share mode (see
+    # evaluation_fair_share in the configuration).
+    FAIR_SHARE_GROUPS = {
+        "participation": lambda operation: operation.participation_id,
+        "dataset": lambda operation: operation.dataset_id,
+    }
+    # The secondary indexes of the queue, to find quickly all the
+    # operations of a submission or of a dataset.
+    INDEX_KEYS = {
+        "submission": lambda operation: operation.object_id
+        if operation.for_submission() else None,
+        "dataset": lambda operation: operation.dataset_id,
+    }
 
     def __init__(self, evaluation_service):
         """Create the single executor for ES.
@@ -67,14 +88,23 @@ class EvaluationExecutor(Executor):
         The executor just delegates work to the worker pool.
 
         """
-        super().__init__(True)
+        group_of = None
+        if config.evaluation_fair_share is not None:
+            if config.evaluation_fair_share \
+                    not in EvaluationExecutor.FAIR_SHARE_GROUPS:
+                raise ConfigError("Unknown fair share mode %r." %
+                                  config.evaluation_fair_share)
+            group_of = EvaluationExecutor.FAIR_SHARE_GROUPS[
+                config.evaluation_fair_share]
+        super().__init__(True, group_of, EvaluationExecutor.INDEX_KEYS)
 
         self.evaluation_service = evaluation_service
         self.pool = WorkerPool(self.evaluation_service)
 
-        # List of QueueItem (ESOperation) we have extracted from the
-        # queue, but not yet finished to execute.
-        self._currently_executing = []
+        # QueueItems (ESOperations) we have extracted from the queue,
+        # but not yet finished to execute, as the keys of a dictionary
+        # (to keep their order and to look them up in constant time).
+        self._currently_executing = {}
 
         # Lock used to guard the currently executing operations
         self._current_execution_lock = gevent.lock.RLock()
@@ -101,17 +131,42 @@ class EvaluationExecutor(Executor):
         """Return the maximum number of operations per batch.
 
         We derive the number from the length of the queue divided by
-        the number of workers, with a cap at MAX_OPERATIONS_PER_BATCH.
+        the number of active workers, with a cap at
+        MAX_OPERATIONS_PER_BATCH for each job that a worker executes
+        concurrently. Batches can be further limited by their predicted
+        duration, see can_be_batched.
 
         """
-        # TODO: len(self.pool) is the total number of workers,
-        # included those that are disabled.
-        ratio = len(self._operation_queue) // len(self.pool) + 1
-        ret = min(max(ratio, 1), EvaluationExecutor.MAX_OPERATIONS_PER_BATCH)
-        logger.info("Ratio is %d, executing %d operations together.",
+        active_workers = max(self.pool.get_active_workers_count(), 1)
+        ratio = len(self._operation_queue) // active_workers + 1
+        ret = min(max(ratio, 1),
+                  EvaluationExecutor.MAX_OPERATIONS_PER_BATCH
+                  * config.worker_parallel_jobs)
+        logger.info("Ratio is %d, executing up to %d operations together.",
                     ratio, ret)
         return ret
 
+    def can_be_batched(self, batch, entry):
+        """Return whether an entry can be added to a batch.
+
+        Only operations with the same priority are batched together,
+        so that, e.g., compilations are never stuck behind a long list
+        of evaluations; moreover, the predicted duration of the batch
+        must stay within TARGET_BATCH_DURATION.
+
+        batch ([QueueEntry]): the entries already in the batch.
+        entry (QueueEntry): the next entry in the queue.
+
+        return (bool): whether to add the entry to the batch.
+
+        """
+        if entry.priority != batch[0].priority:
+            return False
+        predicted = self.pool.durations.estimate_batch(
+            [e.item for e in batch] + [entry.item],
+            config.worker_parallel_jobs)
+        return predicted <= EvaluationExecutor.TARGET_BATCH_DURATION
+
     def execute(self, entries):
         """Execute a batch of operations in the queue.
 
@@ -123,7 +178,7 @@ class EvaluationExecutor(Executor):
 
         """
         with self._current_execution_lock:
-            self._currently_executing = []
+            self._currently_executing = {}
             for entry in entries:
                 operation = entry.item
                 # Side data is attached to the operation sent to the
@@ -131,15 +186,16 @@ class EvaluationExecutor(Executor):
                 # will return it to us, and we will use it to
                 # re-enqueue it.
                 operation.side_data = (entry.priority, entry.timestamp)
-                self._currently_executing.append(operation)
+                self._currently_executing[operation] = None
         while len(self._currently_executing) > 0:
             self.pool.wait_for_workers()
             with self._current_execution_lock:
                 if len(self._currently_executing) == 0:
                     break
-                res = self.pool.acquire_worker(self._currently_executing)
+                res = self.pool.acquire_worker(
+                    list(self._currently_executing))
                 if res is not None:
-                    self._currently_executing = []
+                    self._currently_executing = {}
                     break
 
     def dequeue(self, operation):
@@ -155,11 +211,58 @@ class EvaluationExecutor(Executor):
             super().dequeue(operation)
         except KeyError:
             with self._current_execution_lock:
-                for i in range(len(self._currently_executing)):
-                    if self._currently_executing[i] == operation:
-                        del self._currently_executing[i]
-                        return
-            raise
+                del self._currently_executing[operation]
+
+    def _dequeue_executing(self, predicate):
+        """Remove the extracted operations satisfying a condition.
+
+        predicate (function): receives an operation, and returns
+            whether to remove it.
+
+        return ([ESOperation]): the operations removed.
+
+        """
+        with self._current_execution_lock:
+            removed = [operation for operation in self._currently_executing
+                       if predicate(operation)]
+            for operation in removed:
+                del self._currently_executing[operation]
+        return removed
+
+    def dequeue_matching(self, predicate):
+        """Remove all the operations satisfying a condition.
+
+        As for dequeue, this includes the operations already extracted
+        but not yet executed.
+
+        predicate (function): receives an operation, and returns
+            whether to remove it.
+
+        return ([ESOperation]): the operations removed.
+
+        """
+        return super().dequeue_matching(predicate) \
+            + self._dequeue_executing(predicate)
+
+    def dequeue_by(self, name, key, predicate=None):
+        """Remove the operations with a key in an index of the queue.
+
+        As for dequeue, this includes the operations already extracted
+        but not yet executed (which are at most a batch).
+
+        name (str): the name of the index (see INDEX_KEYS).
+        key (object): the key of the operations to remove.
+        predicate (function|None): if given, receives an operation,
+            and returns whether to remove it.
+
+        return ([ESOperation]): the operations removed.
+
+        """
+        key_of = EvaluationExecutor.INDEX_KEYS[name]
+        return super().dequeue_by(name, key, predicate) \
+            + self._dequeue_executing(
+                lambda operation: key_of(operation) == key
+                and (predicate is None or predicate(operation)))
 
 
 def with_post_finish_lock(func):
@@ -207,11 +310,18 @@ class EvaluationService(TriggeredService):
     # How often we check if a worker is connected.
     WORKER_CONNECTION_CHECK_TIME = timedelta(seconds=10)
 
+    # How often we check for late workers.
+    WORKER_STRAGGLERS_CHECK_TIME = timedelta(seconds=10)
+
     # How many worker results we accumulate before processing them.
     RESULT_CACHE_SIZE = 100
     # The maximum time since the last result before processing.
     MAX_FLUSHING_TIME_SECONDS = 2
 
+    # Number of invalidated submissions whose operations are enqueued
+    # at a time.
+    INVALIDATION_ENQUEUE_CHUNK = 100
+
     def __init__(self, shard, contest_id=None):
         super().__init__(shard)
 
@@ -250,7 +360,37 @@ class EvaluationService(TriggeredService):
         self.scoring_service = self.connect_to(
             ServiceCoord("ScoringService", 0))
 
+        # The sweeper normally only looks at the submissions and user
+        # tests with id at least the watermark (one per kind of object,
+        # see _missing_operations); a full sweep, looking at all of
+        # them, is done at startup and when requested.
+        self._full_sweep_needed = True
+        self._sweep_watermarks = {"submissions": 0, "user_tests": 0}
+        self._sweep_max_ids = {"submissions": None, "user_tests": None}
+        self._last_sweep = None
+
+        # Submissions invalidated whose operations are still to be
+        # enqueued, by a greenlet, in chunks (see _enqueue_invalidated).
+        self._invalidated_queue = deque()
+        self._invalidated_pending = set()
+        self._invalidation_progress = None
+        self._enqueue_invalidated_greenlet = None
+
         self.add_executor(EvaluationExecutor(self))
+
+        # Journal of the operations enqueued and not yet written to the
+        # DB; the ones pending when ES stopped are enqueued right away,
+        # the sweeper will only need to find those missing from it.
+        self.journal = None
+        if config.persistent_evaluation_queue:
+            self.journal = OperationJournal(os.path.join(
+                config.data_dir, "evaluation_queue_%d.journal" % shard))
+            operations = self.journal.load()
+            for operation, priority, timestamp in operations:
+                self.enqueue(operation, priority, timestamp)
+            logger.info("Restored %d operations from the journal.",
+                        len(operations))
+
         self.start_sweeper(117.0)
 
         self.add_timeout(self.check_workers_timeout, None,
@@ -261,6 +401,10 @@ class EvaluationService(TriggeredService):
                          EvaluationService.WORKER_CONNECTION_CHECK_TIME
                          .total_seconds(),
                          immediately=False)
+        self.add_timeout(self.check_workers_stragglers, None,
+                         EvaluationService.WORKER_STRAGGLERS_CHECK_TIME
+                         .total_seconds(),
+                         immediately=False)
 
     def submission_enqueue_operations(self, submission):
         """Push in queue the operations required by a submission.
@@ -316,21 +460,100 @@ class EvaluationService(TriggeredService):
         evaluated for no good reasons. Put the missing operation in
         the queue.
 
+        Apart from full sweeps, only the objects with id at least the
+        watermark are considered. After each sweep, the watermark is
+        moved to the lowest id of an object that still has operations
+        to do, but not after the objects that were not there at the
+        previous sweep (so that each object is looked at by at least
+        two sweeps, even if it was committed late).
+
         """
+        full = self._full_sweep_needed
+        self._full_sweep_needed = False
+        start_time = monotonic_time()
         counter = 0
-        with SessionGen() as session:
+        rows = 0
+        try:
+            with SessionGen() as session:
+                for kind, cls, get_operations in [
+                        ("submissions", Submission,
+                         get_submissions_operations),
+                        ("user_tests", UserTest, get_user_tests_operations)]:
+                    max_id = session.query(func.max(cls.id)).scalar() or 0
+                    min_id = None if full else self._sweep_watermarks[kind]
+                    watermark = self._sweep_max_ids[kind]
+                    watermark = max_id + 1 if watermark is None \
+                        else watermark + 1
+                    for operation, priority, timestamp in get_operations(
+                            session, self.contest_id, min_id):
+                        rows += 1
+                        watermark = min(watermark, operation.object_id)
+                        if self.enqueue(operation, priority, timestamp):
+                            counter += 1
+                    self._sweep_watermarks[kind] = watermark
+                    self._sweep_max_ids[kind] = max_id
+        except Exception:
+            # Do not lose the request for a full sweep.
+            self._full_sweep_needed = self._full_sweep_needed or full
+            raise
 
-            for operation, timestamp, priority in \
-                    get_submissions_operations(session, self.contest_id):
-                if self.enqueue(operation, timestamp, priority):
-                    counter += 1
+        self._last_sweep = {
+            "full": full,
+            "duration": monotonic_time() - start_time,
+            "rows": rows,
+            "operations": counter,
+            "watermarks": dict(self._sweep_watermarks),
+        }
+        logger.info("%s sweep looked at %d missing operation(s) in %.3f s.",
+                    "Full" if full else "Incremental", rows,
+                    self._last_sweep["duration"])
+        return counter
 
-            for operation, timestamp, priority in \
-                    get_user_tests_operations(session, self.contest_id):
-                if self.enqueue(operation, timestamp, priority):
-                    counter += 1
+    @rpc_method
+    def search_operations_not_done(self, full=True):
+        """Make the sweeper loop fire the sweeper as soon as possible.
 
-        return counter
+        full (bool): whether the sweep should look at all submissions
+            and user tests, and not only at the recent ones.
+
+        """
+        if full:
+            self._full_sweep_needed = True
+        super().search_operations_not_done()
+
+    @rpc_method
+    def sweeper_status(self):
+        """Return statistics on the last sweep.
+
+        return ({str: object}|None): whether the sweep was full, its
+            duration in seconds, the number of rows (i.e., operations
+            still to do) it found, the number of operations it added
+            to the queue, and the watermarks for the next sweep; None
+            if no sweep has been done yet.
+
+        """
+        return self._last_sweep
+
+    @rpc_method
+    def fair_share_status(self):
+        """Return the status of the groups in the queue.
+
+        Groups are formed according to the fair share mode (see
+        evaluation_fair_share in the configuration).
+
+        return ({str: {str: object}}): for each group with operations
+            in the queue, their number (under "length") and how long
+            the oldest one has been waiting (under "max_waiting_time",
+            in seconds); empty if the queue is not fair.
+
+        """
+        now = make_timestamp()
+        return dict(
+            (str(group), {"length": status["length"],
+                          "max_waiting_time":
+                              now - status["oldest_timestamp"]})
+            for group, status
+            in self.get_executor().get_groups_status().items())
 
     @rpc_method
     def workers_status(self):
@@ -343,6 +566,35 @@ class EvaluationService(TriggeredService):
         """
         return self.get_executor().pool.get_status()
 
+    @rpc_method
+    def speculation_status(self):
+        """Return the counters of the late batches given to a second
+        worker. See WorkerPool.get_speculation_status.
+
+        return ({str: int}): the counters.
+
+        """
+        return self.get_executor().pool.get_speculation_status()
+
+    @rpc_method
+    def precache_files(self, contest_id=None):
+        """Ask all connected workers to precache the files of a contest.
+
+        contest_id (int|None): the id of the contest; if None, the
+            contest this service is running for.
+
+        returns (bool): True if the request was forwarded to the
+            workers, False if no contest was given.
+
+        """
+        if contest_id is None:
+            contest_id = self.contest_id
+        if contest_id is None:
+            logger.warning("Asked to precache files without a contest.")
+            return False
+        self.get_executor().pool.precache_files(contest_id)
+        return True
+
     def check_workers_timeout(self):
         """We ask WorkerPool for the unresponsive workers, and we put
         again their operations in the queue.
@@ -356,6 +608,15 @@ class EvaluationService(TriggeredService):
             self.enqueue(operation, priority, timestamp)
         return True
 
+    @with_post_finish_lock
+    def check_workers_stragglers(self):
+        """We ask WorkerPool to give the operations of the late
+        workers also to the idle ones.
+
+        """
+        self.get_executor().pool.check_stragglers()
+        return True
+
     def check_workers_connection(self):
         """We ask WorkerPool for the unconnected workers, and we put
         again their operations in the queue.
@@ -387,7 +648,11 @@ class EvaluationService(TriggeredService):
             return False
 
         # enqueue() returns the number of successful pushes.
-        return super().enqueue(operation, priority, timestamp) > 0
+        if super().enqueue(operation, priority, timestamp) == 0:
+            return False
+        if self.journal is not None:
+            self.journal.add(operation, priority, timestamp)
+        return True
 
     @with_post_finish_lock
     def action_finished(self, data, shard, error=None):
@@ -429,16 +694,59 @@ class EvaluationService(TriggeredService):
         if job_group_success:
             for job in job_group.jobs:
                 operation = job.operation
-                if job.success:
-                    logger.info("`%s' succeeded.", operation)
-                else:
-                    logger.error("`%s' failed, see worker logs and (possibly) "
-                                 "sandboxes at '%s'.",
-                                 operation, " ".join(job.sandboxes))
                 if isinstance(to_ignore, list) and operation in to_ignore:
                     logger.info("`%s' result ignored as requested", operation)
                 else:
-                    self.result_cache.add(operation, Result(job, job.success))
+                    self._add_result(job, shard)
+
+    @rpc_method
+    @with_post_finish_lock
+    def job_finished(self, job, shard):
+        """RPC from a worker, to send the result of a single job as soon
+        as it is finished, before the rest of its job group.
+
+        The result goes directly to the result cache, and the operation
+        is not assigned to the worker anymore; its result will be
+        ignored when the complete job group arrives.
+
+        job (dict): the Job, exported to dict.
+        shard (int): the shard of the worker.
+
+        """
+        try:
+            job = Job.import_from_dict_with_type(job)
+        except Exception:
+            logger.error("Couldn't build Job for data %s.", job,
+                         exc_info=True)
+            return
+
+        if not self.get_executor().pool.operation_finished(
+                shard, job.operation):
+            logger.info("Ignored partial result for `%s' from worker %s.",
+                        job.operation, shard)
+            return
+        self._add_result(job, shard)
+
+    def _add_result(self, job, shard):
+        """Put the result of a job in the result cache.
+
+        job (Job): a job executed by a worker.
+        shard (int): the shard of the worker.
+
+        """
+        operation = job.operation
+        if not self.get_executor().pool.claim_result(
+                shard, operation, job.success):
+            logger.info("`%s' failed on worker %s, waiting for the other "
+                        "worker executing it.", operation, shard)
+            return
+        if job.success:
+            logger.info("`%s' succeeded.", operation)
+        else:
+            logger.error("`%s' failed, see worker logs and (possibly) "
+                         "sandboxes at '%s'.",
+                         operation, " ".join(job.sandboxes))
+        self.result_cache.add(operation, Result(job, job.success))
 
     @with_post_finish_lock
     def write_results(self, items):
@@ -446,9 +754,10 @@ class EvaluationService(TriggeredService):
 
         Grouping results together by object (i.e., submission result
         or user test result) and type (compilation or evaluation)
-        allows this method to talk less to the DB, for example by
-        retrieving datasets and submission results only once instead
-        of once for every result.
+        allows this method to talk less to the DB: all datasets,
+        objects and results involved are retrieved with a few queries,
+        and the evaluations of successful jobs (the vast majority of
+        the results) are inserted all at once.
 
         items ([(operation, Result)]): the results received by ES but
             not yet written to the db.
@@ -465,79 +774,417 @@ class EvaluationService(TriggeredService):
             by_object_and_type[t].append((operation, result))
 
         with SessionGen() as session:
+            object_results = self.get_object_results(
+                session, by_object_and_type.keys(), create=True)
+            testcases = self.get_testcase_ids(
+                session, set(dataset_id for type_, _, dataset_id
+                             in by_object_and_type.keys()
+                             if type_ == ESOperation.EVALUATION))
+
+            new_evaluations = []
             for key, operation_results in by_object_and_type.items():
                 type_, object_id, dataset_id = key
-
-                dataset = Dataset.get_from_id(dataset_id, session)
-                if dataset is None:
-                    logger.error("Could not find dataset %d in the database.",
-                                 dataset_id)
+                object_result = object_results.get(key)
+                if object_result is None:
                     continue
 
-                # Get submission or user test results.
-                if type_ in [ESOperation.COMPILATION, ESOperation.EVALUATION]:
-                    object_ = Submission.get_from_id(object_id, session)
-                    if object_ is None:
-                        logger.error("Could not find submission %d "
-                                     "in the database.", object_id)
-                        continue
-                    object_result = object_.get_result_or_create(dataset)
-                else:
-                    object_ = UserTest.get_from_id(object_id, session)
-                    if object_ is None:
-                        logger.error("Could not find user test %d "
-                                     "in the database.", object_id)
-                        continue
-                    object_result = object_.get_result_or_create(dataset)
+                # Successful evaluations are written in bulk later.
+                if type_ == ESOperation.EVALUATION:
+                    new_evaluations.extend(
+                        (object_result, operation, result)
+                        for operation, result in operation_results
+                        if result.job_success)
+                    operation_results = [
+                        (operation, result)
+                        for operation, result in operation_results
+                        if not result.job_success]
 
                 self.write_results_one_object_and_type(
                     session, object_result, operation_results)
 
+            self.write_evaluations(session, new_evaluations, testcases)
+            self.skip_doomed_evaluations(
+                session,
+                [object_results[key] for key in by_object_and_type.keys()
+                 if key[0] == ESOperation.EVALUATION
+                 and key in object_results],
+                testcases)
+
             logger.info("Committing evaluations...")
             session.commit()
 
-            num_testcases_per_dataset = dict()
-            for type_, object_id, dataset_id in by_object_and_type.keys():
-                if type_ == ESOperation.EVALUATION:
-                    if dataset_id not in num_testcases_per_dataset:
-                        num_testcases_per_dataset[dataset_id] = session\
-                            .query(func.count(Testcase.id))\
-                            .filter(Testcase.dataset_id == dataset_id).scalar()
-                    num_evaluations = session\
-                        .query(func.count(Evaluation.id)) \
-                        .filter(Evaluation.dataset_id == dataset_id) \
-                        .filter(Evaluation.submission_id == object_id).scalar()
-                    if num_evaluations == num_testcases_per_dataset[dataset_id]:
-                        submission_result = SubmissionResult.get_from_id(
-                            (object_id, dataset_id), session)
-                        submission_result.set_evaluation_outcome()
+            # The operations are done, new ones (e.g., to retry them)
+            # might be enqueued later.
+            if self.journal is not None:
+                for operation, _ in items:
+                    self.journal.remove(operation)
+
+            evaluated = set((object_id, dataset_id)
+                            for type_, object_id, dataset_id
+                            in by_object_and_type.keys()
+                            if type_ == ESOperation.EVALUATION)
+            num_evaluations = self.count_evaluations(session, evaluated)
+            for object_id, dataset_id in evaluated:
+                submission_result = object_results.get(
+                    (ESOperation.EVALUATION, object_id, dataset_id))
+                if submission_result is not None and \
+                        num_evaluations.get((object_id, dataset_id), 0) \
+                        == len(testcases[dataset_id]):
+                    submission_result.set_evaluation_outcome()
 
             logger.info("Committing evaluation outcomes...")
             session.commit()
 
             logger.info("Ending operations for %s objects...",
                         len(by_object_and_type))
-            for type_, object_id, dataset_id in by_object_and_type.keys():
+            # Refresh all the results (expired by the commit) at once.
+            object_results = self.get_object_results(
+                session, by_object_and_type.keys())
+            for key in by_object_and_type.keys():
+                type_ = key[0]
+                object_result = object_results.get(key)
+                if object_result is None:
+                    continue
                 if type_ == ESOperation.COMPILATION:
-                    submission_result = SubmissionResult.get_from_id(
-                        (object_id, dataset_id), session)
-                    self.compilation_ended(submission_result)
+                    self.compilation_ended(object_result)
                 elif type_ == ESOperation.EVALUATION:
-                    submission_result = SubmissionResult.get_from_id(
-                        (object_id, dataset_id), session)
-                    if submission_result.evaluated():
-                        self.evaluation_ended(submission_result)
+                    if object_result.evaluated():
+                        self.evaluation_ended(object_result)
                 elif type_ == ESOperation.USER_TEST_COMPILATION:
-                    user_test_result = UserTestResult.get_from_id(
-                        (object_id, dataset_id), session)
-                    self.user_test_compilation_ended(user_test_result)
+                    self.user_test_compilation_ended(object_result)
                 elif type_ == ESOperation.USER_TEST_EVALUATION:
-                    user_test_result = UserTestResult.get_from_id(
-                        (object_id, dataset_id), session)
-                    self.user_test_evaluation_ended(user_test_result)
+                    self.user_test_evaluation_ended(object_result)
 
         logger.info("Done")
 
+    @staticmethod
+    def get_object_results(session, keys, create=False):
+        """Retrieve the submission and user test results of many objects.
+
+        session (Session): the DB session to use.
+        keys ([(str, int, int)]): the operation type, the id of the
+            object and the id of the dataset of each result.
+        create (bool): whether to create the results that are not in
+            the DB yet.
+
+        return ({(str, int, int): SubmissionResult|UserTestResult}):
+            the results found (or created), indexed by their key.
+
+        """
+        submission_types = [ESOperation.COMPILATION, ESOperation.EVALUATION]
+
+        def get_class(type_):
+            if type_ in submission_types:
+                return SubmissionResult
+            return UserTestResult
+
+        keys = list(keys)
+        found = dict()
+        for cls, id_column in [
+                (SubmissionResult, SubmissionResult.submission_id),
+                (UserTestResult, UserTestResult.user_test_id)]:
+            pairs = set((object_id, dataset_id)
+                        for type_, object_id, dataset_id in keys
+                        if get_class(type_) is cls)
+            if len(pairs) == 0:
+                continue
+            for result in session.query(cls)\
+                    .filter(tuple_(id_column, cls.dataset_id)
+                            .in_(list(pairs))).all():
+                found[(cls, getattr(result, id_column.key),
+                       result.dataset_id)] = result
+
+        missing = []
+        object_results = dict()
+        for key in keys:
+            type_, object_id, dataset_id = key
+            result_key = (get_class(type_), object_id, dataset_id)
+            if result_key in found:
+                object_results[key] = found[result_key]
+            elif create:
+                missing.append(key)
+        if len(missing) == 0:
+            return object_results
+
+        datasets = EvaluationService._get_by_id(
+            session, Dataset, set(key[2] for key in missing))
+        submissions = EvaluationService._get_by_id(
+            session, Submission, set(key[1] for key in missing
+                                     if key[0] in submission_types))
+        user_tests = EvaluationService._get_by_id(
+            session, UserTest, set(key[1] for key in missing
+                                   if key[0] not in submission_types))
+        for key in missing:
+            type_, object_id, dataset_id = key
+            result_key = (get_class(type_), object_id, dataset_id)
+            # Compilation and evaluation of the same submission share
+            # the result, make sure to create it only once.
+            if result_key in found:
+                object_results[key] = found[result_key]
+                continue
+            dataset = datasets.get(dataset_id)
+            if dataset is None:
+                logger.error("Could not find dataset %d in the database.",
+                             dataset_id)
+                continue
+            if type_ in submission_types:
+                submission = submissions.get(object_id)
+                if submission is None:
+                    logger.error("Could not find submission %d "
+                                 "in the database.", object_id)
+                    continue
+                found[result_key] = SubmissionResult(
+                    submission=submission, dataset=dataset)
+            else:
+                user_test = user_tests.get(object_id)
+                if user_test is None:
+                    logger.error("Could not find user test %d "
+                                 "in the database.", object_id)
+                    continue
+                found[result_key] = UserTestResult(
+                    user_test=user_test, dataset=dataset)
+            object_results[key] = found[result_key]
+
+        return object_results
+
+    @staticmethod
+    def _get_by_id(session, cls, ids):
+        """Retrieve many objects of the same class from their ids.
+
+        session (Session): the DB session to use.
+        cls (type): the class of the objects.
+        ids ({int}): the ids of the objects.
+
+        return ({int: Base}): the objects found, indexed by id.
+
+        """
+        if len(ids) == 0:
+            return dict()
+        return dict((object_.id, object_) for object_ in session.query(cls)
+                    .filter(cls.id.in_(list(ids))).all())
+
+    @staticmethod
+    def get_testcase_ids(session, dataset_ids):
+        """Retrieve the ids of the testcases of some datasets.
+
+        session (Session): the DB session to use.
+        dataset_ids ({int}): the ids of the datasets.
+
+        return ({int: {str: int}}): for each dataset, the ids of its
+            testcases indexed by codename.
+
+        """
+        testcases = dict((dataset_id, dict()) for dataset_id in dataset_ids)
+        if len(dataset_ids) == 0:
+            return testcases
+        for dataset_id, codename, testcase_id in session\
+                .query(Testcase.dataset_id, Testcase.codename, Testcase.id)\
+                .filter(Testcase.dataset_id.in_(list(dataset_ids))).all():
+            testcases[dataset_id][codename] = testcase_id
+        return testcases
+
+    @staticmethod
+    def count_evaluations(session, keys):
+        """Count the evaluations of some submission results.
+
+        session (Session): the DB session to use.
+        keys ({(int, int)}): the submission and dataset ids of the
+            submission results.
+
+        return ({(int, int): int}): the number of evaluations of the
+            submission results that have any, indexed by their key.
+
+        """
+        if len(keys) == 0:
+            return dict()
+        return dict(((submission_id, dataset_id), count)
+                    for submission_id, dataset_id, count in session
+                    .query(Evaluation.submission_id, Evaluation.dataset_id,
+                           func.count(Evaluation.id))
+                    .filter(tuple_(Evaluation.submission_id,
+                                   Evaluation.dataset_id).in_(list(keys)))
+                    .group_by(Evaluation.submission_id,
+                              Evaluation.dataset_id).all())
+
+    def write_evaluations(self, session, new_evaluations, testcases):
+        """Write to the DB the evaluations of successful jobs.
+
+        The evaluations are inserted with a single statement; if that
+        fails (for example because some of them have already been
+        written) they are inserted one by one, ignoring the failures.
+
+        session (Session): the DB session to use.
+        new_evaluations ([(SubmissionResult, ESOperation, Result)]):
+            the evaluations to write, with the submission results they
+            belong to.
+        testcases ({int: {str: int}}): for each dataset, the ids of its
+            testcases indexed by codename.
+
+        """
+        rows = []
+        for submission_result, operation, result in new_evaluations:
+            testcase_id = testcases.get(operation.dataset_id, {}).get(
+                operation.testcase_codename)
+            if testcase_id is None:
+                logger.error("Could not find testcase %s of dataset %d "
+                             "in the database.", operation.testcase_codename,
+                             operation.dataset_id)
+                continue
+            try:
+                row = result.job.get_evaluation_values()
+            except Exception:
+                # See write_results_one_object_and_type.
+                logger.error("Unexpected exception while preparing worker "
+                             "result for %s.", operation, exc_info=True)
+                continue
+            row["submission_id"] = submission_result.submission_id
+            row["dataset_id"] = submission_result.dataset_id
+            row["testcase_id"] = testcase_id
+            rows.append((operation, row))
+        self.insert_evaluations(session, rows)
+
+    @staticmethod
+    def insert_evaluations(session, rows):
+        """Insert evaluations in the DB.
+
+        session (Session): the DB session to use.
+        rows ([(ESOperation, dict)]): the operations and the values of
+            the columns of their evaluations.
+
+        """
+        if len(rows) == 0:
+            return
+
+        logger.info("Writing %d evaluations to db.", len(rows))
+        # The submission results must be in the DB for the foreign keys.
+        session.flush()
+        try:
+            with session.begin_nested():
+                session.execute(Evaluation.__table__.insert().values(
+                    [row for _, row in rows]))
+            return
+        except Exception:
+            logger.info("Error while inserting %d evaluations at once, "
+                        "inserting them one by one.", len(rows),
+                        exc_info=True)
+
+        for operation, row in rows:
+            try:
+                with session.begin_nested():
+                    session.execute(Evaluation.__table__.insert().values(row))
+            except IntegrityError:
+                logger.warning(
+                    "Integrity error while inserting worker result for %s.",
+                    operation, exc_info=True)
+            except Exception:
+                logger.error(
+                    "Unexpected exception while inserting worker result "
+                    "for %s.", operation, exc_info=True)
+
+    def skip_doomed_evaluations(self, session, submission_results,
+                                testcases):
+        """Skip the evaluations that cannot change the score anymore.
+
+        For the datasets where this is enabled (skip_doomed_subtasks),
+        the score type tells which testcases cannot change the score
+        given the outcomes so far (see
+        ScoreType.get_doomed_testcases). Their operations are removed
+        from the queue and the workers, and they get an evaluation
+        with outcome 0.0 marking them as skipped.
+
+        session (Session): the DB session to use.
+        submission_results ([SubmissionResult]): the submission results
+            that just received new evaluations.
+        testcases ({int: {str: int}}): for each dataset, the ids of its
+            testcases indexed by codename.
+
+        """
+        submission_results = [sr for sr in submission_results
+                              if sr.dataset.skip_doomed_subtasks]
+        if len(submission_results) == 0:
+            return
+        outcomes = self.get_evaluation_outcomes(
+            session, set((sr.submission_id, sr.dataset_id)
+                         for sr in submission_results))
+
+        rows = []
+        for submission_result in submission_results:
+            submission_id = submission_result.submission_id
+            dataset_id = submission_result.dataset_id
+            try:
+                doomed = submission_result.dataset.score_type_object\
+                    .get_doomed_testcases(
+                        outcomes.get((submission_id, dataset_id), {}))
+            except Exception:
+                logger.error("Could not find the evaluations to skip for "
+                             "submission %d on dataset %d.", submission_id,
+                             dataset_id, exc_info=True)
+                continue
+            # Results already received will be written anyway.
+            doomed = set(
+                codename for codename in doomed
+                if codename in testcases[dataset_id]
+                and ESOperation(ESOperation.EVALUATION, submission_id,
+                                dataset_id, codename)
+                not in self.result_cache)
+            if len(doomed) == 0:
+                continue
+
+            def is_doomed(operation):
+                return operation.type_ == ESOperation.EVALUATION \
+                    and operation.dataset_id == dataset_id \
+                    and operation.testcase_codename in doomed
+
+            operations = self.dequeue_by(
+                "submission", submission_id, is_doomed)
+            operations.update(self.get_executor().pool
+                              .ignore_operations_matching(is_doomed))
+            if self.journal is not None:
+                for operation in operations:
+                    self.journal.remove(operation)
+            logger.info("Skipping %d evaluations of submission %d on "
+                        "dataset %d.", len(doomed), submission_id,
+                        dataset_id)
+
+            for codename in sorted(doomed):
+                rows.append((
+                    ESOperation(ESOperation.EVALUATION, submission_id,
+                                dataset_id, codename),
+                    {"submission_id": submission_id,
+                     "dataset_id": dataset_id,
+                     "testcase_id": testcases[dataset_id][codename],
+                     "outcome": "0.0",
+                     "text": [EVALUATION_MESSAGES.get("skipped").message]}))
+        self.insert_evaluations(session, rows)
+
+    @staticmethod
+    def get_evaluation_outcomes(session, keys):
+        """Retrieve the outcomes of the evaluations of some results.
+
+        session (Session): the DB session to use.
+        keys ({(int, int)}): the submission and dataset ids of the
+            submission results.
+
+        return ({(int, int): {str: float}}): for each submission
+            result, the outcomes of its evaluations indexed by the
+            codename of the testcase.
+
+        """
+        outcomes = dict((key, dict()) for key in keys)
+        if len(keys) == 0:
+            return outcomes
+        for submission_id, dataset_id, codename, outcome in session\
+                .query(Evaluation.submission_id, Evaluation.dataset_id,
+                       Testcase.codename, Evaluation.outcome)\
+                .join(Testcase, Evaluation.testcase_id == Testcase.id)\
+                .filter(tuple_(Evaluation.submission_id,
+                               Evaluation.dataset_id).in_(list(keys)))\
+                .all():
+            if outcome is not None:
+                outcomes[(submission_id, dataset_id)][codename] = \
+                    float(outcome)
+        return outcomes
+
     def write_results_one_object_and_type(
             self, session, object_result, operation_results):
         """Write to the DB the results for one object and type.
@@ -881,64 +1528,143 @@ class EvaluationService(TriggeredService):
             if dataset_id is not None and task_id is None \
                     and submission_id is None:
                 task_id = Dataset.get_from_id(dataset_id, session).task_id
-            # First we load all involved submissions.
-            submissions = get_submissions(
-                session,
-                # Give contest_id only if all others are None.
-                contest_id
-                if {participation_id, task_id, submission_id} == {None}
-                else None,
-                participation_id, task_id, submission_id).all()
-
-            # Then we get all relevant operations, and we remove them
-            # both from the queue and from the pool (i.e., we ignore
-            # the workers involved in those operations).
-            operations = get_relevant_operations(
-                level, submissions, dataset_id)
-            for operation in operations:
-                try:
-                    self.dequeue(operation)
-                except KeyError:
-                    pass  # Ok, the operation wasn't in the queue.
-                try:
-                    self.get_executor().pool.ignore_operation(operation)
-                except LookupError:
-                    pass  # Ok, the operation wasn't in the pool.
+            # First we find all involved submissions.
+            submission_ids = set(
+                id_ for id_, in get_submissions(
+                    session,
+                    # Give contest_id only if all others are None.
+                    contest_id
+                    if {participation_id, task_id, submission_id} == {None}
+                    else None,
+                    participation_id, task_id, submission_id)
+                .with_entities(Submission.id).all())
+
+            # Then we remove all relevant operations both from the
+            # queue and from the pool (i.e., we ignore the workers
+            # involved in those operations).
+            def is_relevant(operation):
+                return operation.for_submission() \
+                    and operation.object_id in submission_ids \
+                    and (dataset_id is None
+                         or operation.dataset_id == dataset_id) \
+                    and (level == "compilation"
+                         or operation.type_ == ESOperation.EVALUATION)
+
+            # The indexes of the queue give the operations of a dataset
+            # or of a submission without looking at the others.
+            if dataset_id is not None and submission_id is None:
+                operations = self.dequeue_by(
+                    "dataset", dataset_id, is_relevant)
+            else:
+                operations = set()
+                for id_ in submission_ids:
+                    operations.update(self.dequeue_by(
+                        "submission", id_, is_relevant))
+            operations.update(self.get_executor().pool
+                              .ignore_operations_matching(is_relevant))
+            if self.journal is not None:
+                for operation in operations:
+                    self.journal.remove(operation)
+            logger.info("Removed %d operations from the queue and the "
+                        "workers.", len(operations))
 
             # Then we find all existing results in the database, and
-            # we remove them.
-            submission_results = get_submission_results(
+            # we invalidate them.
+            count = invalidate_submission_results(
                 session,
-                # Give contest_id only if all others are None.
-                contest_id
-                if {participation_id,
-                    task_id,
-                    submission_id,
-                    dataset_id} == {None}
-                else None,
-                participation_id,
-                # Provide the task_id only if the entire task has to be
-                # reevaluated and not only a specific dataset.
-                task_id if dataset_id is None else None,
-                submission_id, dataset_id).all()
-            logger.info("Submission results to invalidate %s for: %d.",
-                        level, len(submission_results))
-            for submission_result in submission_results:
-                # We invalidate the appropriate data and queue the
-                # operations to recompute those data.
-                if level == "compilation":
-                    submission_result.invalidate_compilation()
-                elif level == "evaluation":
-                    submission_result.invalidate_evaluation()
-
-            # Finally, we re-enqueue the operations for the
-            # submissions.
-            for submission in submissions:
-                self.submission_enqueue_operations(submission)
-
+                get_submission_results(
+                    session,
+                    # Give contest_id only if all others are None.
+                    contest_id
+                    if {participation_id,
+                        task_id,
+                        submission_id,
+                        dataset_id} == {None}
+                    else None,
+                    participation_id,
+                    # Provide the task_id only if the entire task has
+                    # to be reevaluated and not only a specific dataset.
+                    task_id if dataset_id is None else None,
+                    submission_id, dataset_id),
+                level)
+            logger.info("Submission results invalidated %s for: %d.",
+                        level, count)
             session.commit()
+
+        # Finally, we re-enqueue the operations for the submissions,
+        # a few at a time.
+        self._enqueue_invalidated(submission_ids)
+        logger.info("Invalidation done, enqueuing the operations of %d "
+                    "submissions.", len(submission_ids))
+
+    def _enqueue_invalidated(self, submission_ids):
+        """Enqueue (in the background) the operations of submissions.
+
+        submission_ids ({int}): the ids of the submissions.
+
+        """
+        new_ids = sorted(submission_ids - self._invalidated_pending)
+        self._invalidated_pending.update(new_ids)
+        self._invalidated_queue.extend(new_ids)
+        if self._invalidation_progress is None or \
+                self._invalidation_progress["end_time"] is not None:
+            self._invalidation_progress = {
+                "total": 0,
+                "done": 0,
+                "start_time": make_timestamp(),
+                "end_time": None,
+            }
+        self._invalidation_progress["total"] += len(new_ids)
+        if self._enqueue_invalidated_greenlet is None or \
+                self._enqueue_invalidated_greenlet.dead:
+            self._enqueue_invalidated_greenlet = gevent.spawn(
+                self._enqueue_invalidated_loop)
+
+    def _enqueue_invalidated_loop(self):
+        """Enqueue the operations of the invalidated submissions.
+
+        The submissions are processed INVALIDATION_ENQUEUE_CHUNK at a
+        time, each chunk with its own session and holding the post
+        finish lock only while processing it, so that results can be
+        written in between.
+
+        """
+        progress = self._invalidation_progress
+        while len(self._invalidated_queue) > 0:
+            chunk = []
+            while len(self._invalidated_queue) > 0 and \
+                    len(chunk) < EvaluationService.INVALIDATION_ENQUEUE_CHUNK:
+                chunk.append(self._invalidated_queue.popleft())
+            try:
+                with self.post_finish_lock, SessionGen() as session:
+                    for submission in session.query(Submission)\
+                            .filter(Submission.id.in_(chunk)).all():
+                        self.submission_enqueue_operations(submission)
+                    session.commit()
+            except Exception:
+                # The sweeper will find them eventually.
+                logger.error("Error while enqueuing the operations of "
+                             "invalidated submissions.", exc_info=True)
+            self._invalidated_pending.difference_update(chunk)
+            progress["done"] += len(chunk)
+            logger.info("Enqueued the operations of %d/%d invalidated "
+                        "submissions.", progress["done"], progress["total"])
+            gevent.sleep(0)
+        progress["end_time"] = make_timestamp()
         logger.info("Invalidate successfully completed.")
 
+    @rpc_method
+    def invalidation_status(self):
+        """Return the progress of the last invalidation.
+
+        return ({str: object}|None): the number of submissions to
+            enqueue again ("total") and of those already processed
+            ("done"), and the start and end time (None if still in
+            progress); None if nothing was invalidated yet.
+
+        """
+        return self._invalidation_progress
+
     @rpc_method
     def disable_worker(self, shard):
         """Disable a specific worker (recovering its assigned operations).
@@ -994,7 +1720,8 @@ class EvaluationService(TriggeredService):
         tuple. Generally, we will see only one evaluate operation for
         each submission in the queue status with the number of
         testcase which will be evaluated next. Moreover, we pass also
-        the number of testcases in the queue.
+        the number of testcases in the queue, and their total predicted
+        duration (in seconds) in the field predicted_duration.
 
         The entries are then ordered by priority and timestamp (the
         same criteria used to look at what to complete next).
@@ -1008,11 +1735,15 @@ class EvaluationService(TriggeredService):
             key = (str(entry["item"]["type"]),
                    str(entry["item"]["object_id"]),
                    str(entry["item"]["dataset_id"]))
+            predicted = self.get_executor().pool.durations.estimate(
+                ESOperation.from_dict(entry["item"]))
             if key in entries_by_key:
                 entries_by_key[key]["item"]["multiplicity"] += 1
+                entries_by_key[key]["predicted_duration"] += predicted
             else:
                 entries_by_key[key] = entry
                 entries_by_key[key]["item"]["multiplicity"] = 1
+                entries_by_key[key]["predicted_duration"] = predicted
         return sorted(
             entries_by_key.values(),
             key=lambda x: (x["priority"], x["timestamp"]))
@@ -25,13 +25,21 @@
 """
 
 import logging
+import os
 import time
 
+import gevent
+import gevent.event
 import gevent.lock
+import gevent.pool
+import gevent.queue
 
+from cms import config, ServiceCoord
 from cms.db import SessionGen, Contest, enumerate_files
 from cms.db.filecacher import FileCacher, TombstoneError
 from cms.grading import JobException
+from cms.grading.Sandbox import collect_provisioning_stats, \
+    set_sandbox_cpus
 from cms.grading.Job import CompilationJob, EvaluationJob, JobGroup
 from cms.grading.tasktypes import get_task_type
 from cms.io import Service, rpc_method
@@ -51,6 +59,11 @@ class Worker(Service):
     JOB_TYPE_COMPILATION = "compile"
     JOB_TYPE_EVALUATION = "evaluate"
 
+    # Seconds between two log messages about the precaching progress.
+    PRECACHE_LOG_INTERVAL = 10.0
+    # Number of files requested to the backend at once when precaching.
+    PRECACHE_BATCH_SIZE = 16
+
     def __init__(self, shard, fake_worker_time=None):
         Service.__init__(self, shard)
         self.file_cacher = FileCacher(self)
@@ -63,10 +76,67 @@ class Worker(Service):
 
         self._fake_worker_time = fake_worker_time
 
+        # Used to send the results of the jobs as soon as they finish.
+        self.evaluation_service = self.connect_to(
+            ServiceCoord("EvaluationService", 0), must_be_present=False)
+
+        self._precache_lock = gevent.lock.Semaphore()
+        self._precache_progress = None
+
+        # The jobs of a group are executed concurrently, each using one
+        # of these slots; each slot has the set of CPUs its sandboxes
+        # are pinned to (or None).
+        self._slot_cpus = self._assign_cpus(config.worker_parallel_jobs)
+        self._free_slots = gevent.queue.Queue()
+        for slot in range(len(self._slot_cpus)):
+            self._free_slots.put(slot)
+
+    def _assign_cpus(self, parallel_jobs):
+        """Choose the CPUs for each of the concurrent jobs.
+
+        If pinning is enabled, each slot gets a different CPU among
+        those available to the process; Workers on the same host use
+        different CPUs as long as there are enough for all.
+
+        parallel_jobs (int): the number of jobs executed concurrently.
+
+        return ([{int}|None]): for each slot, the CPUs to use.
+
+        """
+        if not config.worker_pin_cpus:
+            return [None] * parallel_jobs
+        cpus = sorted(os.sched_getaffinity(0))
+        if parallel_jobs > len(cpus):
+            logger.warning("Only %d CPUs available for %d parallel jobs.",
+                           len(cpus), parallel_jobs)
+        first = self.shard * parallel_jobs
+        return [{cpus[(first + slot) % len(cpus)]}
+                for slot in range(parallel_jobs)]
+
     @rpc_method
     def precache_files(self, contest_id):
         """RPC to ask the worker to precache of files in the contest.
 
+        The files of the datasets that are automatically judged are
+        downloaded first, then the others. Files are requested to the
+        backend in batches, and up to precache_concurrency batches (see
+        the configuration) are downloaded at the same time.
+
+        contest_id (int): the id of the contest
+
+        """
+        if not self._precache_lock.acquire(blocking=False):
+            logger.warning("Precaching already in progress, ignoring "
+                           "request for contest %d.", contest_id)
+            return
+        try:
+            self._precache_files(contest_id)
+        finally:
+            self._precache_lock.release()
+
+    def _precache_files(self, contest_id):
+        """Do the work of precache_files, holding the lock.
+
         contest_id (int): the id of the contest
 
         """
@@ -77,22 +147,95 @@ class Worker(Service):
         logger.info("Precaching files for contest %d.", contest_id)
         with SessionGen() as session:
             contest = Contest.get_from_id(contest_id, session)
-            files = enumerate_files(session, contest, skip_submissions=True,
-                                    skip_user_tests=True, skip_print_jobs=True)
-        for digest in files:
-            try:
-                self.file_cacher.load(digest, if_needed=True)
-            except KeyError:
-                # No problem (at this stage) if we cannot find the
-                # file
-                pass
-
+            judged_files = enumerate_files(
+                session, contest, skip_submissions=True,
+                skip_user_tests=True, skip_print_jobs=True,
+                skip_unjudged_datasets=True)
+            other_files = enumerate_files(
+                session, contest, skip_submissions=True,
+                skip_user_tests=True, skip_print_jobs=True) - judged_files
+        files = sorted(judged_files) + sorted(other_files)
+
+        progress = {
+            "contest_id": contest_id,
+            "total": len(files),
+            "done": 0,
+            "downloaded": 0,
+            "downloaded_bytes": 0,
+            "start_time": time.time(),
+            "end_time": None,
+        }
+        self._precache_progress = progress
+        last_log_time = progress["start_time"]
+
+        pool = gevent.pool.Pool(config.precache_concurrency)
+        for i in range(0, len(files), Worker.PRECACHE_BATCH_SIZE):
+            # This blocks until one of the concurrent downloads is done.
+            pool.spawn(self._precache_batch,
+                       files[i:i + Worker.PRECACHE_BATCH_SIZE], progress)
+            now = time.time()
+            if now - last_log_time >= Worker.PRECACHE_LOG_INTERVAL:
+                last_log_time = now
+                self._log_precache_progress(progress, now)
+        pool.join()
+
+        progress["end_time"] = time.time()
         logger.info("Precaching finished.")
+        self._log_precache_progress(progress, progress["end_time"])
+
+    def _precache_batch(self, digests, progress):
+        """Download a batch of files for precache_files.
+
+        digests ([str]): the digests of the files to download.
+        progress (dict): the progress data to update.
+
+        """
+        try:
+            sizes = self.file_cacher.load_many(digests, if_needed=True)
+        except Exception:
+            # No problem (at this stage) if we cannot get the files.
+            logger.warning("Error while precaching files %s.",
+                           ", ".join(digests), exc_info=True)
+            sizes = dict()
+        progress["done"] += len(digests)
+        progress["downloaded"] += len(sizes)
+        progress["downloaded_bytes"] += sum(sizes.values())
+
+    @staticmethod
+    def _log_precache_progress(progress, now):
+        """Log the progress and the throughput of the precaching.
+
+        progress (dict): the progress data.
+        now (float): the current timestamp.
+
+        """
+        elapsed = max(now - progress["start_time"], 1e-6)
+        logger.info("Precached %d/%d files (%d downloaded, %.1f MiB) in "
+                    "%.1f s (%.2f MiB/s).",
+                    progress["done"], progress["total"],
+                    progress["downloaded"],
+                    progress["downloaded_bytes"] / 2**20, elapsed,
+                    progress["downloaded_bytes"] / 2**20 / elapsed)
+
+    @rpc_method
+    def cache_status(self):
+        """RPC to return statistics on the local file cache.
+
+        return ({str: object}): the statistics returned by
+            FileCacher.get_cache_stats(), plus the progress of the last
+            precaching (None if never requested) under "precache".
+
+        """
+        status = self.file_cacher.get_cache_stats()
+        status["precache"] = self._precache_progress
+        return status
 
     @rpc_method
     def execute_job_group(self, job_group_dict):
-        """Receive a group of jobs in a list format and executes them one by
-        one.
+        """Receive a group of jobs in a list format and executes them.
+
+        Up to worker_parallel_jobs jobs (see the configuration) are
+        executed at the same time, each in its own sandboxes.
 
         job_group_dict ({}): a JobGroup exported to dict.
 
@@ -106,26 +249,27 @@ class Worker(Service):
         if self.work_lock.acquire(False):
             try:
                 logger.info("Starting job group.")
-                for job in job_group.jobs:
-                    logger.info("Starting job.",
-                                extra={"operation": job.info})
-
-                    job.shard = self.shard
-
-                    if self._fake_worker_time is None:
-                        task_type = get_task_type(job.task_type,
-                                                  job.task_type_parameters)
-                        try:
-                            task_type.execute_job(job, self.file_cacher)
-                        except TombstoneError:
-                            job.success = False
-                            job.plus = {"tombstone": True}
-                    else:
-                        self._fake_work(job)
-
-                    logger.info("Finished job.",
-                                extra={"operation": job.info})
-
+                pool = gevent.pool.Pool(len(self._slot_cpus))
+                failed = gevent.event.Event()
+                try:
+                    # Spawning blocks until a slot is free.
+                    # With more than one job, send each result as soon
+                    # as it is ready, so that ES doesn't have to wait
+                    # for the whole group (and doesn't lose the result
+                    # if something goes wrong with the rest).
+                    stream = len(job_group.jobs) > 1
+                    greenlets = [pool.spawn(self._execute_job, job, stream,
+                                            failed)
+                                 for job in job_group.jobs]
+                    gevent.joinall(greenlets, raise_error=True)
+                except BaseException:
+                    # Killing the running jobs would leave their
+                    # sandboxes (and isolate box ids) behind: the jobs
+                    # not started yet are skipped, and the others are
+                    # left to finish.
+                    failed.set()
+                    pool.join()
+                    raise
                 logger.info("Finished job group.")
                 return job_group.export_to_dict()
 
@@ -147,9 +291,57 @@ class Worker(Service):
             self._finalize(start_time)
             raise JobException(err_msg)
 
+    def _execute_job(self, job, stream=False, failed=None):
+        """Execute a single job, using one of the free slots.
+
+        job (Job): the job to execute, that is filled with the results.
+        stream (bool): whether to send the result to ES right away.
+        failed (gevent.event.Event|None): set when another job of the
+            group failed, in which case the job is not executed (and
+            left unsuccessful); it is set by this job if it fails.
+
+        """
+        slot = self._free_slots.get()
+        if failed is not None and failed.is_set():
+            self._free_slots.put(slot)
+            return
+        try:
+            logger.info("Starting job.", extra={"operation": job.info})
+            set_sandbox_cpus(self._slot_cpus[slot])
+            provisioning_stats = collect_provisioning_stats()
+
+            job.shard = self.shard
+
+            if self._fake_worker_time is None:
+                task_type = get_task_type(job.task_type,
+                                          job.task_type_parameters)
+                try:
+                    task_type.execute_job(job, self.file_cacher)
+                except TombstoneError:
+                    job.success = False
+                    job.plus = {"tombstone": True}
+            else:
+                self._fake_work(job)
+
+            # Travels with the other stats of the job to ES.
+            if job.plus is not None:
+                job.plus["provisioning_stats"] = dict(provisioning_stats)
+
+            logger.info("Finished job.", extra={"operation": job.info})
+        except Exception:
+            if failed is not None:
+                failed.set()
+            raise
+        finally:
+            self._free_slots.put(slot)
+
+        if stream:
+            self.evaluation_service.job_finished(
+                job=job.export_to_dict(), shard=self.shard)
+
     def _fake_work(self, job):
         """Fill the job with fake success data after waiting for some time."""
-        time.sleep(self._fake_worker_time)
+        gevent.sleep(self._fake_worker_time)
         job.success = True
         job.text = ["ok"]
         job.plus = {
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+# Copyright © 2026 agent <agent@local>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Estimates of the time needed by the workers to execute operations.
+
+"""
+
+from .esoperations import ESOperation
+
+
+class DurationEstimator:
+    """Keep rolling estimates of the duration of the operations.
+
+    Durations are estimated separately for each operation type and
+    dataset (as, e.g., the evaluations on the testcases of a task all
+    take similar times), falling back to an estimate for the operation
+    type when a dataset has not been seen yet. Estimates are updated
+    with exponential moving averages from the measured durations of
+    the batches of operations executed by the workers.
+
+    """
+
+    # Weight of a new measurement in the moving averages.
+    SMOOTHING = 0.2
+
+    # Initial estimates for each operation type, in seconds.
+    DEFAULT_DURATIONS = {
+        ESOperation.COMPILATION: 5.0,
+        ESOperation.EVALUATION: 1.0,
+        ESOperation.USER_TEST_COMPILATION: 5.0,
+        ESOperation.USER_TEST_EVALUATION: 1.0,
+    }
+
+    def __init__(self):
+        # Type: {(str, int): float}
+        self._by_dataset = dict()
+        # Type: {str: float}
+        self._by_type = dict(DurationEstimator.DEFAULT_DURATIONS)
+
+    def estimate(self, operation):
+        """Return the expected duration of an operation.
+
+        operation (ESOperation): the operation.
+
+        return (float): the expected duration, in seconds.
+
+        """
+        key = (operation.type_, operation.dataset_id)
+        if key in self._by_dataset:
+            return self._by_dataset[key]
+        return self._by_type.get(operation.type_, 1.0)
+
+    def estimate_batch(self, operations, parallelism=1):
+        """Return the expected duration of a batch of operations.
+
+        operations ([ESOperation]): the operations in the batch.
+        parallelism (int): how many operations the worker executes at
+            the same time.
+
+        return (float): the expected duration, in seconds.
+
+        """
+        if len(operations) == 0:
+            return 0.0
+        total = sum(self.estimate(operation) for operation in operations)
+        return total / min(parallelism, len(operations))
+
+    def update(self, operations, duration, parallelism=1):
+        """Update the estimates with the duration of a batch.
+
+        The duration is attributed to the operations in proportion to
+        their current estimates.
+
+        operations ([ESOperation]): the operations in the batch.
+        duration (float): the time the worker took, in seconds.
+        parallelism (int): how many operations the worker executed at
+            the same time.
+
+        """
+        predicted = self.estimate_batch(operations, parallelism)
+        if predicted <= 0.0:
+            return
+        ratio = duration / predicted
+        weight = DurationEstimator.SMOOTHING
+        new_by_dataset = dict()
+        new_by_type = dict()
+        for operation in operations:
+            key = (operation.type_, operation.dataset_id)
+            new_by_dataset[key] = self.estimate(operation) * ratio
+            new_by_type[operation.type_] = \
+                self._by_type.get(operation.type_, 1.0) * ratio
+        for key, measured in new_by_dataset.items():
+            if key not in self._by_dataset:
+                # First measurement for the dataset, nothing to average.
+                self._by_dataset[key] = measured
+                continue
+            old = self._by_dataset[key]
+            self._by_dataset[key] = (1 - weight) * old + weight * measured
+        for type_, measured in new_by_type.items():
+            old = self._by_type.get(type_, 1.0)
+            self._by_type[type_] = (1 - weight) * old + weight * measured
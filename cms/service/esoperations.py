@@ -26,6 +26,7 @@ compute sets of operations to do.
 
 """
 
+import itertools
 import logging
 
 from sqlalchemy import case, literal
@@ -43,6 +44,10 @@ MAX_EVALUATION_TRIES = 3
 MAX_USER_TEST_COMPILATION_TRIES = 3
 MAX_USER_TEST_EVALUATION_TRIES = 3
 
+# Number of rows fetched from the database at a time when looking for
+# the operations to do.
+SWEEP_BATCH_SIZE = 1000
+
 
 FILTER_SUBMISSION_DATASETS_TO_JUDGE = (
     (Dataset.id == Task.active_dataset_id) |
@@ -172,7 +177,8 @@ def submission_get_operations(submission_result, submission, dataset):
 
         yield ESOperation(ESOperation.COMPILATION,
                           submission.id,
-                          dataset.id), \
+                          dataset.id,
+                          participation_id=submission.participation_id), \
             priority, \
             submission.timestamp
 
@@ -193,7 +199,8 @@ def submission_get_operations(submission_result, submission, dataset):
                 yield ESOperation(ESOperation.EVALUATION,
                                   submission.id,
                                   dataset.id,
-                                  testcase_codename), \
+                                  testcase_codename,
+                                  submission.participation_id), \
                     priority, \
                     submission.timestamp
 
@@ -222,7 +229,8 @@ def user_test_get_operations(user_test, dataset):
 
         yield ESOperation(ESOperation.USER_TEST_COMPILATION,
                           user_test.id,
-                          dataset.id), \
+                          dataset.id,
+                          participation_id=user_test.participation_id), \
             priority, \
             user_test.timestamp
 
@@ -236,70 +244,37 @@ def user_test_get_operations(user_test, dataset):
 
         yield ESOperation(ESOperation.USER_TEST_EVALUATION,
                           user_test.id,
-                          dataset.id), \
+                          dataset.id,
+                          participation_id=user_test.participation_id), \
             priority, \
             user_test.timestamp
 
 
-def get_relevant_operations(level, submissions, dataset_id=None):
-    """Return all possible operations involving the submissions
-
-    level (string): the starting level; if 'compilation', then we
-        return operations for both compilation and evaluation; if
-        'evaluation', we return evaluations only.
-    submissions ([Submission]): submissions we want the operations for.
-    dataset_id (int|None): id of the dataset to select, or None for all
-        datasets
-
-    return ([ESOperation]): list of relevant operations.
-
-    """
-    operations = []
-    for submission in submissions:
-        # All involved datasets: all of the task's dataset unless
-        # one was specified.
-        datasets = submission.task.datasets
-        if dataset_id is not None:
-            for dataset in submission.task.datasets:
-                if dataset.id == dataset_id:
-                    datasets = [dataset]
-                    break
-
-        # For each submission and dataset, the operations are: one
-        # compilation, and one evaluation per testcase.
-        for dataset in datasets:
-            if level == 'compilation':
-                operations.append(ESOperation(
-                    ESOperation.COMPILATION,
-                    submission.id,
-                    dataset.id))
-            for codename in dataset.testcases:
-                operations.append(ESOperation(
-                    ESOperation.EVALUATION,
-                    submission.id,
-                    dataset.id,
-                    codename))
-
-    return operations
-
-
-def get_submissions_operations(session, contest_id=None):
+def get_submissions_operations(session, contest_id=None,
+                               min_submission_id=None):
     """Return all the operations to do for submissions in the contest.
 
+    The rows are fetched from the database a batch at a time, so the
+    operations must be consumed while the session is still open.
+
     session (Session): the database session to use.
     contest_id (int|None): the contest for which we want the operations.
         If none, get operations for any contest.
+    min_submission_id (int|None): if given, only look at submissions
+        with at least this id.
 
-    return ([ESOperation, float, int]): a list of operation, timestamp
-        and priority.
+    return (iterable of (ESOperation, int, datetime)): the operations,
+        with their priority and timestamp.
 
     """
-    operations = []
-
     if contest_id is None:
         contest_filter = literal(True)
     else:
         contest_filter = Task.contest_id == contest_id
+    if min_submission_id is None:
+        id_filter = literal(True)
+    else:
+        id_filter = Submission.id >= min_submission_id
 
     # Retrieve the compilation operations for all submissions without
     # the corresponding result for a dataset to judge. Since we have
@@ -313,7 +288,7 @@ def get_submissions_operations(session, contest_id=None):
                    (Dataset.id == SubmissionResult.dataset_id) &
                    (Submission.id == SubmissionResult.submission_id))\
         .filter(
-            contest_filter &
+            contest_filter & id_filter &
             (FILTER_SUBMISSION_DATASETS_TO_JUDGE) &
             (SubmissionResult.dataset_id.is_(None)))\
         .with_entities(Submission.id, Dataset.id,
@@ -321,17 +296,18 @@ def get_submissions_operations(session, contest_id=None):
                            (Dataset.id != Task.active_dataset_id,
                             literal(PriorityQueue.PRIORITY_EXTRA_LOW))
                            ], else_=literal(PriorityQueue.PRIORITY_HIGH)),
-                       Submission.timestamp)\
-        .all()
+                       Submission.timestamp,
+                       Submission.participation_id)\
+        .yield_per(SWEEP_BATCH_SIZE)
 
     # Retrieve all the compilation operations for submissions
     # already having a result for a dataset to judge.
-    to_compile += session.query(Submission)\
+    to_recompile = session.query(Submission)\
         .join(Submission.task)\
         .join(Submission.results)\
         .join(SubmissionResult.dataset)\
         .filter(
-            contest_filter &
+            contest_filter & id_filter &
             (FILTER_SUBMISSION_DATASETS_TO_JUDGE) &
             (FILTER_SUBMISSION_RESULTS_TO_COMPILE))\
         .with_entities(Submission.id, Dataset.id,
@@ -341,14 +317,17 @@ def get_submissions_operations(session, contest_id=None):
                            (SubmissionResult.compilation_tries == 0,
                             literal(PriorityQueue.PRIORITY_HIGH))
                            ], else_=literal(PriorityQueue.PRIORITY_MEDIUM)),
-                       Submission.timestamp)\
-        .all()
+                       Submission.timestamp,
+                       Submission.participation_id)\
+        .yield_per(SWEEP_BATCH_SIZE)
 
-    for data in to_compile:
-        submission_id, dataset_id, priority, timestamp = data
-        operations.append((
-            ESOperation(ESOperation.COMPILATION, submission_id, dataset_id),
-            priority, timestamp))
+    for data in itertools.chain(to_compile, to_recompile):
+        submission_id, dataset_id, priority, timestamp, participation_id = \
+            data
+        yield (
+            ESOperation(ESOperation.COMPILATION, submission_id, dataset_id,
+                        participation_id=participation_id),
+            priority, timestamp)
 
     # Retrieve all the evaluation operations for a dataset to
     # judge. Again we need to pick all tuples (submission, dataset,
@@ -365,7 +344,7 @@ def get_submissions_operations(session, contest_id=None):
                    (Evaluation.dataset_id == Dataset.id) &
                    (Evaluation.testcase_id == Testcase.id))\
         .filter(
-            contest_filter &
+            contest_filter & id_filter &
             (FILTER_SUBMISSION_DATASETS_TO_JUDGE) &
             (FILTER_SUBMISSION_RESULTS_TO_EVALUATE) &
             (Evaluation.id.is_(None)))\
@@ -377,36 +356,45 @@ def get_submissions_operations(session, contest_id=None):
                             literal(PriorityQueue.PRIORITY_MEDIUM))
                            ], else_=literal(PriorityQueue.PRIORITY_LOW)),
                        Submission.timestamp,
-                       Testcase.codename)\
-        .all()
+                       Testcase.codename,
+                       Submission.participation_id)\
+        .yield_per(SWEEP_BATCH_SIZE)
 
     for data in to_evaluate:
-        submission_id, dataset_id, priority, timestamp, codename = data
-        operations.append((
+        submission_id, dataset_id, priority, timestamp, codename, \
+            participation_id = data
+        yield (
             ESOperation(
-                ESOperation.EVALUATION, submission_id, dataset_id, codename),
-            priority, timestamp))
+                ESOperation.EVALUATION, submission_id, dataset_id, codename,
+                participation_id),
+            priority, timestamp)
 
-    return operations
 
-
-def get_user_tests_operations(session, contest_id=None):
+def get_user_tests_operations(session, contest_id=None,
+                              min_user_test_id=None):
     """Return all the operations to do for user tests in the contest.
 
+    The rows are fetched from the database a batch at a time, so the
+    operations must be consumed while the session is still open.
+
     session (Session): the database session to use.
     contest_id (int|None): the contest for which we want the operations.
         If none, get operations for any contest.
+    min_user_test_id (int|None): if given, only look at user tests
+        with at least this id.
 
-    return ([ESOperation, float, int]): a list of operation, timestamp
-        and priority.
+    return (iterable of (ESOperation, int, datetime)): the operations,
+        with their priority and timestamp.
 
     """
-    operations = []
-
     if contest_id is None:
         contest_filter = literal(True)
     else:
         contest_filter = Task.contest_id == contest_id
+    if min_user_test_id is None:
+        id_filter = literal(True)
+    else:
+        id_filter = UserTest.id >= min_user_test_id
 
     # Retrieve the compilation operations for all user tests without
     # the corresponding result for a dataset to judge. Since we have
@@ -420,7 +408,7 @@ def get_user_tests_operations(session, contest_id=None):
                    (Dataset.id == UserTestResult.dataset_id) &
                    (UserTest.id == UserTestResult.user_test_id))\
         .filter(
-            contest_filter &
+            contest_filter & id_filter &
             (FILTER_USER_TEST_DATASETS_TO_JUDGE) &
             (UserTestResult.dataset_id.is_(None)))\
         .with_entities(UserTest.id, Dataset.id,
@@ -428,17 +416,18 @@ def get_user_tests_operations(session, contest_id=None):
                            (Dataset.id != Task.active_dataset_id,
                             literal(PriorityQueue.PRIORITY_EXTRA_LOW))
                            ], else_=literal(PriorityQueue.PRIORITY_HIGH)),
-                       UserTest.timestamp)\
-        .all()
+                       UserTest.timestamp,
+                       UserTest.participation_id)\
+        .yield_per(SWEEP_BATCH_SIZE)
 
     # Retrieve all the compilation operations for user_tests
     # already having a result for a dataset to judge.
-    to_compile += session.query(UserTest)\
+    to_recompile = session.query(UserTest)\
         .join(UserTest.task)\
         .join(UserTest.results)\
         .join(UserTestResult.dataset)\
         .filter(
-            contest_filter &
+            contest_filter & id_filter &
             (FILTER_USER_TEST_DATASETS_TO_JUDGE) &
             (FILTER_USER_TEST_RESULTS_TO_COMPILE))\
         .with_entities(UserTest.id, Dataset.id,
@@ -448,15 +437,18 @@ def get_user_tests_operations(session, contest_id=None):
                            (UserTestResult.compilation_tries == 0,
                             literal(PriorityQueue.PRIORITY_HIGH))
                            ], else_=literal(PriorityQueue.PRIORITY_MEDIUM)),
-                       UserTest.timestamp)\
-        .all()
-
-    for data in to_compile:
-        user_test_id, dataset_id, priority, timestamp = data
-        operations.append((
+                       UserTest.timestamp,
+                       UserTest.participation_id)\
+        .yield_per(SWEEP_BATCH_SIZE)
+
+    for data in itertools.chain(to_compile, to_recompile):
+        user_test_id, dataset_id, priority, timestamp, participation_id = \
+            data
+        yield (
             ESOperation(ESOperation.USER_TEST_COMPILATION,
-                        user_test_id, dataset_id),
-            priority, timestamp))
+                        user_test_id, dataset_id,
+                        participation_id=participation_id),
+            priority, timestamp)
 
     # Retrieve all the evaluation operations for a dataset to judge,
     # that is, all pairs (user_test, dataset) for which we have a
@@ -466,7 +458,7 @@ def get_user_tests_operations(session, contest_id=None):
         .join(UserTest.results)\
         .join(UserTestResult.dataset)\
         .filter(
-            contest_filter &
+            contest_filter & id_filter &
             (FILTER_USER_TEST_DATASETS_TO_JUDGE) &
             (FILTER_USER_TEST_RESULTS_TO_EVALUATE))\
         .with_entities(UserTest.id, Dataset.id,
@@ -476,17 +468,18 @@ def get_user_tests_operations(session, contest_id=None):
                            (UserTestResult.evaluation_tries == 0,
                             literal(PriorityQueue.PRIORITY_MEDIUM))
                            ], else_=literal(PriorityQueue.PRIORITY_LOW)),
-                       UserTest.timestamp)\
-        .all()
+                       UserTest.timestamp,
+                       UserTest.participation_id)\
+        .yield_per(SWEEP_BATCH_SIZE)
 
     for data in to_evaluate:
-        user_test_id, dataset_id, priority, timestamp = data
-        operations.append((
+        user_test_id, dataset_id, priority, timestamp, participation_id = \
+            data
+        yield (
             ESOperation(
-                ESOperation.USER_TEST_EVALUATION, user_test_id, dataset_id),
-            priority, timestamp))
-
-    return operations
+                ESOperation.USER_TEST_EVALUATION, user_test_id, dataset_id,
+                participation_id=participation_id),
+            priority, timestamp)
 
 
 class ESOperation(QueueItem):
@@ -497,18 +490,23 @@ class ESOperation(QueueItem):
     USER_TEST_EVALUATION = "evaluate_test"
 
     # Testcase codename is only needed for EVALUATION type of operation
-    def __init__(self, type_, object_id, dataset_id, testcase_codename=None):
+    # The participation owning the object, if known, is only used to
+    # schedule fairly the operations, and does not identify them.
+    def __init__(self, type_, object_id, dataset_id, testcase_codename=None,
+                 participation_id=None):
         self.type_ = type_
         self.object_id = object_id
         self.dataset_id = dataset_id
         self.testcase_codename = testcase_codename
+        self.participation_id = participation_id
 
     @staticmethod
     def from_dict(d):
         return ESOperation(d["type"],
                            d["object_id"],
                            d["dataset_id"],
-                           d["testcase_codename"])
+                           d["testcase_codename"],
+                           d.get("participation_id"))
 
     def __eq__(self, other):
         # We may receive a non-ESOperation other when comparing with
@@ -555,5 +553,6 @@ class ESOperation(QueueItem):
             "type": self.type_,
             "object_id": self.object_id,
             "dataset_id": self.dataset_id,
-            "testcase_codename": self.testcase_codename
+            "testcase_codename": self.testcase_codename,
+            "participation_id": self.participation_id,
         }
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+# Copyright © 2026 agent <agent@local>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""On-disk journal of the operations that ES has still to complete.
+
+"""
+
+import json
+import logging
+import os
+
+from cmscommon.datetime import make_datetime, make_timestamp
+from .esoperations import ESOperation
+
+
+logger = logging.getLogger(__name__)
+
+
+class OperationJournal:
+    """Keep on disk the operations that are queued or being executed.
+
+    The journal is an append-only file with one JSON record per line,
+    either adding an operation (with its priority and timestamp) or
+    removing it. Reading it back gives the operations that were still
+    pending when the service stopped, even if it crashed (an
+    incomplete last line is ignored). When most of the records refer
+    to operations that are not pending anymore, the file is compacted,
+    that is, rewritten with only the pending operations.
+
+    """
+
+    # The journal is compacted when it has more than this many records
+    # and more than COMPACTION_RATIO records per pending operation.
+    COMPACTION_MIN_RECORDS = 1000
+    COMPACTION_RATIO = 4
+
+    def __init__(self, path):
+        """Create a journal, without reading it or opening it.
+
+        path (str): the path of the file holding the journal.
+
+        """
+        self.path = path
+        # Type: {ESOperation: (int, datetime)}
+        self._pending = dict()
+        self._records = 0
+        self._file = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def load(self):
+        """Read the journal and open it for writing.
+
+        return ([(ESOperation, int, datetime)]): the pending
+            operations, with their priority and timestamp.
+
+        """
+        self._pending = dict()
+        try:
+            with open(self.path, "rt", encoding="utf-8") as f:
+                for line_number, line in enumerate(f, 1):
+                    try:
+                        self._apply(json.loads(line))
+                    except (ValueError, KeyError, TypeError):
+                        logger.warning("Ignoring invalid record at line %d "
+                                       "of the operation journal %s.",
+                                       line_number, self.path)
+        except FileNotFoundError:
+            pass
+        self.compact()
+        return [(operation, priority, timestamp)
+                for operation, (priority, timestamp)
+                in self._pending.items()]
+
+    def _apply(self, record):
+        """Update the pending operations with a record.
+
+        record (dict): a record read from the journal.
+
+        """
+        operation = ESOperation.from_dict(record["operation"])
+        if record["action"] == "add":
+            self._pending[operation] = (
+                record["priority"], make_datetime(record["timestamp"]))
+        elif record["action"] == "remove":
+            self._pending.pop(operation, None)
+        else:
+            raise ValueError("Unknown action %s." % record["action"])
+
+    @staticmethod
+    def _add_record(operation, priority, timestamp):
+        return {"action": "add",
+                "operation": operation.to_dict(),
+                "priority": priority,
+                "timestamp": make_timestamp(timestamp)}
+
+    def _write(self, record):
+        """Append a record to the journal, compacting it if needed.
+
+        record (dict): the record to write.
+
+        """
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        self._records += 1
+        if self._records > max(
+                OperationJournal.COMPACTION_MIN_RECORDS,
+                OperationJournal.COMPACTION_RATIO * len(self._pending)):
+            self.compact()
+
+    def add(self, operation, priority, timestamp):
+        """Record that an operation is pending.
+
+        operation (ESOperation): the operation.
+        priority (int): the priority of the operation.
+        timestamp (datetime): the timestamp of the operation.
+
+        """
+        if self._pending.get(operation) == (priority, timestamp):
+            return
+        self._pending[operation] = (priority, timestamp)
+        self._write(self._add_record(operation, priority, timestamp))
+
+    def remove(self, operation):
+        """Record that an operation is not pending anymore.
+
+        operation (ESOperation): the operation.
+
+        """
+        if self._pending.pop(operation, None) is None:
+            return
+        self._write({"action": "remove", "operation": operation.to_dict()})
+
+    def compact(self):
+        """Rewrite the journal with only the pending operations."""
+        if self._file is not None:
+            self._file.close()
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "wt", encoding="utf-8") as f:
+            for operation, (priority, timestamp) in self._pending.items():
+                f.write(json.dumps(
+                    self._add_record(operation, priority, timestamp)) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        self._file = open(self.path, "at", encoding="utf-8")
+        self._records = len(self._pending)
+
+    def close(self):
+        """Close the journal file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -27,14 +27,18 @@
 
 import logging
 import random
+from collections import OrderedDict
 from datetime import timedelta
 
 import gevent.lock
 from gevent.event import Event
 
+from cms import config
 from cms.db import SessionGen
-from cms.grading.Job import JobGroup
+from cms.grading.Job import EvaluationJob, JobGroup
 from cmscommon.datetime import make_datetime, make_timestamp
+from .durationestimator import DurationEstimator
+from .esoperations import ESOperation
 
 
 logger = logging.getLogger(__name__)
@@ -52,6 +56,21 @@ class WorkerPool:
     # Seconds after which we declare a worker stale.
     WORKER_TIMEOUT = timedelta(seconds=600)
 
+    # How many of the datasets and of the submissions (or user tests)
+    # that each worker handled most recently we remember, assuming it
+    # still has their files in its cache.
+    LOCALITY_MAX_DATASETS = 50
+    LOCALITY_MAX_OBJECTS = 1000
+
+    # A batch is late (and its remaining operations are given also to
+    # an idle worker, the first result winning) when it runs for
+    # longer than it could reasonably take: the wall clock limits of
+    # its evaluations, or STRAGGLER_FACTOR times the estimated
+    # duration of the other operations, plus STRAGGLER_OVERHEAD
+    # seconds.
+    STRAGGLER_FACTOR = 3.0
+    STRAGGLER_OVERHEAD = 30.0
+
     def __init__(self, service):
         """service (Service): the EvaluationService using this
         WorkerPool.
@@ -78,6 +97,42 @@ class WorkerPool:
         self._schedule_disabling = {}
         # Type: {int: bool}
         self._ignore = {}
+        # The datasets and the submissions or user tests (as pairs
+        # (is_user_test, object_id)) of the operations recently
+        # assigned to each worker, from the least to the most recent.
+        # Type: {int: OrderedDict}
+        self._recent_datasets = {}
+        # Type: {int: OrderedDict}
+        self._recent_objects = {}
+        # The operations of the batch each worker is executing, and the
+        # predicted duration of the batch.
+        # Type: {int: [ESOperation]}
+        self._batch_operations = {}
+        # Type: {int: float|None}
+        self._predicted_duration = {}
+        # Size, predicted and actual duration of the last batch
+        # completed by each worker.
+        # Type: {int: {str: object}|None}
+        self._last_batch = {}
+        # The time after which the batch of each worker is late, in
+        # seconds, and whether its remaining operations have already
+        # been given to another worker.
+        # Type: {int: float|None}
+        self._expected_duration = {}
+        # Type: {int: bool}
+        self._speculated = {}
+        # The operations given to a second worker because the first
+        # was late, with the shard of the second worker.
+        # Type: {ESOperation: int}
+        self._speculative_copies = {}
+        # How many batches were given to a second worker, and how many
+        # operations the second worker completed first.
+        self.speculative_dispatches = 0
+        self.speculative_wins = 0
+
+        # Estimates of the duration of the operations, measured on the
+        # batches completed by the workers.
+        self.durations = DurationEstimator()
 
         # TODO: given the number of pieces data associated to each
         # worker, this class could be simplified by creating a new
@@ -87,8 +142,9 @@ class WorkerPool:
         # checks cannot be excluded. A refactoring of this class
         # should take that into account.
 
-        # A reverse lookup dictionary mapping operations to shards.
-        # Type: {ESOperation: int}
+        # A reverse lookup dictionary mapping operations to the shards
+        # executing them (more than one only for late batches).
+        # Type: {ESOperation: {int}}
         self._operations_reverse = dict()
 
         # A lock to ensure that the reverse lookup stays in sync with
@@ -120,7 +176,20 @@ class WorkerPool:
             self._operations[shard] = new_operation
             if isinstance(operations, list):
                 for operation in operations:
-                    del self._operations_reverse[operation]
+                    self._unassign(operation, shard)
+
+    def _unassign(self, operation, shard):
+        """Remove a worker from the reverse lookup of an operation.
+
+        shard (int): the worker.
+        operation (ESOperation): the operation it is not executing
+            anymore.
+
+        """
+        shards = self._operations_reverse[operation]
+        shards.discard(shard)
+        if len(shards) == 0:
+            del self._operations_reverse[operation]
 
     def _add_operations(self, shard, operations):
         """Assigns new operations to a currently inactive worker.
@@ -134,7 +203,8 @@ class WorkerPool:
         with self._operation_lock:
             self._operations[shard] = operations
             for operation in operations:
-                self._operations_reverse[operation] = shard
+                self._operations_reverse.setdefault(
+                    operation, set()).add(shard)
 
     def wait_for_workers(self):
         """Wait until a worker might be available."""
@@ -158,6 +228,13 @@ class WorkerPool:
         self._start_time[shard] = None
         self._schedule_disabling[shard] = False
         self._ignore[shard] = False
+        self._recent_datasets[shard] = OrderedDict()
+        self._recent_objects[shard] = OrderedDict()
+        self._batch_operations[shard] = []
+        self._predicted_duration[shard] = None
+        self._last_batch[shard] = None
+        self._expected_duration[shard] = None
+        self._speculated[shard] = False
         self._workers_available_event.set()
         logger.debug("Worker %s added.", shard)
 
@@ -183,6 +260,23 @@ class WorkerPool:
         # so we wake up the consumers.
         self._workers_available_event.set()
 
+    def precache_files(self, contest_id):
+        """Ask all connected workers to precache the files of a contest.
+
+        contest_id (int): the id of the contest.
+
+        return (int): the number of workers that received the request.
+
+        """
+        count = 0
+        for shard, worker in self._worker.items():
+            if worker.connected:
+                worker.precache_files(contest_id=contest_id)
+                count += 1
+        logger.info("Asked %d workers to precache files for contest %d.",
+                    count, contest_id)
+        return count
+
     def acquire_worker(self, operations):
         """Tries to assign an operation to an available worker. If no workers
         are available then this returns None, otherwise this returns
@@ -196,22 +290,36 @@ class WorkerPool:
         """
         # We look for an available worker.
         try:
-            shard = self.find_worker(WorkerPool.WORKER_INACTIVE,
-                                     require_connection=True,
-                                     random_worker=True)
+            shard = self.find_worker_for_operations(operations)
         except LookupError:
             self._workers_available_event.clear()
             return None
 
-        # Then we fill the info for future memory.
+        logger.debug("Worker %s acquired.", shard)
+        self._dispatch(shard, operations)
+        return shard
+
+    def _dispatch(self, shard, operations):
+        """Send operations to an available worker.
+
+        shard (int): the worker.
+        operations ([ESOperation]): the operations to assign to it.
+
+        """
+        # We fill the info for future memory.
         self._add_operations(shard, operations)
+        self._remember_locality(shard, operations)
 
-        logger.debug("Worker %s acquired.", shard)
         self._start_time[shard] = make_datetime()
+        self._batch_operations[shard] = list(operations)
+        self._predicted_duration[shard] = self.durations.estimate_batch(
+            operations, config.worker_parallel_jobs)
 
         with SessionGen() as session:
-            job_group_dict = \
-                JobGroup.from_operations(operations, session).export_to_dict()
+            job_group = JobGroup.from_operations(operations, session)
+            self._expected_duration[shard] = \
+                self._expected_batch_duration(operations, job_group)
+            job_group_dict = job_group.export_to_dict()
 
         logger.info("Asking worker %s to %s.", shard,
                     ", ".join("`%s'" % operation for operation in operations))
@@ -220,7 +328,30 @@ class WorkerPool:
             job_group_dict=job_group_dict,
             callback=self._service.action_finished,
             plus=shard)
-        return shard
+
+    def _expected_batch_duration(self, operations, job_group):
+        """Return the time after which a batch is considered late.
+
+        operations ([ESOperation]): the operations in the batch.
+        job_group (JobGroup): the jobs for the operations.
+
+        return (float): the duration, in seconds.
+
+        """
+        time_limits = dict((job.operation, job.time_limit)
+                           for job in job_group.jobs
+                           if isinstance(job, EvaluationJob))
+        total = 0.0
+        for operation in operations:
+            time_limit = time_limits.get(operation)
+            if time_limit is not None:
+                # The wall clock limit set by the evaluation step.
+                total += 2 * time_limit + 1
+            else:
+                total += WorkerPool.STRAGGLER_FACTOR \
+                    * self.durations.estimate(operation)
+        return total / min(config.worker_parallel_jobs, len(operations)) \
+            + WorkerPool.STRAGGLER_OVERHEAD
 
     def release_worker(self, shard):
         """To be called by ES when it receives a notification that an
@@ -251,7 +382,16 @@ class WorkerPool:
         with self._operation_lock:
             to_ignore = self._operations_to_ignore[shard]
             self._operations_to_ignore[shard] = []
+        # The duration of late batches would spoil the estimates.
+        if not ret and self._worker[shard].connected \
+                and self._start_time[shard] is not None \
+                and not self._speculated[shard]:
+            self._record_batch_duration(shard)
         self._start_time[shard] = None
+        self._batch_operations[shard] = []
+        self._predicted_duration[shard] = None
+        self._expected_duration[shard] = None
+        self._speculated[shard] = False
         self._ignore[shard] = False
         if self._schedule_disabling[shard]:
             self._remove_operations(shard, WorkerPool.WORKER_DISABLED)
@@ -266,6 +406,97 @@ class WorkerPool:
         else:
             return ret
 
+    def operation_finished(self, shard, operation):
+        """To be called by ES when a worker sends the result of one of
+        its operations before finishing the whole job group.
+
+        The operation is not assigned to the worker anymore: it is not
+        returned if the worker is lost, and its result in the complete
+        job group will be ignored.
+
+        shard (int): the worker that executed the operation.
+        operation (ESOperation): the operation.
+
+        return (bool): whether the result is to be used; False if the
+            results of the worker or of this operation are to be
+            ignored, or if the operation is not assigned to the worker
+            (e.g., because the complete job group already arrived).
+
+        """
+        with self._operation_lock:
+            operations = self._operations.get(shard)
+            if not isinstance(operations, list) \
+                    or self._ignore[shard] \
+                    or operation not in operations \
+                    or operation in self._operations_to_ignore[shard]:
+                return False
+            operations.remove(operation)
+            self._unassign(operation, shard)
+            self._operations_to_ignore[shard].append(operation)
+        return True
+
+    def claim_result(self, shard, operation, success):
+        """Decide whether to use the result of an operation.
+
+        To be called by ES for each result it is going to use. This
+        matters only for the operations that are being executed by
+        more than one worker (see check_stragglers): the first
+        successful result wins, and the operation is ignored on the
+        other workers; a failed result is discarded if another worker
+        is still executing the operation, as it may succeed.
+
+        shard (int): the worker that sent the result.
+        operation (ESOperation): the operation.
+        success (bool): whether the worker succeeded.
+
+        return (bool): whether to use the result.
+
+        """
+        with self._operation_lock:
+            others = [other for other
+                      in self._operations_reverse.get(operation, ())
+                      if other != shard and operation
+                      not in self._operations_to_ignore[other]]
+            if not success and len(others) > 0:
+                return False
+            for other in others:
+                self._operations_to_ignore[other].append(operation)
+            if self._speculative_copies.pop(operation, None) == shard:
+                self.speculative_wins += 1
+                logger.info("Worker %s completed `%s' before the late "
+                            "worker.", shard, operation)
+        return True
+
+    def _record_batch_duration(self, shard):
+        """Use the duration of the batch just completed by a worker to
+        update the estimates.
+
+        shard (int): the worker that completed the batch.
+
+        """
+        operations = self._batch_operations[shard]
+        duration = (make_datetime() - self._start_time[shard]).total_seconds()
+        self._last_batch[shard] = {
+            "size": len(operations),
+            "predicted_duration": self._predicted_duration[shard],
+            "actual_duration": duration,
+        }
+        logger.debug("Worker %s completed %d operations in %.3f s "
+                     "(predicted %.3f s).", shard, len(operations),
+                     duration, self._predicted_duration[shard])
+        self.durations.update(operations, duration,
+                              config.worker_parallel_jobs)
+
+    def get_active_workers_count(self):
+        """Return the number of workers that can receive operations.
+
+        return (int): the number of connected and enabled workers.
+
+        """
+        return sum(1 for shard in self._worker
+                   if self._worker[shard].connected
+                   and self._operations[shard] != WorkerPool.WORKER_DISABLED)
+
     def find_worker(self, operation, require_connection=False,
                     random_worker=False):
         """Return a worker whose assigned operation is operation.
@@ -298,6 +529,91 @@ class WorkerPool:
         else:
             return random.choice(pool)
 
+    def find_worker_for_operations(self, operations):
+        """Return an available worker, preferring those that are
+        likely to have the files needed by the operations in cache.
+
+        A worker gets one point for each operation on a dataset it was
+        recently assigned operations for (it probably has the
+        testcases and managers), and one for each operation on a
+        submission or user test it recently handled (it probably has
+        the executable). Ties, including the case in which no worker
+        has points, are broken at random.
+
+        operations ([ESOperation]): the operations to assign.
+
+        return (int): the shard of the chosen worker.
+
+        raise (LookupError): if no worker is available.
+
+        """
+        best_score = None
+        best = []
+        for shard, worker_operation in self._operations.items():
+            if worker_operation != WorkerPool.WORKER_INACTIVE \
+                    or not self._worker[shard].connected:
+                continue
+            score = sum(
+                (operation.dataset_id in self._recent_datasets[shard])
+                + (WorkerPool._object_key(operation)
+                   in self._recent_objects[shard])
+                for operation in operations)
+            if best_score is None or score > best_score:
+                best_score = score
+                best = [shard]
+            elif score == best_score:
+                best.append(shard)
+        if best == []:
+            raise LookupError("No available worker.")
+        shard = random.choice(best)
+        logger.debug("Chose worker %s with locality score %d.",
+                     shard, best_score)
+        return shard
+
+    @staticmethod
+    def _object_key(operation):
+        """Return the key identifying the object of an operation.
+
+        operation (ESOperation): an operation.
+
+        return ((bool, int)): whether the object is a user test, and
+            its id.
+
+        """
+        return (operation.type_ in [ESOperation.USER_TEST_COMPILATION,
+                                    ESOperation.USER_TEST_EVALUATION],
+                operation.object_id)
+
+    def _remember_locality(self, shard, operations):
+        """Record that the worker handles the given operations, and
+        so will have their files in cache.
+
+        shard (int): the worker.
+        operations ([ESOperation]): the operations assigned to it.
+
+        """
+        for operation in operations:
+            WorkerPool._touch(self._recent_datasets[shard],
+                              operation.dataset_id,
+                              WorkerPool.LOCALITY_MAX_DATASETS)
+            WorkerPool._touch(self._recent_objects[shard],
+                              WorkerPool._object_key(operation),
+                              WorkerPool.LOCALITY_MAX_OBJECTS)
+
+    @staticmethod
+    def _touch(recent, key, max_size):
+        """Mark a key as the most recent, forgetting the oldest ones.
+
+        recent (OrderedDict): keys from the least to the most recent.
+        key (object): the key to mark.
+        max_size (int): the maximum number of keys to remember.
+
+        """
+        recent.pop(key, None)
+        recent[key] = True
+        while len(recent) > max_size:
+            recent.popitem(last=False)
+
     def ignore_operation(self, operation):
         """Mark the operation to be ignored.
 
@@ -308,20 +624,44 @@ class WorkerPool:
         """
         try:
             with self._operation_lock:
-                shard = self._operations_reverse[operation]
-                self._operations_to_ignore[shard].append(operation)
+                for shard in self._operations_reverse[operation]:
+                    self._operations_to_ignore[shard].append(operation)
         except LookupError:
             logger.debug("Asked to ignore operation `%s' "
                          "that cannot be found.", operation)
             raise
 
+    def ignore_operations_matching(self, predicate):
+        """Mark all the operations satisfying a condition to be ignored.
+
+        predicate (function): receives an operation, and returns
+            whether to ignore it.
+
+        return ([ESOperation]): the operations ignored.
+
+        """
+        ignored = []
+        with self._operation_lock:
+            for operation, shards in self._operations_reverse.items():
+                if not predicate(operation):
+                    continue
+                shards = [shard for shard in shards if operation
+                          not in self._operations_to_ignore[shard]]
+                for shard in shards:
+                    self._operations_to_ignore[shard].append(operation)
+                if len(shards) > 0:
+                    ignored.append(operation)
+        return ignored
+
     def get_status(self):
         """Returns a dict with info about the current status of all
         workers.
 
         return (dict): dict of info: current operation, starting time,
             number of errors, and additional data specified in the
-            operation.
+            operation; also the predicted duration of the current
+            batch, and the size, predicted and actual duration of the
+            last batch completed.
 
         """
         result = dict()
@@ -335,9 +675,78 @@ class WorkerPool:
                                for operation in self._operations[shard]]
                 if isinstance(self._operations[shard], list)
                 else self._operations[shard],
-                'start_time': s_time}
+                'start_time': s_time,
+                'predicted_duration': self._predicted_duration[shard],
+                'last_batch': self._last_batch[shard]}
         return result
 
+    def get_speculation_status(self):
+        """Return the counters of the late batches.
+
+        return ({str: int}): the number of batches whose remaining
+            operations were given to a second worker ("dispatches"),
+            and the number of operations the second worker completed
+            first ("wins").
+
+        """
+        return {"dispatches": self.speculative_dispatches,
+                "wins": self.speculative_wins}
+
+    def check_stragglers(self):
+        """Give the remaining operations of late batches also to idle
+        workers.
+
+        A worker on a slow or faulty machine would otherwise hold its
+        operations until WORKER_TIMEOUT. Each operation is given to at
+        most two workers, and the first result wins (see
+        claim_result).
+
+        return (int): the number of late batches given to another
+            worker.
+
+        """
+        now = make_datetime()
+        count = 0
+        for shard in self._worker:
+            if self._start_time[shard] is None \
+                    or self._expected_duration[shard] is None \
+                    or self._speculated[shard] or self._ignore[shard] \
+                    or not isinstance(self._operations[shard], list):
+                continue
+            active_for = (now - self._start_time[shard]).total_seconds()
+            if active_for <= self._expected_duration[shard]:
+                continue
+
+            with self._operation_lock:
+                remaining = [
+                    operation for operation in self._operations[shard]
+                    if operation not in self._operations_to_ignore[shard]
+                    and len(self._operations_reverse[operation]) == 1]
+            if remaining == []:
+                continue
+            try:
+                other = self.find_worker_for_operations(remaining)
+            except LookupError:
+                break
+
+            logger.warning("Worker %s is late (running for %.1f s, "
+                           "expected at most %.1f s), giving its %d "
+                           "remaining operations also to worker %s.",
+                           shard, active_for, self._expected_duration[shard],
+                           len(remaining), other)
+            self._speculated[shard] = True
+            for operation in remaining:
+                self._speculative_copies[operation] = other
+            self._dispatch(other, remaining)
+            self.speculative_dispatches += 1
+            count += 1
+
+        # Forget the copies whose result will never arrive.
+        for operation in [operation for operation in self._speculative_copies
+                          if operation not in self._operations_reverse]:
+            del self._speculative_copies[operation]
+        return count
+
     def check_timeouts(self):
         """Check if some worker is not responding in too much time. If
         this is the case, the worker is scheduled for disabling, and
@@ -23,7 +23,7 @@ from weakref import WeakSet
 
 from gevent import Timeout
 from gevent.pywsgi import WSGIHandler
-from gevent.queue import Queue, Empty
+from gevent.queue import Queue, Empty, Full
 from werkzeug.exceptions import NotAcceptable
 from werkzeug.wrappers import Request
 
@@ -84,17 +84,39 @@ class Publisher:
     a cache for a while, instantiating subscribers, each with its own
     queue, and pushing new messages to all these queues.
 
+    The queues can be bounded: when a subscriber falls too much behind
+    (e.g., a slow client) its queue is emptied, it's told to reinit
+    and it receives no more messages.
+
+    The ID of each message is the time it was sent at, followed by a
+    tag of the publisher (i.e., "<time>-<tag>", both in hexadecimal),
+    so that a client that comes back with an ID given by another
+    publisher (e.g., another instance of the server, behind the same
+    load balancer) is told to reinit. IDs without a tag are accepted
+    too, and taken as the time the client got its data at.
+
     """
-    def __init__(self, size):
+    REINIT_MESSAGE = b"event:reinit\n\n"
+
+    def __init__(self, size, queue_size=None):
         """Instantiate a new publisher.
 
         size (int): the number of messages to keep in cache.
+        queue_size (int|None): the number of messages each subscriber
+            can have waiting, or None for no limit.
 
         """
+        self._queue_size = queue_size
         # We use a deque as it's efficient to add messages to one end
         # and have the ones at the other end be dropped when the total
         # number exceeds the given limit.
         self._cache = deque(maxlen=size)
+        # All the messages with a greater key than this are in the
+        # cache: it's the key of the last message dropped from it or,
+        # if none was, the time the publisher was created at.
+        self._cache_start = int(time.time() * 1_000_000)
+        # The tag of the IDs of the messages.
+        self._epoch = "%x" % self._cache_start
         # We use a WeakSet as we want queues to be vanish automatically
         # when no one else is using (i.e. fetching from) them.
         self._sub_queues = WeakSet()
@@ -110,12 +132,25 @@ class Publisher:
         """
         # Number of microseconds since epoch.
         key = int(time.time() * 1_000_000)
-        msg = format_event("%x" % key, event, data)
+        msg = format_event("%x-%s" % (key, self._epoch), event, data)
         # Put into cache.
+        if len(self._cache) == self._cache.maxlen:
+            self._cache_start = self._cache[0][0]
         self._cache.append((key, msg))
         # Send to all subscribers.
+        overflowed = list()
         for queue in self._sub_queues:
-            queue.put(msg)
+            try:
+                queue.put_nowait(msg)
+            except Full:
+                overflowed.append(queue)
+        # Replace what these subscribers have waiting with a request
+        # to reinit, and stop sending them messages.
+        for queue in overflowed:
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(Publisher.REINIT_MESSAGE)
+            self._sub_queues.discard(queue)
 
     def get_subscriber(self, last_event_id=None):
         """Obtain a new subscriber.
@@ -131,20 +166,28 @@ class Publisher:
         return (Subscriber): a new subscriber instance.
 
         """
-        queue = Queue()
+        queue = Queue(self._queue_size)
         # If a valid last_event_id is provided see if cache can supply
         # missed events.
-        if last_event_id is not None and \
-                re.match("^[0-9A-Fa-f]+$", last_event_id):
-            last_event_key = int(last_event_id, 16)
-            if len(self._cache) > 0 and last_event_key >= self._cache[0][0]:
+        match = None
+        if last_event_id is not None:
+            match = re.match("^([0-9A-Fa-f]+)(?:-([0-9A-Fa-f]+))?$",
+                             last_event_id)
+        if match is not None:
+            last_event_key = int(match.group(1), 16)
+            epoch = match.group(2)
+            missed = [msg for key, msg in self._cache
+                      if key > last_event_key]
+            if epoch in (None, self._epoch) \
+                    and last_event_key >= self._cache_start \
+                    and (self._queue_size is None
+                         or len(missed) <= self._queue_size):
                 # All missed events are in cache.
-                for key, msg in self._cache:
-                    if key > last_event_key:
-                        queue.put(msg)
+                for msg in missed:
+                    queue.put(msg)
             else:
                 # Some events may be missing. Ask to reinit.
-                queue.put(b"event:reinit\n\n")
+                queue.put(Publisher.REINIT_MESSAGE)
         # Store the queue and return a subscriber bound to it.
         self._sub_queues.add(queue)
         return Subscriber(queue)
@@ -212,12 +255,13 @@ class EventSource:
     _PING_TIMEOUT = 15
 
     _CACHE_SIZE = 250
+    _QUEUE_SIZE = None
 
     def __init__(self):
         """Create an event source.
 
         """
-        self._pub = Publisher(self._CACHE_SIZE)
+        self._pub = Publisher(self._CACHE_SIZE, self._QUEUE_SIZE)
 
     def send(self, event, data):
         """Send the event to the stream.
@@ -390,5 +434,10 @@ class EventSource:
                 if one_shot and got_sth:
                     break
 
+                # A client told to reinit has to start over, so there's
+                # no point in keeping the stream open.
+                if data.endswith(Publisher.REINIT_MESSAGE):
+                    break
+
         # An empty iterable tells the server not to send anything.
         return []
@@ -29,7 +29,8 @@ import argparse
 import logging
 import sys
 
-from cms.db import SessionGen, Digest, Executable, enumerate_files
+from cms.db import SessionGen, CompilationCacheEntry, Digest, Executable, \
+    enumerate_files
 from cms.db.filecacher import FileCacher
 
 
@@ -43,6 +44,10 @@ def make_tombstone(session):
             count += 1
         exe.digest = Digest.TOMBSTONE
     logger.info("Replaced %d executables with the tombstone.", count)
+    # The cached compilations would refer to the removed executables.
+    count = session.query(CompilationCacheEntry)\
+        .delete(synchronize_session=False)
+    logger.info("Removed %d entries from the compilation cache.", count)
 
 
 def clean_files(session, dry_run):
@@ -51,6 +56,8 @@ def clean_files(session, dry_run):
     logger.info("A total number of %d files are present in the file store",
                 len(files))
     found_digests = enumerate_files(session)
+    for entry in session.query(CompilationCacheEntry).all():
+        found_digests.update(entry.executables.values())
     logger.info("Found %d digests while scanning", len(found_digests))
     files -= found_digests
     logger.info("%d digests are orphan.", len(files))
@@ -210,6 +210,14 @@ class DumpExporter:
                         skip_user_tests=self.skip_user_tests,
                         skip_print_jobs=self.skip_print_jobs,
                         skip_generated=self.skip_generated)
+                    # Fetch all the files at once; safe_get_file will
+                    # then find them in the cache (or report them if
+                    # they could not be fetched).
+                    try:
+                        self.file_cacher.load_many(files, if_needed=True)
+                    except Exception:
+                        logger.warning("Could not prefetch the files.",
+                                       exc_info=True)
                     for file_ in files:
                         if not self.safe_get_file(file_,
                                                   os.path.join(files_dir,
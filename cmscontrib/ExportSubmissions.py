@@ -23,6 +23,7 @@
 """
 
 import argparse
+import io
 import logging
 import os
 import sys
@@ -30,6 +31,7 @@ import sys
 from cms import utf8_decoder
 from cms.db import Dataset, File, FSObject, Participation, SessionGen, \
     Submission, SubmissionResult, Task, User
+from cms.db.filecacher import decompress_fileobj
 from cms.grading import languagemanager
 
 
@@ -222,8 +224,11 @@ def main():
 
             fso = FSObject.get_from_digest(f_digest, session)
             assert fso is not None
-            with fso.get_lobject(mode="rb") as file_obj:
-                data = file_obj.read()
+            with fso.get_lobject(mode="rb") as file_obj, \
+                    io.BytesIO() as buffer:
+                # Files might be stored compressed.
+                decompress_fileobj(file_obj, buffer)
+                data = buffer.getvalue()
 
                 if args.utf8:
                     try:
@@ -49,6 +49,10 @@ class Config:
         self.https_keyfile = None
         self.timeout = 600  # 10 minutes (in seconds)
 
+        # Replication: the URL of the RWS to copy the data from, or
+        # null for a primary RWS (which receives it from ProxyService).
+        self.primary_url = None
+
         # Authentication.
         self.realm_name = 'Scoreboard'
         self.username = 'usern4me'
@@ -56,6 +60,12 @@ class Config:
 
         # Buffers
         self.buffer_size = 100  # Needs to be strictly positive.
+        # Messages waiting for each client; slower clients are told to
+        # reload (null for no limit).
+        self.queue_size = 1000
+        # Seconds during which score changes are collected and then sent
+        # together (0 to send each one at once).
+        self.score_interval = 0.5
 
         # File system.
         # TODO: move to cmscommon as it is used both here and in cms/conf.py
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+# Copyright © 2026 agent <agent@local>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import logging
+import os
+
+
+logger = logging.getLogger(__name__)
+
+
+class Journal:
+    """The persistent storage of a store.
+
+    The data is kept in a directory, in a snapshot file (with the data
+    of each entity) and in an append-only journal file, with one JSON
+    record per line, either setting the data of an entity or deleting
+    it. Changes are buffered in memory and written in batches by
+    flush(). When the journal gets too long with respect to the number
+    of entities, compact() replaces both files with a new snapshot.
+    Snapshot and journal carry a generation number, so that a journal
+    left behind by an interrupted compaction is not applied to the
+    newer snapshot.
+
+    Before the journal, each entity was stored in its own file (called
+    <key>.json); load() migrates these files to the snapshot.
+
+    """
+
+    SNAPSHOT_FILENAME = "store.snapshot"
+    JOURNAL_FILENAME = "store.journal"
+
+    # The journal is compacted when it has more than this many records
+    # and more than COMPACTION_RATIO records per entity.
+    COMPACTION_MIN_RECORDS = 1000
+    COMPACTION_RATIO = 4
+
+    def __init__(self, path):
+        """Create a journal, without reading it or opening it.
+
+        path (str): the directory holding the files.
+
+        """
+        self._path = path
+        self._snapshot_path = os.path.join(path, Journal.SNAPSHOT_FILENAME)
+        self._journal_path = os.path.join(path, Journal.JOURNAL_FILENAME)
+        self._file = None
+        self._generation = 0
+        # Records written to the journal file, and still to be written.
+        self._records = 0
+        self._pending = list()
+
+    def load(self):
+        """Read the data and open the journal for writing.
+
+        return ({str: object}): the data of each entity, by key.
+
+        """
+        try:
+            os.mkdir(self._path)
+        except FileExistsError:
+            pass
+
+        data = dict()
+        try:
+            with open(self._snapshot_path, "rt", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            self._generation = snapshot["generation"]
+            data.update(snapshot["data"])
+        except FileNotFoundError:
+            pass
+
+        legacy_files = self._load_legacy_files(data)
+
+        try:
+            with open(self._journal_path, "rt", encoding="utf-8") as f:
+                header = json.loads(f.readline() or "{}")
+                if header.get("generation") != self._generation:
+                    raise FileNotFoundError()
+                for line_number, line in enumerate(f, 2):
+                    try:
+                        record = json.loads(line)
+                        if "data" in record:
+                            data[record["key"]] = record["data"]
+                        else:
+                            data.pop(record["key"], None)
+                    except (ValueError, KeyError, TypeError):
+                        logger.warning("Ignoring invalid record at line %d.",
+                                       line_number,
+                                       extra={'location': self._journal_path})
+        except FileNotFoundError:
+            pass
+
+        self.compact(data)
+        for name in legacy_files:
+            os.remove(os.path.join(self._path, name))
+        if len(legacy_files) > 0:
+            logger.info("Migrated %d entities to %s.", len(legacy_files),
+                        self._snapshot_path)
+        return data
+
+    def _load_legacy_files(self, data):
+        """Read the entities stored one per file.
+
+        data ({str: object}): the dict where to put the data, by key.
+
+        return ([str]): the names of the files read.
+
+        """
+        names = list()
+        for name in sorted(os.listdir(self._path)):
+            if name[-5:] != '.json' or name[:-5] == '':
+                continue
+            try:
+                with open(os.path.join(self._path, name), 'rb') as rec:
+                    data[name[:-5]] = json.load(rec)
+            except ValueError:
+                logger.error("Invalid JSON", exc_info=False,
+                             extra={'location': os.path.join(self._path,
+                                                             name)})
+                continue
+            names.append(name)
+        return names
+
+    def put(self, key, data):
+        """Record the new data of an entity.
+
+        Nothing is recorded if the journal is not open (i.e., if it
+        could not be loaded).
+
+        key (str): the key of the entity.
+        data (object): the data of the entity.
+
+        """
+        if self._file is not None:
+            self._pending.append({"key": key, "data": data})
+
+    def delete(self, key):
+        """Record that an entity was deleted.
+
+        key (str): the key of the entity.
+
+        """
+        if self._file is not None:
+            self._pending.append({"key": key})
+
+    def needs_compaction(self, entities):
+        """Return whether the journal should be compacted.
+
+        entities (int): the number of entities in the store.
+
+        return (bool): whether the journal is much longer than a
+            snapshot would be.
+
+        """
+        records = self._records + len(self._pending)
+        return records > max(Journal.COMPACTION_MIN_RECORDS,
+                             Journal.COMPACTION_RATIO * entities)
+
+    def flush(self):
+        """Write the buffered records to the journal file."""
+        if self._file is None or len(self._pending) == 0:
+            return
+        self._file.write("".join(json.dumps(record) + "\n"
+                                 for record in self._pending))
+        self._file.flush()
+        self._records += len(self._pending)
+        self._pending = list()
+
+    def compact(self, data):
+        """Replace snapshot and journal with a snapshot of the data.
+
+        data ({str: object}): the data of each entity, by key; it has
+            to include the changes still buffered.
+
+        """
+        compaction = self.begin_compaction()
+        self.write_snapshot(compaction, data)
+        self.end_compaction(compaction)
+
+    def begin_compaction(self):
+        """Start replacing snapshot and journal with a new snapshot.
+
+        The compaction is split in three steps so that the snapshot,
+        which is slow to write, can be written without blocking the
+        changes: begin_compaction() and end_compaction() must be called
+        when the data does not change, but the changes made between
+        them are recorded as usual, and are written to the new journal.
+
+        return ((int, int)): the compaction, to pass to the other
+            steps: the new generation and the number of buffered
+            records that the snapshot includes.
+
+        """
+        return self._generation + 1, len(self._pending)
+
+    def write_snapshot(self, compaction, data):
+        """Write the new snapshot of a compaction.
+
+        It does not touch the state of the journal, hence it can run in
+        another thread.
+
+        compaction ((int, int)): as returned by begin_compaction().
+        data ({str: object}): the data of each entity, by key, at the
+            time begin_compaction() was called.
+
+        """
+        generation, _ = compaction
+        temp_path = self._snapshot_path + ".tmp"
+        with open(temp_path, "wt", encoding="utf-8") as f:
+            json.dump({"generation": generation, "data": data}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self._snapshot_path)
+
+    def end_compaction(self, compaction):
+        """Start a new journal, after the new snapshot.
+
+        compaction ((int, int)): as returned by begin_compaction().
+
+        """
+        generation, included = compaction
+        if self._file is not None:
+            self._file.close()
+        self._generation = generation
+        self._file = open(self._journal_path, "wt", encoding="utf-8")
+        self._file.write(json.dumps({"generation": self._generation}) + "\n")
+        self._file.flush()
+        self._records = 0
+        self._pending = self._pending[included:]
+
+    def close(self):
+        """Write the buffered records and close the journal file."""
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
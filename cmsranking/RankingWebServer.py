@@ -18,6 +18,7 @@
 
 import argparse
 import functools
+import gzip
 import json
 import logging
 import os
@@ -42,6 +43,7 @@ from cmscommon.eventsource import EventSource
 from cmsranking.Config import Config
 from cmsranking.Contest import Contest
 from cmsranking.Entity import InvalidData
+from cmsranking.Replica import ENTITIES, Replica
 from cmsranking.Scoring import ScoringStore
 from cmsranking.Store import Store
 from cmsranking.Subchange import Subchange
@@ -70,20 +72,26 @@ class CustomUnauthorized(Unauthorized):
 
 class StoreHandler:
 
-    def __init__(self, store, username, password, realm_name):
+    def __init__(self, store, username, password, realm_name,
+                 read_only=False):
         self.store = store
         self.username = username
         self.password = password
         self.realm_name = realm_name
 
-        self.router = Map([
+        rules = [
             Rule("/<key>", methods=["GET"], endpoint="get"),
             Rule("/", methods=["GET"], endpoint="get_list"),
-            Rule("/<key>", methods=["PUT"], endpoint="put"),
-            Rule("/", methods=["PUT"], endpoint="put_list"),
-            Rule("/<key>", methods=["DELETE"], endpoint="delete"),
-            Rule("/", methods=["DELETE"], endpoint="delete_list"),
-        ], encoding_errors="strict")
+        ]
+        # Replicas get their data only from the primary.
+        if not read_only:
+            rules += [
+                Rule("/<key>", methods=["PUT"], endpoint="put"),
+                Rule("/", methods=["PUT"], endpoint="put_list"),
+                Rule("/<key>", methods=["DELETE"], endpoint="delete"),
+                Rule("/", methods=["DELETE"], endpoint="delete_list"),
+            ]
+        self.router = Map(rules, encoding_errors="strict")
 
     def __call__(self, environ, start_response):
         return self.wsgi_app(environ, start_response)
@@ -238,12 +246,27 @@ class StoreHandler:
 
 
 class DataWatcher(EventSource):
-    """Receive the messages from the entities store and redirect them."""
+    """Receive the messages from the entities store and redirect them.
+
+    Score changes are not sent at once, but collected for score_interval
+    seconds and then sent in a single event (one line for each user and
+    task, with the latest score), to bound the number of events sent
+    when many scores change at the same time (e.g., for a rejudge).
+
+    """
 
-    def __init__(self, stores, buffer_size):
+    def __init__(self, stores, buffer_size, queue_size=None,
+                 score_interval=0.0):
         self._CACHE_SIZE = buffer_size
+        self._QUEUE_SIZE = queue_size
         EventSource.__init__(self)
 
+        self._score_interval = score_interval
+        # The score changes not sent yet, by (user, task), and the
+        # greenlet that will send them.
+        self._pending_scores = dict()
+        self._score_greenlet = None
+
         stores["contest"].add_create_callback(
             functools.partial(self.callback, "contest", "create"))
         stores["contest"].add_update_callback(
@@ -275,11 +298,63 @@ class DataWatcher(EventSource):
         stores["scoring"].add_score_callback(self.score_callback)
 
     def callback(self, entity, event, key, *args):
+        # Keep the events in order, as the clients need the entities to
+        # exist when they get their scores.
+        self.flush_scores()
         self.send(entity, "%s %s" % (event, key))
 
     def score_callback(self, user, task, score):
+        self._pending_scores[(user, task)] = score
+        if self._score_interval <= 0:
+            self.flush_scores()
+        elif self._score_greenlet is None:
+            self._score_greenlet = gevent.spawn_later(self._score_interval,
+                                                      self.flush_scores)
+
+    def flush_scores(self):
+        """Send the pending score changes in a single event."""
+        if self._score_greenlet is not None:
+            if self._score_greenlet is not gevent.getcurrent():
+                self._score_greenlet.kill(block=False)
+            self._score_greenlet = None
+        if len(self._pending_scores) == 0:
+            return
         # FIXME Use score_precision.
-        self.send("score", "%s %s %0.2f" % (user, task, score))
+        data = "\n".join("%s %s %0.2f" % (user, task, score)
+                         for (user, task), score
+                         in self._pending_scores.items())
+        self._pending_scores = dict()
+        self.send("score", data)
+
+
+class ReplicationWatcher(EventSource):
+    """Send every change of the entities, for the replicas to follow.
+
+    Each event is named after the store and contains the key of the
+    entity and, unless it was deleted, its new data.
+
+    """
+    # Replicas need to be able to resume after a lost connection, and
+    # are few: keep many events and don't limit their queues.
+    _CACHE_SIZE = 10000
+
+    def __init__(self, stores):
+        EventSource.__init__(self)
+        self.stores = stores
+
+        for entity in ENTITIES:
+            callback = functools.partial(self.put_callback, entity)
+            stores[entity].add_create_callback(callback)
+            stores[entity].add_update_callback(callback)
+            stores[entity].add_delete_callback(
+                functools.partial(self.delete_callback, entity))
+
+    def put_callback(self, entity, key, *args):
+        self.send(entity, json.dumps(
+            {"key": key, "data": self.stores[entity].retrieve(key)}))
+
+    def delete_callback(self, entity, key, *args):
+        self.send(entity, json.dumps({"key": key}))
 
 
 class SubListHandler:
@@ -328,11 +403,77 @@ class SubListHandler:
         return response(environ, start_response)
 
 
+def make_cached_response(request, data, gzip_data, etag):
+    """Return a response with a precomputed body, for conditional GETs.
+
+    request (Request): the request to answer.
+    data (bytes): the JSON body, uncompressed.
+    gzip_data (bytes): the same body, compressed with gzip.
+    etag (str): the ETag of the uncompressed body.
+
+    return (Response): a 304 response if the client has the current
+        version of the body, otherwise a 200 one with the body,
+        compressed if the client accepts it.
+
+    """
+    response = Response()
+    response.mimetype = "application/json"
+    response.headers['Cache-Control'] = "no-cache"
+    response.vary.add("Accept-Encoding")
+    # The two encodings are different representations, hence they
+    # need different (strong) ETags.
+    use_gzip = "gzip" in request.accept_encodings
+    if use_gzip:
+        etag += "-gz"
+    response.set_etag(etag)
+    if request.if_none_match.contains(etag):
+        response.status_code = 304
+    else:
+        response.status_code = 200
+        if use_gzip:
+            response.content_encoding = "gzip"
+            response.data = gzip_data
+        else:
+            response.data = data
+    return response
+
+
 class HistoryHandler:
+    """Serve the global history of the scores.
+
+    The history is serialized and compressed once per version of it,
+    and the version is used as the ETag of the response.
+
+    """
 
     def __init__(self, stores):
         self.scoring_store = stores["scoring"]
 
+        # The history, uncompressed and compressed, and the version of
+        # the global history it was computed with.
+        self._data = None
+        self._gzip_data = None
+        self._version = None
+
+        # Different each time RWS starts, so that versions don't clash.
+        self._epoch = "%x" % int(time.time() * 1000000)
+
+    def get_history(self):
+        """Return the current history, computing it if needed.
+
+        return ((bytes, bytes, str)): the history, uncompressed and
+            compressed with gzip, and the ETag of the former.
+
+        """
+        if self._version != self.scoring_store.history_version:
+            self._version = self.scoring_store.history_version
+            self._data = json.dumps(
+                self.scoring_store.get_global_history()).encode("utf-8")
+            self._gzip_data = gzip.compress(self._data)
+
+        return (self._data, self._gzip_data,
+                "%s-%d" % (self._epoch, self._version))
+
     def __call__(self, environ, start_response):
         return self.wsgi_app(environ, start_response)
 
@@ -343,12 +484,117 @@ class HistoryHandler:
         if request.accept_mimetypes.quality("application/json") <= 0:
             raise NotAcceptable()
 
-        result = list(self.scoring_store.get_global_history())
+        response = make_cached_response(request, *self.get_history())
 
-        response = Response()
-        response.status_code = 200
-        response.mimetype = "application/json"
-        response.data = json.dumps(result)
+        return response(environ, start_response)
+
+
+class SnapshotHandler:
+    """Serve the whole ranking in a single precomputed response.
+
+    The snapshot contains the entities and the current scores (the
+    history, needed only by the details of the users, is served by
+    HistoryHandler). Each part is serialized again only after it
+    changes (as notified by the callbacks of the stores), and the
+    whole snapshot is compressed once per version, so that any number
+    of clients can be served at little cost. The version is used as
+    the ETag of the response.
+
+    """
+
+    ENTITIES = ["contest", "task", "team", "user"]
+
+    def __init__(self, stores):
+        self.stores = stores
+        self.scoring_store = stores["scoring"]
+
+        # The current scores (only the positive ones).
+        self._scores = dict()
+        for u_id, tasks in self.scoring_store._scores.items():
+            for t_id, score in tasks.items():
+                if score.get_score() > 0.0:
+                    self._scores.setdefault(u_id, dict())[t_id] = \
+                        score.get_score()
+
+        # The serialized parts, or None when they have to be computed
+        # again.
+        self._parts = dict()
+
+        # The snapshot, uncompressed and compressed, with the time it
+        # was computed at, or None when it has to be computed again.
+        self._data = None
+        self._gzip_data = None
+        self._timestamp = None
+
+        # Different each time RWS starts, so that versions don't clash.
+        self._epoch = "%x" % int(time.time() * 1000000)
+        self._version = 0
+
+        for entity in SnapshotHandler.ENTITIES:
+            callback = functools.partial(self.entity_callback, entity)
+            stores[entity].add_create_callback(callback)
+            stores[entity].add_update_callback(callback)
+            stores[entity].add_delete_callback(callback)
+        self.scoring_store.add_score_callback(self.score_callback)
+
+    def _invalidate(self, part):
+        self._parts.pop(part, None)
+        self._data = None
+
+    def entity_callback(self, entity, key, *args):
+        self._invalidate(entity)
+
+    def score_callback(self, user, task, score):
+        if score > 0.0:
+            self._scores.setdefault(user, dict())[task] = score
+        elif task in self._scores.get(user, dict()):
+            del self._scores[user][task]
+            if len(self._scores[user]) == 0:
+                del self._scores[user]
+        self._invalidate("scores")
+
+    def get_snapshot(self):
+        """Return the current snapshot, computing it if needed.
+
+        return ((bytes, bytes, str)): the snapshot, uncompressed and
+            compressed with gzip, and the ETag of the former.
+
+        """
+        if self._data is None:
+            for entity in SnapshotHandler.ENTITIES:
+                if entity not in self._parts:
+                    self._parts[entity] = json.dumps(
+                        self.stores[entity].retrieve_list())
+            if "scores" not in self._parts:
+                self._parts["scores"] = json.dumps(self._scores)
+
+            self._version += 1
+            self._timestamp = time.time()
+            self._data = (
+                '{"version": %d, "timestamp": %0.6f, "contests": %s, '
+                '"tasks": %s, "teams": %s, "users": %s, "scores": %s}' % (
+                    self._version, self._timestamp,
+                    self._parts["contest"], self._parts["task"],
+                    self._parts["team"], self._parts["user"],
+                    self._parts["scores"])
+            ).encode("utf-8")
+            self._gzip_data = gzip.compress(self._data)
+
+        return (self._data, self._gzip_data,
+                "%s-%d" % (self._epoch, self._version))
+
+    def __call__(self, environ, start_response):
+        return self.wsgi_app(environ, start_response)
+
+    def wsgi_app(self, environ, start_response):
+        request = Request(environ)
+        request.encoding_errors = "strict"
+
+        if request.accept_mimetypes.quality("application/json") <= 0:
+            raise NotAcceptable()
+
+        response = make_cached_response(request, *self.get_snapshot())
+        response.headers['Timestamp'] = "%0.6f" % self._timestamp
 
         return response(environ, start_response)
 
@@ -473,11 +719,14 @@ class RootHandler:
 class RoutingHandler:
 
     def __init__(self, root_handler, event_handler, logo_handler,
-                 score_handler, history_handler):
+                 score_handler, history_handler, snapshot_handler,
+                 replication_handler):
         self.router = Map([
             Rule("/", methods=["GET"], endpoint="root"),
             Rule("/history", methods=["GET"], endpoint="history"),
             Rule("/scores", methods=["GET"], endpoint="scores"),
+            Rule("/snapshot", methods=["GET"], endpoint="snapshot"),
+            Rule("/replication", methods=["GET"], endpoint="replication"),
             Rule("/events", methods=["GET"], endpoint="events"),
             Rule("/logo", methods=["GET"], endpoint="logo"),
         ], encoding_errors="strict")
@@ -486,6 +735,8 @@ class RoutingHandler:
         self.logo_handler = logo_handler
         self.score_handler = score_handler
         self.history_handler = history_handler
+        self.snapshot_handler = snapshot_handler
+        self.replication_handler = replication_handler
         self.root_handler = root_handler
 
     def __call__(self, environ, start_response):
@@ -508,6 +759,10 @@ class RoutingHandler:
             return self.score_handler(environ, start_response)
         elif endpoint == "history":
             return self.history_handler(environ, start_response)
+        elif endpoint == "snapshot":
+            return self.snapshot_handler(environ, start_response)
+        elif endpoint == "replication":
+            return self.replication_handler(environ, start_response)
 
 
 def main():
@@ -574,33 +829,47 @@ def main():
 
     toplevel_handler = RoutingHandler(
         RootHandler(config.web_dir),
-        DataWatcher(stores, config.buffer_size),
+        DataWatcher(stores, config.buffer_size, config.queue_size,
+                    config.score_interval),
         ImageHandler(
             os.path.join(config.lib_dir, '%(name)s'),
             os.path.join(config.web_dir, 'img', 'logo.png')),
         ScoreHandler(stores),
-        HistoryHandler(stores))
+        HistoryHandler(stores),
+        SnapshotHandler(stores),
+        ReplicationWatcher(stores))
+
+    # A replica follows its primary, and doesn't accept changes.
+    read_only = config.primary_url is not None
+    if read_only:
+        gevent.spawn(Replica(stores, config.primary_url).run)
 
     wsgi_app = SharedDataMiddleware(DispatcherMiddleware(
         toplevel_handler, {
             '/contests': StoreHandler(
                 stores["contest"],
-                config.username, config.password, config.realm_name),
+                config.username, config.password, config.realm_name,
+                read_only),
             '/tasks': StoreHandler(
                 stores["task"],
-                config.username, config.password, config.realm_name),
+                config.username, config.password, config.realm_name,
+                read_only),
             '/teams': StoreHandler(
                 stores["team"],
-                config.username, config.password, config.realm_name),
+                config.username, config.password, config.realm_name,
+                read_only),
             '/users': StoreHandler(
                 stores["user"],
-                config.username, config.password, config.realm_name),
+                config.username, config.password, config.realm_name,
+                read_only),
             '/submissions': StoreHandler(
                 stores["submission"],
-                config.username, config.password, config.realm_name),
+                config.username, config.password, config.realm_name,
+                read_only),
             '/subchanges': StoreHandler(
                 stores["subchange"],
-                config.username, config.password, config.realm_name),
+                config.username, config.password, config.realm_name,
+                read_only),
             '/faces': ImageHandler(
                 os.path.join(config.lib_dir, 'faces', '%(name)s'),
                 os.path.join(config.web_dir, 'img', 'face.png')),
@@ -627,4 +896,8 @@ def main():
         pass
     finally:
         gevent.joinall(list(gevent.spawn(s.stop) for s in servers))
+        # Write the changes still buffered.
+        for store in stores.values():
+            if isinstance(store, Store):
+                store.flush()
     return 0
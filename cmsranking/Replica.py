@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+# Copyright © 2026 agent <agent@local>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import logging
+from urllib.parse import urljoin
+
+import gevent
+import requests
+import requests.exceptions
+
+from cmsranking.Entity import InvalidData, InvalidKey
+
+
+logger = logging.getLogger(__name__)
+
+
+# The stores, in the order in which their entities have to be created
+# (i.e., each one after those it depends on).
+ENTITIES = ["contest", "task", "team", "user", "submission", "subchange"]
+
+# The URL prefixes of the stores.
+URLS = {
+    "contest": "contests/",
+    "task": "tasks/",
+    "team": "teams/",
+    "user": "users/",
+    "submission": "submissions/",
+    "subchange": "subchanges/",
+}
+
+
+def parse_events(lines):
+    """Parse a stream of Server-Sent Events.
+
+    lines (iterable of str): the lines of the stream.
+
+    return (iterable of (str|None, str|None, str)): the ID, the name
+        and the data of each event.
+
+    """
+    id_ = event = None
+    data = list()
+    for line in lines:
+        if line == "":
+            if event is not None or len(data) > 0:
+                yield id_, event, "\n".join(data)
+            event = None
+            data = list()
+            continue
+        field, _, value = line.partition(":")
+        if field == "id":
+            id_ = value
+        elif field == "event":
+            event = value
+        elif field == "data":
+            data.append(value)
+
+
+class Replica:
+    """Keep the stores up to date with those of a primary RWS.
+
+    At first (and whenever it's too late to follow the changes) the
+    whole content of the stores is downloaded from the primary. Then
+    the replica follows the replication stream of the primary, which
+    has an event for each change of an entity, with its new data. The
+    stream is followed from before the download, hence some changes
+    can be applied twice, which is harmless as each event carries the
+    whole data of the entity.
+
+    """
+
+    # Seconds to wait before connecting again after an error.
+    RETRY_DELAY = 5.0
+    # Seconds after which a silent connection is considered lost (the
+    # primary sends a ping every 15 seconds).
+    READ_TIMEOUT = 60.0
+
+    def __init__(self, stores, primary_url):
+        """Create a replica of the given primary.
+
+        stores ({str: Store}): the stores to keep up to date.
+        primary_url (str): the base URL of the primary RWS.
+
+        """
+        self.stores = stores
+        self.primary_url = primary_url
+        # The ID of the last event applied, or None if the stores have
+        # to be downloaded again.
+        self._last_event_id = None
+
+    def run(self):
+        """Follow the primary, forever."""
+        while True:
+            try:
+                if self._last_event_id is None:
+                    self.synchronize()
+                self.follow()
+            except (requests.exceptions.RequestException,
+                    ValueError) as error:
+                logger.warning("Error while replicating %s: %s.",
+                               self.primary_url, error)
+                gevent.sleep(Replica.RETRY_DELAY)
+
+    def _get(self, path, **kwargs):
+        response = requests.get(urljoin(self.primary_url, path),
+                                timeout=Replica.READ_TIMEOUT, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def synchronize(self):
+        """Download the whole content of the stores of the primary."""
+        lists = dict()
+        start = None
+        for entity in ENTITIES:
+            response = self._get(URLS[entity])
+            if start is None:
+                start = float(response.headers["Timestamp"])
+            lists[entity] = response.json()
+
+        for entity in ENTITIES:
+            items = lists[entity].items()
+            if entity == "subchange":
+                # Creating the subchanges in order avoids replaying them.
+                items = sorted(items, key=lambda item: (item[1]["time"],
+                                                        item[0]))
+            for key, data in items:
+                self.apply(entity, {"key": key, "data": data})
+        for entity in reversed(ENTITIES):
+            for key in list(self.stores[entity]._store.keys()):
+                if key not in lists[entity]:
+                    self.apply(entity, {"key": key})
+
+        self._last_event_id = "%x" % int(start * 1_000_000)
+        logger.info("Downloaded the data of %s.", self.primary_url)
+
+    def follow(self):
+        """Apply the changes of the primary as they happen.
+
+        Return when the connection ends, or when the stores have to be
+        downloaded again.
+
+        """
+        response = self._get("replication",
+                             headers={"Accept": "text/event-stream"},
+                             params={"last_event_id": self._last_event_id},
+                             stream=True)
+        with response:
+            lines = response.iter_lines(decode_unicode=True)
+            for id_, event, data in parse_events(lines):
+                if event == "reinit":
+                    logger.warning("Missed some changes of %s.",
+                                   self.primary_url)
+                    self._last_event_id = None
+                    return
+                if event in ENTITIES:
+                    self.apply(event, json.loads(data))
+                if id_ is not None:
+                    self._last_event_id = id_
+
+    def apply(self, entity, record):
+        """Apply a change to a store.
+
+        entity (str): the name of the store.
+        record (dict): the key of the entity and, unless it was
+            deleted, its data.
+
+        """
+        store = self.stores[entity]
+        key = record["key"]
+        try:
+            if "data" not in record:
+                if key in store:
+                    store.delete(key)
+            elif key in store:
+                # Updates are costly for the scores: skip the ones that
+                # were already applied.
+                if store.retrieve(key) != record["data"]:
+                    store.update(key, record["data"])
+            else:
+                store.create(key, record["data"])
+        except (InvalidData, InvalidKey) as error:
+            # The entity may depend on one that was created later, or
+            # deleted, and whose own event will follow.
+            logger.debug("Could not apply change of %s %s: %s.",
+                         entity, key, error)
@@ -18,9 +18,9 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import bisect
 import heapq
 import logging
-from itertools import zip_longest
 
 from cmscommon.constants import \
     SCORE_MODE_MAX, SCORE_MODE_MAX_SUBTASK, SCORE_MODE_MAX_TOKENED_LAST
@@ -33,30 +33,49 @@ class NumberSet:
     """A fast data structure on numbers.
 
     It supports:
-    - inserting a value
-    - removing a value
-    - querying the maximum value
+    - inserting a value, in O(log n)
+    - removing a value, in amortized O(log n)
+    - querying the maximum value, in amortized O(1)
 
     It can hold the same value multiple times.
 
-    This data structure could be implemented with a binary tree, but
-    at the moment we're actually using a standard python list.
+    It's implemented as a binary heap, with removed values kept aside
+    (and counted) until they reach the top of the heap.
 
     """
     def __init__(self):
-        self._impl = list()
+        # The opposites of the values, as heapq implements a min-heap.
+        self._heap = list()
+        # Type: {float: int}
+        self._removed = dict()
+        self._len = 0
+
+    def __len__(self):
+        return self._len
 
     def insert(self, val):
-        self._impl.append(val)
+        heapq.heappush(self._heap, -val)
+        self._len += 1
 
     def remove(self, val):
-        self._impl.remove(val)
-
-    def query(self):
-        return max(self._impl + [0.0])
+        if self._len == 0:
+            raise ValueError("Value not in the set.")
+        self._removed[val] = self._removed.get(val, 0) + 1
+        self._len -= 1
+
+    def query(self, default=0.0):
+        """Return the maximum value, or default if there is none."""
+        while len(self._heap) > 0 and -self._heap[0] in self._removed:
+            val = -heapq.heappop(self._heap)
+            self._removed[val] -= 1
+            if self._removed[val] == 0:
+                del self._removed[val]
+        return -self._heap[0] if len(self._heap) > 0 else default
 
     def clear(self):
-        del self._impl[:]
+        del self._heap[:]
+        self._removed.clear()
+        self._len = 0
 
 
 class Score:
@@ -66,6 +85,12 @@ class Score:
     user/task.  It gets notified in case a submission is created,
     updated and deleted.
 
+    The score is kept up to date using the maximum of the scores of
+    the submissions, of the released ones, and of each subtask, so
+    that a change is applied in O(log n). Each applied change records
+    what it modified, so that a change arriving out of order undoes
+    only the changes after it, and applies them again.
+
     """
     # We assume that the submissions will all have different times,
     # since cms enforces a minimum delay between two submissions of
@@ -78,12 +103,25 @@ class Score:
         # The submissions in their current status.
         self._submissions = dict()
 
-        # The list of changes of the submissions.
+        # The list of changes of the submissions, sorted by time and
+        # key, and their (time, key) pairs.
         self._changes = list()
+        self._change_keys = list()
+
+        # For each applied change, the status it modified: the
+        # submission with its old score, token and extra, the old last
+        # submission and the length of the history.
+        self._undo = list()
+
+        # The set of the scores of all the submissions.
+        self._scores = NumberSet()
 
         # The set of the scores of the currently released submissions.
         self._released = NumberSet()
 
+        # For each subtask, the set of the scores of the submissions.
+        self._subtask_scores = list()
+
         # The last submitted submission (with at least one subchange).
         self._last = None
 
@@ -91,109 +129,174 @@ class Score:
         # object).
         self._history = list()
 
-        self._score_mode = score_mode
+        # The number of entries at the beginning of the history that
+        # didn't change since the last call to pop_kept_history.
+        self._kept_history = 0
 
-    def append_change(self, change):
-        # Remove from released submission (if needed), apply changes,
-        # add back to released submissions (if needed) and check if
-        # it's the last. Compute the new score and, if it changed,
-        # append it to the history.
-        s_id = change.submission
-        if self._submissions[s_id].token:
-            self._released.remove(self._submissions[s_id].score)
-        if change.score is not None:
-            self._submissions[s_id].score = change.score
-        if change.token is not None:
-            self._submissions[s_id].token = change.token
-        if change.extra is not None:
-            self._submissions[s_id].extra = change.extra
-        if self._submissions[s_id].token:
-            self._released.insert(self._submissions[s_id].score)
-        if change.score is not None and \
-                (self._last is None or
-                 self._submissions[s_id].time > self._last.time):
-            self._last = self._submissions[s_id]
+        self._score_mode = score_mode
 
+    def _add_to_sets(self, submission):
+        self._scores.insert(submission.score)
+        if submission.token:
+            self._released.insert(submission.score)
+        for idx, score in enumerate(submission.extra or []):
+            if idx == len(self._subtask_scores):
+                self._subtask_scores.append(NumberSet())
+            self._subtask_scores[idx].insert(float(score))
+
+    def _remove_from_sets(self, submission):
+        self._scores.remove(submission.score)
+        if submission.token:
+            self._released.remove(submission.score)
+        for idx, score in enumerate(submission.extra or []):
+            self._subtask_scores[idx].remove(float(score))
+
+    def _compute_score(self):
         if self._score_mode == SCORE_MODE_MAX:
-            score = max((submission.score
-                         for submission in self._submissions.values()),
-                        default=0.0)
+            return self._scores.query()
         elif self._score_mode == SCORE_MODE_MAX_SUBTASK:
-            scores_by_submission = (map(float, s.extra or [])
-                                    for s in self._submissions.values())
-            scores_by_subtask = zip_longest(*scores_by_submission,
-                                            fillvalue=0.0)
-            score = float(sum(max(s) for s in scores_by_subtask))
+            return float(sum(scores.query()
+                             for scores in self._subtask_scores))
         elif self._score_mode == SCORE_MODE_MAX_TOKENED_LAST:
-            score = max(self._released.query(),
-                        self._last.score if self._last is not None else 0.0)
+            return max(self._released.query(),
+                       self._last.score if self._last is not None else 0.0,
+                       0.0)
         else:
             raise ValueError("Unexpected score mode '%s'" % self._score_mode)
 
+    def append_change(self, change):
+        # Remove from the sets, apply changes, add back to the sets and
+        # check if it's the last. Compute the new score and, if it
+        # changed, append it to the history.
+        submission = self._submissions[change.submission]
+        self._undo.append((submission, submission.score, submission.token,
+                           submission.extra, self._last, len(self._history)))
+        self._remove_from_sets(submission)
+        if change.score is not None:
+            submission.score = change.score
+        if change.token is not None:
+            submission.token = change.token
+        if change.extra is not None:
+            submission.extra = change.extra
+        self._add_to_sets(submission)
+        if change.score is not None and \
+                (self._last is None or submission.time > self._last.time):
+            self._last = submission
+
+        score = self._compute_score()
         if score != self.get_score():
             self._history.append((change.time, score))
 
+    def _undo_changes(self, idx):
+        # Undo the changes from the idx-th on, in reverse order.
+        while len(self._undo) > idx:
+            submission, score, token, extra, last, history_len = \
+                self._undo.pop()
+            self._remove_from_sets(submission)
+            submission.score = score
+            submission.token = token
+            submission.extra = extra
+            self._add_to_sets(submission)
+            self._last = last
+            if history_len < len(self._history):
+                self._kept_history = min(self._kept_history, history_len)
+                del self._history[history_len:]
+
+    def _replay_changes(self, idx):
+        # Undo the changes from the idx-th on and apply them again.
+        self._undo_changes(idx)
+        for change in self._changes[idx:]:
+            self.append_change(change)
+
     def get_score(self):
         return self._history[-1][1] if len(self._history) > 0 else 0.0
 
+    def pop_kept_history(self):
+        """Return how many entries of the history are unchanged.
+
+        return (int): the number of entries at the beginning of the
+            history that didn't change since the last call.
+
+        """
+        kept = self._kept_history
+        self._kept_history = len(self._history)
+        return kept
+
     def reset_history(self):
         # Delete everything except the submissions and the subchanges.
         self._last = None
+        self._scores.clear()
         self._released.clear()
+        del self._subtask_scores[:]
+        del self._undo[:]
         del self._history[:]
+        self._kept_history = 0
 
         # Reset the submissions at their default value.
         for sub in self._submissions.values():
             sub.score = 0.0
             sub.token = False
             sub.extra = list()
+            self._add_to_sets(sub)
 
         # Append each change, one at a time.
         for change in self._changes:
             self.append_change(change)
 
+    def _find_change(self, key):
+        for idx, change in enumerate(self._changes):
+            if change.key == key:
+                return idx
+        raise KeyError(key)
+
     def create_subchange(self, key, subchange):
         # Insert the subchange at the right position inside the
-        # (sorted) list and call the appropriate method (append_change
-        # or reset_history)
-        if len(self._changes) == 0 or \
-                subchange.time > self._changes[-1].time or \
-                (subchange.time == self._changes[-1].time and
-                 subchange.key > self._changes[-1].key):
-            self._changes.append(subchange)
+        # (sorted) list and apply it (together with the following
+        # ones, if any).
+        change_key = (subchange.time, key)
+        idx = bisect.bisect(self._change_keys, change_key)
+        self._changes.insert(idx, subchange)
+        self._change_keys.insert(idx, change_key)
+        if idx == len(self._changes) - 1:
             self.append_change(subchange)
         else:
-            for idx, val in enumerate(self._changes):
-                if subchange.time < val.time or \
-                   (subchange.time == val.time and subchange.key < val.key):
-                    self._changes.insert(idx, subchange)
-                    break
-            self.reset_history()
-            logger.info("Reset history for user '%s' and task '%s' after "
-                        "creating subchange '%s' for submission '%s'",
+            self._replay_changes(idx)
+            logger.info("Replayed %d changes for user '%s' and task '%s' "
+                        "after creating subchange '%s' for submission '%s'",
+                        len(self._changes) - idx,
                         self._submissions[subchange.submission].user,
                         self._submissions[subchange.submission].task,
                         key, subchange.submission)
 
     def update_subchange(self, key, subchange):
-        # Update the subchange inside the (sorted) list and,
-        # regardless of its position in that list, reset the history.
-        for i in range(len(self._changes)):
-            if self._changes[i].key == key:
-                self._changes[i] = subchange
-        self.reset_history()
-        logger.info("Reset history for user '%s' and task '%s' after "
-                    "creating subchange '%s' for submission '%s'",
+        # Remove the subchange from the (sorted) list and insert it
+        # again, replaying the changes from the first position it
+        # affected.
+        old_idx = self._find_change(key)
+        del self._changes[old_idx]
+        del self._change_keys[old_idx]
+        change_key = (subchange.time, key)
+        new_idx = bisect.bisect(self._change_keys, change_key)
+        self._changes.insert(new_idx, subchange)
+        self._change_keys.insert(new_idx, change_key)
+        idx = min(old_idx, new_idx)
+        self._replay_changes(idx)
+        logger.info("Replayed %d changes for user '%s' and task '%s' after "
+                    "updating subchange '%s' for submission '%s'",
+                    len(self._changes) - idx,
                     self._submissions[subchange.submission].user,
                     self._submissions[subchange.submission].task,
                     key, subchange.submission)
 
     def delete_subchange(self, key):
-        # Delete the subchange from the (sorted) list and reset the
-        # history.
-        self._changes = [c for c in self._changes if c.key != key]
-        self.reset_history()
-        logger.info("Reset history after deleting subchange '%s'", key)
+        # Delete the subchange from the (sorted) list and replay the
+        # changes after it.
+        idx = self._find_change(key)
+        del self._changes[idx]
+        del self._change_keys[idx]
+        self._replay_changes(idx)
+        logger.info("Replayed %d changes after deleting subchange '%s'",
+                    len(self._changes) - idx, key)
 
     def create_submission(self, key, submission):
         # A new submission never triggers an update in the history,
@@ -202,6 +305,7 @@ class Score:
         submission.token = False
         submission.extra = list()
         self._submissions[key] = submission
+        self._add_to_sets(submission)
 
     def update_submission(self, key, submission):
         # An updated submission may cause an update in history because
@@ -217,7 +321,10 @@ class Score:
         if key in self._submissions:
             del self._submissions[key]
             # Delete all its subchanges.
-            self._changes = [c for c in self._changes if c.submission != key]
+            kept = [idx for idx, change in enumerate(self._changes)
+                    if change.submission != key]
+            self._changes = [self._changes[idx] for idx in kept]
+            self._change_keys = [self._change_keys[idx] for idx in kept]
             self.reset_history()
 
     def update_score_mode(self, score_mode):
@@ -255,6 +362,14 @@ class ScoringStore:
         self._scores = dict()
         self._callbacks = list()
 
+        # The global history, as returned by get_global_history, or
+        # None if it has to be computed again; the number of entries
+        # of the history of each Score it includes; and a counter
+        # increased every time it changes.
+        self._history = list()
+        self._history_lengths = dict()
+        self.history_version = 0
+
     def init_store(self):
         """Load the scores from the stores.
 
@@ -264,7 +379,9 @@ class ScoringStore:
         """
         for key, value in self.submission_store._store.items():
             self.create_submission(key, value)
-        for key, value in sorted(self.subchange_store._store.items()):
+        # Creating the subchanges in their order avoids replaying them.
+        for key, value in sorted(self.subchange_store._store.items(),
+                                 key=lambda item: (item[1].time, item[0])):
             self.create_subchange(key, value)
 
     def add_score_callback(self, callback):
@@ -292,6 +409,7 @@ class ScoringStore:
         old_score = score_obj.get_score()
         score_obj.create_submission(key, submission)
         new_score = score_obj.get_score()
+        self._update_history(submission.user, submission.task, score_obj)
         if old_score != new_score:
             self.notify_callbacks(submission.user, submission.task, new_score)
 
@@ -311,6 +429,7 @@ class ScoringStore:
         score_obj.update_submission(key, submission)
         score_obj.update_score_mode(task["score_mode"])
         new_score = score_obj.get_score()
+        self._update_history(submission.user, submission.task, score_obj)
         if old_score != new_score:
             self.notify_callbacks(submission.user, submission.task, new_score)
 
@@ -319,12 +438,16 @@ class ScoringStore:
         old_score = score_obj.get_score()
         score_obj.delete_submission(key)
         new_score = score_obj.get_score()
+        self._update_history(submission.user, submission.task, score_obj)
         if old_score != new_score:
             self.notify_callbacks(submission.user, submission.task, new_score)
 
         if len(self._scores[submission.user][submission.task]
                ._submissions) == 0:
             del self._scores[submission.user][submission.task]
+            if self._history_lengths.pop(
+                    (submission.user, submission.task), 0) > 0:
+                self._history = None
         if len(self._scores[submission.user]) == 0:
             del self._scores[submission.user]
 
@@ -334,6 +457,7 @@ class ScoringStore:
         old_score = score_obj.get_score()
         score_obj.create_subchange(key, subchange)
         new_score = score_obj.get_score()
+        self._update_history(submission.user, submission.task, score_obj)
         if old_score != new_score:
             self.notify_callbacks(submission.user, submission.task, new_score)
 
@@ -348,6 +472,7 @@ class ScoringStore:
         old_score = score_obj.get_score()
         score_obj.update_subchange(key, subchange)
         new_score = score_obj.get_score()
+        self._update_history(submission.user, submission.task, score_obj)
         if old_score != new_score:
             self.notify_callbacks(submission.user, submission.task, new_score)
 
@@ -362,9 +487,45 @@ class ScoringStore:
         old_score = score_obj.get_score()
         score_obj.delete_subchange(key)
         new_score = score_obj.get_score()
+        self._update_history(submission.user, submission.task, score_obj)
         if old_score != new_score:
             self.notify_callbacks(submission.user, submission.task, new_score)
 
+    def _update_history(self, user, task, score_obj):
+        """Bring the global history up to date with a changed Score.
+
+        If the history of the Score only got new entries, and they come
+        after all the others, they are appended to the global history;
+        otherwise the global history is discarded, to be computed again
+        when needed.
+
+        user (str): the user of the Score.
+        task (str): the task of the Score.
+        score_obj (Score): the Score that changed.
+
+        """
+        kept = score_obj.pop_kept_history()
+        history = score_obj._history
+        included = self._history_lengths.get((user, task), 0)
+        if kept == included == len(history):
+            return
+        self._history_lengths[(user, task)] = len(history)
+        self.history_version += 1
+
+        if self._history is None:
+            return
+        if kept < included:
+            self._history = None
+            return
+        for time, score in history[included:]:
+            if len(self._history) > 0:
+                l_user, l_task, l_time, l_score = self._history[-1]
+                if ((time, score), user, task) < \
+                        ((l_time, l_score), l_user, l_task):
+                    self._history = None
+                    return
+            self._history.append((user, task, time, score))
+
     def get_score(self, user, task):
         if user not in self._scores or task not in self._scores[user]:
             # We may want to raise an exception to distinguish between
@@ -378,6 +539,21 @@ class ScoringStore:
         return self._scores[user][task]._submissions
 
     def get_global_history(self):
+        """Return the global history of all score changes.
+
+        The global history is kept up to date as the scores change, and
+        computed again only when the individual histories change in the
+        past. The caller must not modify it.
+
+        return ([(str, str, int, float)]): the score changes, sorted by
+            time, in the form (user_id, task_id, time, score).
+
+        """
+        if self._history is None:
+            self._history = list(self._merge_histories())
+        return self._history
+
+    def _merge_histories(self):
         """Merge all individual histories into a global one.
 
         Take all per-user/per-task histories and merge them, providing
@@ -16,14 +16,14 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-import json
 import logging
-import os
 import re
 
-from gevent.lock import RLock
+import gevent
+from gevent.lock import RLock, Semaphore
 
 from cmsranking.Entity import Entity, InvalidKey, InvalidData
+from cmsranking.Journal import Journal
 
 
 logger = logging.getLogger(__name__)
@@ -43,7 +43,15 @@ class Store:
     get notified when something changes by providing appropriate
     callbacks.
 
+    Changes are made persistent by a journal (see Journal), written in
+    batches every FLUSH_INTERVAL seconds by a background greenlet, so
+    that requests do not wait for the disk.
+
     """
+
+    # How often the changes are written to the disk, in seconds.
+    FLUSH_INTERVAL = 0.5
+
     def __init__(self, entity, path, all_stores, depends=None):
         """Initialize an empty EntityStore.
 
@@ -58,7 +66,8 @@ class Store:
             raise ValueError("The 'entity' parameter "
                              "isn't a subclass of Entity")
         self._entity = entity
-        self._path = path
+        self._journal = Journal(path)
+        self._flush_lock = Semaphore()
         self._all_stores = all_stores
         self._depends = depends if depends is not None else []
         self._store = dict()
@@ -67,34 +76,66 @@ class Store:
         self._delete_callbacks = list()
 
     def load_from_disk(self):
-        """Load the initial data for this store from the disk.
+        """Load the initial data for this store from the disk, and
+        start writing the changes to it.
 
         """
         try:
-            os.mkdir(self._path)
+            data = self._journal.load()
         except OSError:
-            # it's ok: it means the directory already exists
-            pass
-
-        try:
-            for name in os.listdir(self._path):
-                # TODO check that the key is '[A-Za-z0-9_]+'
-                if name[-5:] == '.json' and name[:-5] != '':
-                    with open(os.path.join(self._path, name), 'rb') as rec:
-                        item = self._entity()
-                        item.set(json.load(rec))
-                        item.key = name[:-5]
-                        self._store[name[:-5]] = item
-        except OSError:
-            # the path isn't a directory or is inaccessible
+            # the path isn't a directory or is inaccessible; the journal
+            # stays closed, and the changes are not recorded
             logger.error("Path is not a directory or is not accessible "
                          "(or other I/O error occurred)", exc_info=True)
-        except ValueError:
-            logger.error("Invalid JSON", exc_info=False,
-                         extra={'location': os.path.join(self._path, name)})
-        except InvalidData as exc:
-            logger.error(str(exc), exc_info=False,
-                         extra={'location': os.path.join(self._path, name)})
+            return
+
+        for key, value in data.items():
+            # TODO check that the key is '[A-Za-z0-9_]+'
+            try:
+                item = self._entity()
+                item.set(value)
+            except InvalidData as exc:
+                logger.error(str(exc), exc_info=False,
+                             extra={'location': key})
+                continue
+            item.key = key
+            self._store[key] = item
+
+        gevent.spawn(self._flush_loop)
+
+    def _flush_loop(self):
+        """Write the changes to the disk, forever."""
+        while True:
+            gevent.sleep(Store.FLUSH_INTERVAL)
+            self.flush()
+
+    def flush(self):
+        """Write the changes made so far to the disk.
+
+        When the journal gets compacted, the new snapshot is written
+        in a thread, without holding the lock, so that the other
+        requests are not blocked meanwhile.
+
+        """
+        with self._flush_lock:
+            with LOCK:
+                if not self._journal.needs_compaction(len(self._store)):
+                    try:
+                        self._journal.flush()
+                    except OSError:
+                        logger.error("I/O error occured while writing the "
+                                     "store", exc_info=True)
+                    return
+                data = self.retrieve_list()
+                compaction = self._journal.begin_compaction()
+            try:
+                gevent.get_hub().threadpool.apply(
+                    self._journal.write_snapshot, (compaction, data))
+                with LOCK:
+                    self._journal.end_compaction(compaction)
+            except OSError:
+                logger.error("I/O error occured while writing the store",
+                             exc_info=True)
 
     def add_create_callback(self, callback):
         """Add a callback to be called when entities are created.
@@ -153,13 +194,7 @@ class Store:
             for callback in self._create_callbacks:
                 callback(key, item)
             # reflect changes on the persistent storage
-            try:
-                path = os.path.join(self._path, key + '.json')
-                with open(path, 'wt', encoding="utf-8") as rec:
-                    json.dump(self._store[key].get(), rec)
-            except OSError:
-                logger.error("I/O error occured while creating entity",
-                             exc_info=True)
+            self._journal.put(key, self._store[key].get())
 
     def update(self, key, data):
         """Update an entity.
@@ -192,13 +227,7 @@ class Store:
             for callback in self._update_callbacks:
                 callback(key, old_item, item)
             # reflect changes on the persistent storage
-            try:
-                path = os.path.join(self._path, key + '.json')
-                with open(path, 'wt', encoding="utf-8") as rec:
-                    json.dump(self._store[key].get(), rec)
-            except OSError:
-                logger.error("I/O error occured while updating entity",
-                             exc_info=True)
+            self._journal.put(key, self._store[key].get())
 
     def merge_list(self, data_dict):
         """Merge a list of entities.
@@ -246,14 +275,7 @@ class Store:
                     for callback in self._update_callbacks:
                         callback(key, old_value, value)
                 # reflect changes on the persistent storage
-                try:
-                    path = os.path.join(self._path, key + '.json')
-                    with open(path, 'wt', encoding="utf-8") as rec:
-                        json.dump(value.get(), rec)
-                except OSError:
-                    logger.error(
-                        "I/O error occured while merging entity lists",
-                        exc_info=True)
+                self._journal.put(key, value.get())
 
     def delete(self, key):
         """Delete an entity.
@@ -282,10 +304,7 @@ class Store:
             for callback in self._delete_callbacks:
                 callback(key, old_value)
             # reflect changes on the persistent storage
-            try:
-                os.remove(os.path.join(self._path, key + '.json'))
-            except OSError:
-                logger.error("Unable to delete entity", exc_info=True)
+            self._journal.delete(key)
 
     def delete_list(self):
         """Delete all entities.
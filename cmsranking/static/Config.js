@@ -73,4 +73,8 @@ var Config = new function () {
     self.get_history_url = function () {
         return "history";
     }
+
+    self.get_snapshot_url = function () {
+        return "snapshot";
+    };
 };
@@ -779,23 +779,64 @@ var DataStore = new function () {
     ////// Initialization
 
     /* The init process works this way:
-       - we start init_contests() and init_teams()
-       - they each start an asynchronous AJAX request
-       - when the requests end their data is processed and then, respectively,
-         init_tasks() and init_users() are called
-       - they also start an AJAX request and process its data
-       - when BOTH requests finish init_scores() is called
-       - it does again an AJAX request and processes its data
-       - at the end it calls init_ranks() which calls init_selections() which,
-         in turn, calls init_callback()
+       - we request the snapshot, which contains all the entities and the
+         scores, computed by the server at a single point in time
+       - we process its data and then call init_ranks() which calls
+         init_selections() which, in turn, calls init_callback()
+       - if the snapshot is not available (e.g., an older server), we
+         fall back to requesting each kind of data on its own:
+         - we start init_contests() and init_teams()
+         - they each start an asynchronous AJAX request
+         - when the requests end their data is processed and then,
+           respectively, init_tasks() and init_users() are called
+         - they also start an AJAX request and process its data
+         - when BOTH requests finish init_scores() is called
+         - it does again an AJAX request and processes its data
+         - at the end it calls init_ranks()
      */
 
     self.init = function (callback) {
         self.inits_todo = 2;
         self.init_callback = callback;
 
-        self.init_contests();
-        self.init_teams();
+        $.ajax({
+            url: Config.get_snapshot_url(),
+            dataType: "json",
+            success: self.init_from_snapshot,
+            error: function () {
+                console.info("Snapshot not available, requesting each list");
+                self.init_contests();
+                self.init_teams();
+            }
+        });
+    };
+
+    self.init_from_snapshot = function (data) {
+        var timestamp = data["timestamp"];
+        self.contest_init_time = timestamp;
+        self.task_init_time = timestamp;
+        self.team_init_time = timestamp;
+        self.user_init_time = timestamp;
+        self.score_init_time = timestamp;
+
+        for (var key in data["contests"]) {
+            self.create_contest(key, data["contests"][key]);
+        }
+        for (var key in data["tasks"]) {
+            self.create_task(key, data["tasks"][key]);
+        }
+        for (var key in data["teams"]) {
+            self.create_team(key, data["teams"][key]);
+        }
+        for (var key in data["users"]) {
+            self.create_user(key, data["users"][key]);
+        }
+        for (var u_id in data["scores"]) {
+            for (var t_id in data["scores"][u_id]) {
+                self.set_score(u_id, t_id, data["scores"][u_id][t_id]);
+            }
+        }
+        self.init_ranks();
     };
 
 
@@ -823,6 +864,7 @@ var DataStore = new function () {
         self.es.addEventListener("open", self.es_open_handler, false);
         self.es.addEventListener("error", self.es_error_handler, false);
         self.es.addEventListener("reload", self.es_reload_handler, false);
+        self.es.addEventListener("reinit", self.es_reload_handler, false);
         self.es.addEventListener("contest", function (event) {
             var timestamp = parseInt(event.lastEventId, 16) / 1000000;
             if (timestamp > self.contest_init_time) {
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+# Copyright © 2026 agent <agent@local>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the eventsource module."""
+
+import unittest
+from unittest.mock import patch
+
+from cmscommon.eventsource import Publisher
+
+
+class TestPublisher(unittest.TestCase):
+
+    def test_unbounded(self):
+        publisher = Publisher(10)
+        subscriber = publisher.get_subscriber()
+        for i in range(100):
+            publisher.put("score", "%d" % i)
+        self.assertEqual(len(list(subscriber.get())), 100)
+
+    def test_overflow(self):
+        publisher = Publisher(10, queue_size=5)
+        slow = publisher.get_subscriber()
+        fast = publisher.get_subscriber()
+        for i in range(5):
+            publisher.put("score", "%d" % i)
+        self.assertEqual(len(list(fast.get())), 5)
+
+        publisher.put("score", "5")
+        # The slow subscriber only gets told to reinit, now and later.
+        self.assertEqual(list(slow.get()), [Publisher.REINIT_MESSAGE])
+        publisher.put("score", "6")
+        self.assertEqual(slow._queue.qsize(), 0)
+        messages = list(fast.get())
+        self.assertEqual(len(messages), 2)
+        self.assertTrue(messages[1].endswith(b"data:6\n\n"))
+
+    @patch("cmscommon.eventsource.time.time",
+           side_effect=[0.0, 1.0, 2.0, 3.0, 4.0])
+    def test_resume_too_far_behind(self, _):
+        publisher = Publisher(10, queue_size=2)
+        for i in range(4):
+            publisher.put("score", "%d" % i)
+        # Two messages fit in the queue, three don't.
+        subscriber = publisher.get_subscriber("%x" % 2_000_000)
+        self.assertEqual(len(list(subscriber.get())), 2)
+        subscriber = publisher.get_subscriber("%x" % 1_000_000)
+        self.assertEqual(list(subscriber.get()), [Publisher.REINIT_MESSAGE])
+
+    def test_resume(self):
+        publisher = Publisher(10)
+        publisher.put("score", "0")
+        subscriber = publisher.get_subscriber()
+        publisher.put("score", "1")
+        last_event_id = list(subscriber.get())[0].split(b"\n")[0][3:]
+        publisher.put("score", "2")
+        messages = list(publisher.get_subscriber(
+            last_event_id.decode("ascii")).get())
+        self.assertEqual(len(messages), 1)
+        self.assertTrue(messages[0].endswith(b"data:2\n\n"))
+
+    def test_resume_from_other_publisher(self):
+        # The ID comes from another publisher, e.g. another instance
+        # of the server: the events it sent are not known.
+        publisher = Publisher(10)
+        other_publisher = Publisher(10)
+        other_publisher._epoch = "%x" % 1
+        subscriber = other_publisher.get_subscriber()
+        other_publisher.put("score", "0")
+        last_event_id = list(subscriber.get())[0].split(b"\n")[0][3:]
+        subscriber = publisher.get_subscriber(last_event_id.decode("ascii"))
+        self.assertEqual(list(subscriber.get()), [Publisher.REINIT_MESSAGE])
+
+    def test_resume_from_empty_cache(self):
+        # No message was sent yet, hence none was missed.
+        publisher = Publisher(10)
+        subscriber = publisher.get_subscriber(
+            "%x" % publisher._cache_start)
+        publisher.put("score", "0")
+        messages = list(subscriber.get())
+        self.assertEqual(len(messages), 1)
+        self.assertTrue(messages[0].endswith(b"data:0\n\n"))
+
+
+if __name__ == "__main__":
+    unittest.main()
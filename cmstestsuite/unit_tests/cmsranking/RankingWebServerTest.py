@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+# Copyright © 2026 agent <agent@local>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the handlers of the ranking web server."""
+
+import gzip
+import json
+import os
+import unittest
+from unittest.mock import Mock, patch
+
+from werkzeug.test import Client
+from werkzeug.wrappers import BaseResponse
+
+from cmscommon.constants import SCORE_MODE_MAX
+from cmsranking.Contest import Contest
+from cmsranking.RankingWebServer import DataWatcher, HistoryHandler, \
+    ReplicationWatcher, SnapshotHandler, StoreHandler
+from cmsranking.Replica import ENTITIES, Replica, URLS, parse_events
+from cmsranking.Scoring import ScoringStore
+from cmsranking.Store import Store
+from cmsranking.Subchange import Subchange
+from cmsranking.Submission import Submission
+from cmsranking.Task import Task
+from cmsranking.Team import Team
+from cmsranking.User import User
+from cmstestsuite.unit_tests.filesystemmixin import FileSystemMixin
+
+
+def make_stores(path):
+    """Create the stores of the ranking, as RankingWebServer does."""
+    os.mkdir(path)
+    stores = dict()
+    stores["subchange"] = Store(
+        Subchange, os.path.join(path, 'subchanges'), stores)
+    stores["submission"] = Store(
+        Submission, os.path.join(path, 'submissions'), stores,
+        [stores["subchange"]])
+    stores["user"] = Store(
+        User, os.path.join(path, 'users'), stores,
+        [stores["submission"]])
+    stores["team"] = Store(
+        Team, os.path.join(path, 'teams'), stores,
+        [stores["user"]])
+    stores["task"] = Store(
+        Task, os.path.join(path, 'tasks'), stores,
+        [stores["submission"]])
+    stores["contest"] = Store(
+        Contest, os.path.join(path, 'contests'), stores,
+        [stores["task"]])
+    for name in ["contest", "task", "team", "user", "submission",
+                 "subchange"]:
+        stores[name].load_from_disk()
+    stores["scoring"] = ScoringStore(stores)
+    stores["scoring"].init_store()
+    return stores
+
+
+class RankingMixin(FileSystemMixin):
+    """Provide the stores of the ranking, with a contest and a task."""
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch("cmsranking.Store.gevent.spawn")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.stores = make_stores(self.get_path("ranking"))
+
+        self.stores["contest"].create("c", {
+            "name": "C", "begin": 0, "end": 1000, "score_precision": 2})
+        self.stores["task"].create("t", {
+            "name": "T", "short_name": "t", "contest": "c",
+            "max_score": 100.0, "score_precision": 2, "extra_headers": [],
+            "score_mode": SCORE_MODE_MAX, "order": 0})
+        for user in ["u1", "u2"]:
+            self.stores["user"].create(user, {
+                "f_name": user, "l_name": "", "team": None})
+
+    def add_submission(self, key, user, time):
+        self.stores["submission"].create(key, {
+            "user": user, "task": "t", "time": time})
+
+    def add_subchange(self, key, submission, time, score):
+        self.stores["subchange"].create(key, {
+            "submission": submission, "time": time, "score": score,
+            "extra": []})
+
+
+class TestGlobalHistory(RankingMixin, unittest.TestCase):
+
+    def assertHistoryConsistent(self):
+        scoring = self.stores["scoring"]
+        self.assertEqual(scoring.get_global_history(),
+                         list(scoring._merge_histories()))
+
+    def test_appended(self):
+        self.add_submission("s1", "u1", 10)
+        self.add_subchange("c1", "s1", 10, 50.0)
+        self.assertHistoryConsistent()
+        history = self.stores["scoring"].get_global_history()
+
+        self.add_submission("s2", "u2", 20)
+        self.add_subchange("c2", "s2", 20, 30.0)
+        # The new entry was appended to the same list.
+        self.assertIs(self.stores["scoring"].get_global_history(), history)
+        self.assertEqual(history, [("u1", "t", 10, 50.0),
+                                   ("u2", "t", 20, 30.0)])
+
+    def test_changed_in_the_past(self):
+        self.add_submission("s1", "u1", 10)
+        self.add_submission("s2", "u2", 20)
+        self.add_subchange("c2", "s2", 20, 30.0)
+        self.add_subchange("c1", "s1", 10, 50.0)
+        self.assertHistoryConsistent()
+        version = self.stores["scoring"].history_version
+
+        self.stores["subchange"].update("c1", {
+            "submission": "s1", "time": 5, "score": 40.0, "extra": []})
+        self.assertHistoryConsistent()
+        self.stores["subchange"].delete("c2")
+        self.assertHistoryConsistent()
+        self.stores["submission"].delete("s2")
+        self.assertHistoryConsistent()
+        self.assertGreater(self.stores["scoring"].history_version, version)
+
+
+class TestHistoryHandler(RankingMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.handler = HistoryHandler(self.stores)
+        self.client = Client(self.handler, BaseResponse)
+
+    def get(self, headers=None):
+        headers = dict(headers or {})
+        headers["Accept"] = "application/json"
+        return self.client.get("/history", headers=headers)
+
+    def test_etag(self):
+        self.add_submission("s1", "u1", 10)
+        self.add_subchange("c1", "s1", 10, 50.0)
+        response = self.get()
+        self.assertEqual(json.loads(response.data.decode()),
+                         [["u1", "t", 10, 50.0]])
+        etag = response.headers["ETag"]
+        with patch("cmsranking.RankingWebServer.json.dumps") as dumps:
+            self.assertEqual(
+                self.get({"If-None-Match": etag}).status_code, 304)
+            dumps.assert_not_called()
+
+        self.add_subchange("c2", "s1", 20, 60.0)
+        response = self.get({"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+        self.assertEqual(json.loads(response.data.decode()),
+                         [["u1", "t", 10, 50.0], ["u1", "t", 20, 60.0]])
+
+    def test_gzip(self):
+        self.add_submission("s1", "u1", 10)
+        self.add_subchange("c1", "s1", 10, 50.0)
+        plain_response = self.get()
+        response = self.get({"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.data), plain_response.data)
+        self.assertNotEqual(response.headers["ETag"],
+                            plain_response.headers["ETag"])
+
+
+class TestSnapshotHandler(RankingMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.handler = SnapshotHandler(self.stores)
+        self.client = Client(self.handler, BaseResponse)
+
+    def get(self, headers=None):
+        headers = dict(headers or {})
+        headers["Accept"] = "application/json"
+        return self.client.get("/snapshot", headers=headers)
+
+    def test_content(self):
+        self.add_submission("s1", "u1", 10)
+        self.add_subchange("c1", "s1", 10, 50.0)
+
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        snapshot = json.loads(response.data.decode("utf-8"))
+        for entity in ["contest", "task", "team", "user"]:
+            self.assertEqual(snapshot[entity + "s"],
+                             self.stores[entity].retrieve_list())
+        self.assertEqual(snapshot["scores"], {"u1": {"t": 50.0}})
+        # The history is served by HistoryHandler.
+        self.assertNotIn("history", snapshot)
+        self.assertEqual(float(response.headers["Timestamp"]),
+                         snapshot["timestamp"])
+
+    def test_etag(self):
+        response = self.get()
+        etag = response.headers["ETag"]
+        self.assertEqual(
+            self.get({"If-None-Match": etag}).status_code, 304)
+
+        # The snapshot changes with the entities and the scores.
+        self.stores["team"].create("team", {"name": "Team"})
+        response = self.get({"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+        self.assertIn("team", json.loads(response.data.decode())["teams"])
+
+        etag = response.headers["ETag"]
+        self.add_submission("s1", "u1", 10)
+        self.add_subchange("c1", "s1", 10, 50.0)
+        response = self.get({"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data.decode())["scores"],
+                         {"u1": {"t": 50.0}})
+
+    def test_gzip(self):
+        plain_response = self.get()
+        response = self.get({"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.data), plain_response.data)
+
+        # Each encoding has its own ETag.
+        etag = response.headers["ETag"]
+        self.assertNotEqual(etag, plain_response.headers["ETag"])
+        self.assertEqual(
+            self.get({"Accept-Encoding": "gzip",
+                      "If-None-Match": etag}).status_code, 304)
+        self.assertEqual(
+            self.get({"If-None-Match": etag}).status_code, 200)
+
+    def test_not_rebuilt(self):
+        self.get()
+        with patch("cmsranking.RankingWebServer.json.dumps") as dumps:
+            self.get()
+            dumps.assert_not_called()
+            # Only the changed part is serialized again.
+            self.stores["team"].create("team", {"name": "Team"})
+            dumps.return_value = "{}"
+            self.get()
+            dumps.assert_called_once_with({"team": {"name": "Team"}})
+
+
+class TestDataWatcher(RankingMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch("cmsranking.RankingWebServer.gevent.spawn_later")
+        self.spawn_later = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.watcher = DataWatcher(self.stores, 100, score_interval=1.0)
+        self.subscriber = self.watcher._pub.get_subscriber()
+        self.add_submission("s1", "u1", 10)
+        self.add_submission("s2", "u2", 20)
+
+    def events(self):
+        if self.subscriber._queue.empty():
+            return []
+        return [msg.decode("utf-8").split("\n", 1)[1]
+                for msg in self.subscriber.get()]
+
+    def test_coalesced(self):
+        self.add_subchange("c1", "s1", 10, 50.0)
+        self.add_subchange("c2", "s2", 20, 30.0)
+        self.add_subchange("c3", "s1", 30, 70.0)
+        self.assertEqual(self.events(), [])
+        self.spawn_later.assert_called_once()
+
+        self.watcher.flush_scores()
+        self.assertEqual(self.events(), [
+            "event:score\ndata:u1 t 70.00\ndata:u2 t 30.00\n\n"])
+        self.watcher.flush_scores()
+        self.assertEqual(self.events(), [])
+
+    def test_sent_before_entities(self):
+        self.add_subchange("c1", "s1", 10, 50.0)
+        self.stores["team"].create("team", {"name": "Team"})
+        self.assertEqual(self.events(), [
+            "event:score\ndata:u1 t 50.00\n\n",
+            "event:team\ndata:create team\n\n"])
+
+    def test_no_interval(self):
+        self.watcher._score_interval = 0.0
+        self.add_subchange("c1", "s1", 10, 50.0)
+        self.assertEqual(self.events(), ["event:score\ndata:u1 t 50.00\n\n"])
+        self.spawn_later.assert_not_called()
+
+
+class TestReplica(RankingMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.watcher = ReplicationWatcher(self.stores)
+        self.subscriber = self.watcher._pub.get_subscriber()
+        self.replica_stores = make_stores(self.get_path("replica"))
+        self.replica = Replica(self.replica_stores, "http://primary/")
+
+    def get(self, path, **kwargs):
+        entity = [e for e in ENTITIES if URLS[e] == path][0]
+        response = Mock()
+        response.headers = {"Timestamp": "1.5"}
+        response.json.return_value = self.stores[entity].retrieve_list()
+        return response
+
+    def replicate(self):
+        """Apply the changes sent by the primary to the replica."""
+        if self.subscriber._queue.empty():
+            return
+        lines = list()
+        for msg in self.subscriber.get():
+            lines.extend(msg.decode("utf-8").split("\n"))
+        for _, event, data in parse_events(lines):
+            self.replica.apply(event, json.loads(data))
+
+    def assertReplicated(self):
+        for entity in ENTITIES:
+            self.assertEqual(self.replica_stores[entity].retrieve_list(),
+                             self.stores[entity].retrieve_list())
+        self.assertEqual(
+            self.replica_stores["scoring"].get_global_history(),
+            self.stores["scoring"].get_global_history())
+
+    def test_parse_events(self):
+        lines = [":", "id:1", "event:score", "data:a", "data:b", "",
+                 "event:reinit", "", ""]
+        self.assertEqual(list(parse_events(lines)),
+                         [("1", "score", "a\nb"), ("1", "reinit", "")])
+
+    def synchronize(self):
+        with patch.object(self.replica, "_get", self.get):
+            self.replica.synchronize()
+
+    def test_follow(self):
+        self.synchronize()
+        self.add_submission("s1", "u1", 10)
+        self.add_subchange("c1", "s1", 10, 50.0)
+        self.stores["team"].create("team", {"name": "Team"})
+        self.stores["user"].update("u2", {
+            "f_name": "u2", "l_name": "", "team": "team"})
+        self.replicate()
+        self.assertReplicated()
+        self.assertEqual(self.replica_stores["scoring"].get_score("u1", "t"),
+                         50.0)
+
+        # Deleting the user deletes their submissions too.
+        self.stores["user"].delete("u1")
+        self.replicate()
+        self.assertReplicated()
+
+    def test_synchronize(self):
+        self.add_submission("s1", "u1", 10)
+        self.add_subchange("c1", "s1", 10, 50.0)
+        self.synchronize()
+        # Changes the replica missed.
+        self.add_subchange("c2", "s1", 20, 70.0)
+        self.stores["submission"].delete("s1")
+        self.add_submission("s2", "u2", 10)
+        self.add_subchange("c3", "s2", 10, 30.0)
+
+        self.synchronize()
+        self.assertReplicated()
+        self.assertEqual(self.replica._last_event_id, "%x" % 1_500_000)
+
+    def test_read_only(self):
+        client = Client(StoreHandler(self.replica_stores["team"], "user",
+                                     "pass", "realm", read_only=True),
+                        BaseResponse)
+        self.assertEqual(client.get("/").status_code, 200)
+        self.assertEqual(client.put("/team", data="{}").status_code, 405)
+        self.assertEqual(client.delete("/").status_code, 405)
+
+    def test_unchanged_not_updated(self):
+        self.add_submission("s1", "u1", 10)
+        self.synchronize()
+        callback = Mock()
+        self.replica_stores["submission"].add_update_callback(callback)
+        self.replica.apply("submission", {
+            "key": "s1", "data": self.stores["submission"].retrieve("s1")})
+        callback.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+# Copyright © 2026 agent <agent@local>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the computation of the scores of the ranking."""
+
+import random
+import unittest
+
+from cmsranking.Scoring import NumberSet, Score, SCORE_MODE_MAX, \
+    SCORE_MODE_MAX_SUBTASK, SCORE_MODE_MAX_TOKENED_LAST
+from cmsranking.Subchange import Subchange
+from cmsranking.Submission import Submission
+
+
+def make_submission(key, time):
+    submission = Submission()
+    submission.set({"user": "u", "task": "t", "time": time})
+    submission.key = key
+    return submission
+
+
+def make_subchange(key, submission, time, score=None, token=None,
+                   extra=None):
+    data = {"submission": submission, "time": time, "score": score,
+            "token": token, "extra": extra}
+    subchange = Subchange()
+    subchange.set(dict((k, v) for k, v in data.items() if v is not None))
+    subchange.key = key
+    return subchange
+
+
+def naive_history(score_mode, submissions, subchanges):
+    """Compute the history from scratch after each subchange."""
+    status = dict((key, [0.0, False, []]) for key in submissions)
+    last = None
+    history = list()
+    for change in sorted(subchanges.values(),
+                         key=lambda c: (c.time, c.key)):
+        sub_status = status[change.submission]
+        if change.score is not None:
+            sub_status[0] = change.score
+            if last is None or \
+                    submissions[change.submission].time > \
+                    submissions[last].time:
+                last = change.submission
+        if change.token is not None:
+            sub_status[1] = change.token
+        if change.extra is not None:
+            sub_status[2] = change.extra
+
+        if score_mode == SCORE_MODE_MAX:
+            score = max(s[0] for s in status.values())
+        elif score_mode == SCORE_MODE_MAX_SUBTASK:
+            subtasks = max(len(s[2]) for s in status.values())
+            score = sum(max(float(s[2][i]) if i < len(s[2]) else 0.0
+                            for s in status.values())
+                        for i in range(subtasks))
+        else:
+            score = max([s[0] for s in status.values() if s[1]]
+                        + [status[last][0] if last is not None else 0.0,
+                           0.0])
+        if score != (history[-1][1] if len(history) > 0 else 0.0):
+            history.append((change.time, score))
+    return history
+
+
+class TestNumberSet(unittest.TestCase):
+
+    def test_operations(self):
+        numbers = NumberSet()
+        self.assertEqual(numbers.query(), 0.0)
+        for value in [3.0, 5.0, 5.0, 1.0]:
+            numbers.insert(value)
+        self.assertEqual(numbers.query(), 5.0)
+        numbers.remove(5.0)
+        self.assertEqual(numbers.query(), 5.0)
+        numbers.remove(5.0)
+        self.assertEqual(numbers.query(), 3.0)
+        numbers.insert(5.0)
+        self.assertEqual(numbers.query(), 5.0)
+        self.assertEqual(len(numbers), 3)
+        numbers.clear()
+        self.assertEqual(numbers.query(default=-1.0), -1.0)
+
+
+class TestScore(unittest.TestCase):
+
+    def setUp(self):
+        self.random = random.Random(42)
+
+    def random_subchange(self, key, submissions):
+        submission = self.random.choice(sorted(submissions))
+        time = submissions[submission].time + self.random.randint(0, 50)
+        score = extra = token = None
+        if self.random.random() < 0.7:
+            extra = [str(self.random.randint(0, 5)) for _ in range(3)]
+            score = sum(float(e) for e in extra)
+        if self.random.random() < 0.3:
+            token = self.random.random() < 0.8
+        return make_subchange(key, submission, time, score, token, extra)
+
+    def check(self, score, score_mode, submissions, subchanges):
+        expected = naive_history(score_mode, submissions, subchanges)
+        self.assertEqual(score._history, expected)
+        self.assertEqual(score.get_score(),
+                         expected[-1][1] if len(expected) > 0 else 0.0)
+
+    def run_random(self, score_mode):
+        score = Score(score_mode)
+        submissions = dict()
+        subchanges = dict()
+        for i in range(10):
+            key = "s%d" % i
+            submissions[key] = make_submission(key, 10 * i)
+            score.create_submission(key, submissions[key])
+
+        for i in range(200):
+            action = self.random.random()
+            if action < 0.6 or len(subchanges) == 0:
+                key = "c%03d" % i
+                subchanges[key] = self.random_subchange(key, submissions)
+                score.create_subchange(key, subchanges[key])
+            elif action < 0.8:
+                key = self.random.choice(sorted(subchanges))
+                subchanges[key] = self.random_subchange(key, submissions)
+                score.update_subchange(key, subchanges[key])
+            else:
+                key = self.random.choice(sorted(subchanges))
+                del subchanges[key]
+                score.delete_subchange(key)
+            self.check(score, score_mode, submissions, subchanges)
+
+        # Delete a submission with all its subchanges.
+        for key in [k for k, c in subchanges.items()
+                    if c.submission == "s0"]:
+            del subchanges[key]
+            score.delete_subchange(key)
+        del submissions["s0"]
+        score.delete_submission("s0")
+        self.check(score, score_mode, submissions, subchanges)
+
+    def test_max(self):
+        self.run_random(SCORE_MODE_MAX)
+
+    def test_max_subtask(self):
+        self.run_random(SCORE_MODE_MAX_SUBTASK)
+
+    def test_max_tokened_last(self):
+        self.run_random(SCORE_MODE_MAX_TOKENED_LAST)
+
+    def test_in_order_does_not_replay(self):
+        score = Score(SCORE_MODE_MAX)
+        score.create_submission("s", make_submission("s", 0))
+        score.reset_history = None
+        for i in range(10):
+            score.create_subchange(
+                "c%d" % i, make_subchange("c%d" % i, "s", i, score=float(i)))
+        self.assertEqual(score.get_score(), 9.0)
+        self.assertEqual(len(score._undo), 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+# Copyright © 2026 agent <agent@local>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the persistence of the stores of the ranking."""
+
+import json
+import os
+import unittest
+from unittest.mock import patch
+
+from cmsranking.Journal import Journal
+from cmsranking.Store import Store
+from cmsranking.Team import Team
+from cmstestsuite.unit_tests.filesystemmixin import FileSystemMixin
+
+
+class TestStore(FileSystemMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.path = self.get_path("teams")
+        patcher = patch("cmsranking.Store.gevent.spawn")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.store = self.load()
+
+    def load(self):
+        store = Store(Team, self.path, dict())
+        store.load_from_disk()
+        return store
+
+    def reload(self):
+        self.store.flush()
+        self.store._journal.close()
+        self.store = self.load()
+        return self.store.retrieve_list()
+
+    def journal_length(self):
+        with open(os.path.join(self.path, Journal.JOURNAL_FILENAME),
+                  "rt") as f:
+            return len(f.readlines())
+
+    def test_changes_persisted(self):
+        self.store.create("a", {"name": "A"})
+        self.store.merge_list({"b": {"name": "B"}, "c": {"name": "C"}})
+        self.store.update("a", {"name": "AA"})
+        self.store.delete("c")
+
+        self.assertEqual(self.reload(),
+                         {"a": {"name": "AA"}, "b": {"name": "B"}})
+
+    def test_changes_buffered(self):
+        self.store.create("a", {"name": "A"})
+        self.store.create("b", {"name": "B"})
+        # Nothing is written until the store is flushed, then all the
+        # changes are (after the header).
+        self.assertEqual(self.journal_length(), 1)
+        self.store.flush()
+        self.assertEqual(self.journal_length(), 3)
+
+    @patch.object(Journal, "COMPACTION_MIN_RECORDS", 10)
+    def test_compaction(self):
+        for i in range(100):
+            self.store.create("a", {"name": "A%d" % i})
+            self.store.delete("a")
+            self.store.flush()
+        self.store.create("b", {"name": "B"})
+        self.store.flush()
+
+        self.assertLessEqual(self.journal_length(), 11)
+        self.assertEqual(self.reload(), {"b": {"name": "B"}})
+
+    def test_interrupted_compaction(self):
+        self.store.create("a", {"name": "A"})
+        self.store.flush()
+        journal_path = os.path.join(self.path, Journal.JOURNAL_FILENAME)
+        with open(journal_path, "rt") as f:
+            old_journal = f.read()
+        self.store.update("a", {"name": "AA"})
+        self.store._journal.compact(self.store.retrieve_list())
+        # The journal of the previous generation is left behind, with
+        # an older version of the entity.
+        with open(journal_path, "wt") as f:
+            f.write(old_journal)
+
+        self.assertEqual(self.reload(), {"a": {"name": "AA"}})
+
+    def test_changes_during_compaction(self):
+        self.store.create("a", {"name": "A"})
+        journal = self.store._journal
+        compaction = journal.begin_compaction()
+        data = self.store.retrieve_list()
+        # Changes made while the snapshot is written go to the new
+        # journal.
+        self.store.create("b", {"name": "B"})
+        journal.write_snapshot(compaction, data)
+        journal.end_compaction(compaction)
+        self.store.update("a", {"name": "AA"})
+
+        self.assertEqual(self.reload(),
+                         {"a": {"name": "AA"}, "b": {"name": "B"}})
+
+    def test_load_failed(self):
+        self.store._journal.close()
+        path = self.get_path("file")
+        with open(path, "wt"):
+            pass
+        with self.assertLogs("cmsranking.Store", "ERROR"):
+            store = Store(Team, path, dict())
+            store.load_from_disk()
+        # The store works in memory only.
+        store.create("a", {"name": "A"})
+        store.flush()
+        self.assertEqual(store.retrieve_list(), {"a": {"name": "A"}})
+        self.assertEqual(store._journal._pending, [])
+
+    def test_migration(self):
+        self.store._journal.close()
+        for key in ["a", "b"]:
+            with open(os.path.join(self.path, key + ".json"), "wt") as f:
+                json.dump({"name": key.upper()}, f)
+
+        self.store = self.load()
+        self.assertEqual(self.store.retrieve_list(),
+                         {"a": {"name": "A"}, "b": {"name": "B"}})
+        self.assertCountEqual(os.listdir(self.path),
+                              [Journal.SNAPSHOT_FILENAME,
+                               Journal.JOURNAL_FILENAME])
+        self.assertEqual(self.reload(),
+                         {"a": {"name": "A"}, "b": {"name": "B"}})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -26,13 +26,14 @@
 import os
 import random
 import shutil
+import time
 import unittest
 from io import BytesIO
 
 # Needs to be first to allow for monkey patching the DB connection string.
 from cmstestsuite.unit_tests.databasemixin import DatabaseMixin
 
-from cms.db.filecacher import FileCacher
+from cms.db.filecacher import COMPRESSION_MAGIC, FileCacher, zstandard
 from cmscommon.digest import Digester, bytes_digest
 
 
@@ -356,6 +357,47 @@ class TestFileCacherBase:
         # Check that the file was stored correctly.
         self.check_stored_file(digest)
 
+    def test_load_many(self):
+        """Load many files at once, some of which are missing or
+        already in the local cache.
+
+        """
+        contents = [os.urandom(100) for _ in range(3)]
+        digests = [self.file_cacher.put_file_content(content)
+                   for content in contents]
+        missing_digest = bytes_digest(b"not stored")
+        for digest in digests[:2]:
+            os.unlink(os.path.join(self.cache_base_path, digest))
+
+        sizes = self.file_cacher.load_many(digests + [missing_digest],
+                                           if_needed=True)
+
+        self.assertEqual(sizes, {digests[0]: 100, digests[1]: 100})
+        for digest, content in zip(digests, contents):
+            with open(os.path.join(self.cache_base_path, digest), "rb") as f:
+                self.assertEqual(f.read(), content)
+
+    def test_compression(self):
+        """Store compressed files, and read them back uncompressed.
+
+        """
+        self.file_cacher.compression = "zlib"
+        content = b"compressible " * 1000
+        digest = self.file_cacher.put_file_content(content)
+        self.assertEqual(digest, bytes_digest(content))
+
+        with self.file_cacher.backend.get_file(digest) as fobj:
+            stored = fobj.read()
+        self.assertTrue(stored.startswith(COMPRESSION_MAGIC))
+        self.assertLess(len(stored), len(content))
+
+        self.file_cacher.drop(digest)
+        self.assertEqual(self.file_cacher.get_file_content(digest), content)
+        with open(os.path.join(self.cache_base_path, digest), "rb") as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual(self.file_cacher.get_size(digest), len(content))
+        self.assertTrue(self.file_cacher.check_backend_integrity())
+
 
 class TestFileCacherDB(TestFileCacherBase, DatabaseMixin, unittest.TestCase):
     """Tests for the FileCacher service with a database backend."""
@@ -382,5 +424,134 @@ class TestFileCacherFS(TestFileCacherBase, unittest.TestCase):
         shutil.rmtree("fs-storage", ignore_errors=True)
 
 
+class TestFileCacherCompression(unittest.TestCase):
+    """Tests for the storage format of compressed files."""
+
+    def setUp(self):
+        super().setUp()
+        self.file_cacher = FileCacher(path="fs-storage")
+
+    def tearDown(self):
+        shutil.rmtree(self.file_cacher.file_dir, ignore_errors=True)
+        shutil.rmtree("fs-storage", ignore_errors=True)
+
+    def stored_content(self, digest):
+        with open(os.path.join("fs-storage", digest), "rb") as f:
+            return f.read()
+
+    def check_round_trip(self, content):
+        digest = self.file_cacher.put_file_content(content)
+        self.file_cacher.drop(digest)
+        self.assertEqual(self.file_cacher.get_file_content(digest), content)
+        self.assertEqual(self.file_cacher.get_size(digest), len(content))
+        return digest
+
+    def test_uncompressed(self):
+        """Without compression, files are stored as they are."""
+        content = b"content"
+        digest = self.check_round_trip(content)
+        self.assertEqual(self.stored_content(digest), content)
+
+    def test_uncompressed_with_marker(self):
+        """Contents starting with the marker are stored with a header
+        even without compression, to avoid ambiguity.
+
+        """
+        content = COMPRESSION_MAGIC + b"content"
+        digest = self.check_round_trip(content)
+        self.assertNotEqual(self.stored_content(digest), content)
+
+    def test_read_uncompressed_with_compression(self):
+        """Files stored uncompressed stay readable."""
+        digest = self.file_cacher.put_file_content(b"content")
+        self.file_cacher.compression = "zlib"
+        self.file_cacher.drop(digest)
+        self.assertEqual(self.file_cacher.get_file_content(digest),
+                         b"content")
+
+    @unittest.skipIf(zstandard is None, "zstandard not available")
+    def test_zstd(self):
+        self.file_cacher.compression = "zstd"
+        content = b"compressible " * 1000
+        digest = self.check_round_trip(content)
+        self.assertLess(len(self.stored_content(digest)), len(content))
+
+    def test_empty(self):
+        self.file_cacher.compression = "zlib"
+        self.check_round_trip(b"")
+
+    def test_corrupted(self):
+        self.file_cacher.compression = "zlib"
+        digest = self.file_cacher.put_file_content(b"content" * 100)
+        stored = self.stored_content(digest)
+        with open(os.path.join("fs-storage", digest), "wb") as f:
+            f.write(stored[:-5])
+        self.file_cacher.drop(digest)
+        with self.assertRaises(ValueError):
+            self.file_cacher.get_file_content(digest)
+        self.assertFalse(self.file_cacher.check_backend_integrity())
+
+
+class TestFileCacherEviction(unittest.TestCase):
+    """Tests for the eviction of files from the local cache."""
+
+    def setUp(self):
+        super().setUp()
+        self.file_cacher = FileCacher(path="fs-storage")
+        self.file_cacher.max_size = 1000
+
+    def tearDown(self):
+        shutil.rmtree(self.file_cacher.file_dir, ignore_errors=True)
+        shutil.rmtree("fs-storage", ignore_errors=True)
+
+    def put_file(self, size, age):
+        """Store a random file, pretending it was last used age ago."""
+        digest = self.file_cacher.put_file_content(os.urandom(size))
+        past = time.time() - age
+        os.utime(os.path.join(self.file_cacher.file_dir, digest),
+                 (past, past))
+        return digest
+
+    def is_cached(self, digest):
+        return os.path.exists(os.path.join(self.file_cacher.file_dir, digest))
+
+    def test_least_recently_used_evicted(self):
+        old = self.put_file(400, 300)
+        middle = self.put_file(400, 200)
+        # Using the old file makes it the most recent.
+        self.file_cacher.get_file_content(old)
+        new = self.put_file(400, 0)
+
+        self.assertTrue(self.is_cached(old))
+        self.assertFalse(self.is_cached(middle))
+        self.assertTrue(self.is_cached(new))
+        stats = self.file_cacher.get_cache_stats()
+        self.assertEqual(stats["evictions"], 1)
+        self.assertEqual(stats["evicted_bytes"], 400)
+        self.assertEqual(stats["size"], 800)
+        self.assertEqual(stats["hits"], 1)
+
+        # The evicted file can still be retrieved from the backend.
+        self.file_cacher.get_file_content(middle)
+        self.assertEqual(self.file_cacher.get_cache_stats()["misses"], 1)
+
+    def test_open_file_not_evicted(self):
+        old = self.put_file(400, 300)
+        middle = self.put_file(400, 200)
+        with self.file_cacher.get_file(old):
+            os.utime(os.path.join(self.file_cacher.file_dir, old),
+                     (0, 0))
+            self.put_file(400, 0)
+            self.assertTrue(self.is_cached(old))
+            self.assertFalse(self.is_cached(middle))
+
+    def test_unbounded(self):
+        self.file_cacher.max_size = None
+        digests = [self.put_file(400, 0) for _ in range(5)]
+        for digest in digests:
+            self.assertTrue(self.is_cached(digest))
+        self.assertEqual(self.file_cacher.get_cache_stats()["evictions"], 0)
+
+
 if __name__ == "__main__":
     unittest.main()
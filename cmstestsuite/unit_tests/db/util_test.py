@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+# Copyright © 2026 agent <agent@local>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for util.py."""
+
+import unittest
+
+# Needs to be first to allow for monkey patching the DB connection string.
+from cmstestsuite.unit_tests.databasemixin import DatabaseMixin
+
+from cms.db import Evaluation, Executable, SubmissionResult, \
+    get_submission_results, invalidate_submission_results
+
+
+class TestInvalidateSubmissionResults(DatabaseMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        contest = self.add_contest()
+        participation = self.add_participation(contest=contest)
+        self.task = self.add_task(contest=contest)
+        dataset = self.add_dataset(task=self.task)
+        self.task.active_dataset = dataset
+        testcase = self.add_testcase(dataset)
+        self.results = []
+        for _ in range(2):
+            _, results = self.add_submission_with_results(
+                self.task, participation, compilation_outcome="ok")
+            result = results[0]
+            result.set_evaluation_outcome()
+            result.score = 1.0
+            result.score_details = []
+            result.public_score = 1.0
+            result.public_score_details = []
+            result.ranking_score_details = []
+            self.add_executable(result)
+            self.add_evaluation(result, testcase)
+            self.results.append(result)
+        self.session.commit()
+
+    def tearDown(self):
+        self.delete_data()
+        super().tearDown()
+
+    def invalidate(self, level, submission_id=None):
+        count = invalidate_submission_results(
+            self.session,
+            get_submission_results(self.session,
+                                   submission_id=submission_id),
+            level)
+        self.session.commit()
+        self.session.expire_all()
+        return count
+
+    def count(self, cls):
+        return self.session.query(cls).count()
+
+    def test_evaluation(self):
+        self.assertEqual(self.invalidate("evaluation"), 2)
+        for result in self.results:
+            self.assertTrue(result.compiled())
+            self.assertFalse(result.evaluated())
+            self.assertFalse(result.scored())
+        self.assertEqual(self.count(Evaluation), 0)
+        self.assertEqual(self.count(Executable), 2)
+
+    def test_compilation(self):
+        self.assertEqual(self.invalidate("compilation"), 2)
+        for result in self.results:
+            self.assertFalse(result.compiled())
+            self.assertEqual(result.compilation_tries, 0)
+            self.assertFalse(result.evaluated())
+        self.assertEqual(self.count(Evaluation), 0)
+        self.assertEqual(self.count(Executable), 0)
+
+    def test_only_selected(self):
+        submission_id = self.results[0].submission_id
+        self.assertEqual(self.invalidate("compilation", submission_id), 1)
+        self.assertFalse(self.results[0].compiled())
+        self.assertTrue(self.results[1].compiled())
+        self.assertTrue(self.results[1].evaluated())
+        self.assertEqual(self.count(Evaluation), 1)
+
+    def test_bad_level(self):
+        with self.assertRaises(ValueError):
+            self.invalidate("scoring")
+        self.assertEqual(self.count(Evaluation), 2)
+        self.assertIsNotNone(self.session.query(SubmissionResult).first())
+
+
+if __name__ == "__main__":
+    unittest.main()
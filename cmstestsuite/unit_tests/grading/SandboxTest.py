@@ -20,9 +20,17 @@
 """Tests for general utility functions."""
 
 import io
+import os
+import shutil
+import tempfile
 import unittest
+from unittest.mock import patch
 
-from cms.grading.Sandbox import Truncator
+import gevent
+
+from cms.db.filecacher import FileCacher
+from cms.grading.Sandbox import StupidSandbox, Truncator, \
+    collect_provisioning_stats
 
 
 class TestTruncator(unittest.TestCase):
@@ -62,5 +70,91 @@ class TestTruncator(unittest.TestCase):
         self.perform_truncator_test(100, 40, 7)
 
 
+class LinkingStupidSandbox(StupidSandbox):
+    """A StupidSandbox that pretends hard links are safe."""
+    HARDLINKS_ALLOWED = True
+
+
+class TestCreateFileFromStorage(unittest.TestCase):
+    """Test the provisioning of files from storage in the sandbox."""
+    def setUp(self):
+        self.storage_dir = tempfile.mkdtemp()
+        self.file_cacher = FileCacher(path=self.storage_dir)
+        self.content = b"content of the file" * 100
+        self.digest = self.file_cacher.put_file_content(self.content)
+        # Use the same file system as the cache, to allow linking.
+        self.sandbox_dir = tempfile.mkdtemp(dir=self.file_cacher.temp_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.sandbox_dir)
+        shutil.rmtree(self.storage_dir)
+
+    def provision(self, mode, sandbox_class=StupidSandbox):
+        sandbox = sandbox_class(self.file_cacher, temp_dir=self.sandbox_dir)
+        with patch("cms.grading.Sandbox.config.sandbox_file_provisioning",
+                   mode):
+            sandbox.create_file_from_storage("file", self.digest)
+        self.assertEqual(sandbox.get_file_to_string("file", maxlen=None),
+                         self.content)
+        return sandbox
+
+    def test_copy(self):
+        sandbox = self.provision("copy")
+        self.assertEqual(sandbox.provisioning_stats, {
+            "copied_bytes": len(self.content),
+            "linked_bytes": 0,
+            "reflinked_bytes": 0,
+        })
+
+    def test_reflink(self):
+        """Reflinking falls back to copying where not supported."""
+        sandbox = self.provision("reflink")
+        stats = sandbox.provisioning_stats
+        self.assertEqual(stats["linked_bytes"], 0)
+        self.assertEqual(stats["copied_bytes"] + stats["reflinked_bytes"],
+                         len(self.content))
+
+    def test_hardlink(self):
+        sandbox = self.provision("hardlink", LinkingStupidSandbox)
+        self.assertEqual(sandbox.provisioning_stats["linked_bytes"],
+                         len(self.content))
+        self.assertEqual(sandbox.stat_file("file").st_nlink, 2)
+
+        # Breaking the link must leave the cache untouched.
+        sandbox._unlink_from_cache(sandbox.relative_path("file"))
+        self.assertEqual(sandbox.stat_file("file").st_nlink, 1)
+        self.assertEqual(sandbox.provisioning_stats["copied_bytes"],
+                         len(self.content))
+        os.chmod(sandbox.relative_path("file"), 0o644)
+        with open(sandbox.relative_path("file"), "wb") as f:
+            f.write(b"modified")
+        self.assertEqual(self.file_cacher.get_file_content(self.digest),
+                         self.content)
+
+    def test_hardlink_not_allowed(self):
+        """Sandboxes where linking is unsafe never link."""
+        sandbox = self.provision("hardlink")
+        self.assertEqual(sandbox.provisioning_stats["linked_bytes"], 0)
+        self.assertEqual(sandbox.stat_file("file").st_nlink, 1)
+
+    def test_job_stats(self):
+        """The stats of all the sandboxes of a greenlet are collected."""
+        def run_job():
+            stats = collect_provisioning_stats()
+            self.provision("copy")
+            self.provision("hardlink", LinkingStupidSandbox)
+            return stats
+
+        greenlet = gevent.spawn(run_job)
+        greenlet.join()
+        # Sandboxes of other greenlets are not counted.
+        gevent.spawn(self.provision, "copy").join()
+        self.assertEqual(greenlet.get(), {
+            "copied_bytes": len(self.content),
+            "linked_bytes": len(self.content),
+            "reflinked_bytes": 0,
+        })
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -157,6 +157,28 @@ class TestGroupMin(ScoreTypeTestMixin, unittest.TestCase):
         self.assertComputeScore(gmin.compute_score(sr),
                                 s2 + s3 * 0.1, 0.0, [0, s2, s3 * 0.1])
 
+    def test_get_doomed_testcases(self):
+        parameters = [[10, "1_*"], [20, "2_*"], [30, "[23]_1"]]
+        gmin = GroupMin(parameters, self._public_testcases)
+
+        self.assertEqual(gmin.get_doomed_testcases({}), set())
+        self.assertEqual(gmin.get_doomed_testcases({"1_0": 0.5}), set())
+        # 2_1 is also in the third subtask, which can still score.
+        self.assertEqual(gmin.get_doomed_testcases({"2_0": 0.0}), set())
+        self.assertEqual(
+            gmin.get_doomed_testcases({"2_0": 0.0, "3_1": 0.0}), {"2_1"})
+
+    def test_get_doomed_testcases_public(self):
+        # The second subtask has a public testcase (2_0) and a private
+        # one (2_1): only the latter can be skipped.
+        parameters = [[10, "1_*"], [20, "2_*"]]
+        gmin = GroupMin(parameters, self._public_testcases)
+
+        self.assertEqual(gmin.get_doomed_testcases({"2_0": 0.0}), {"2_1"})
+        self.assertEqual(gmin.get_doomed_testcases({"2_1": 0.0}), set())
+        # All the testcases of the first subtask are public.
+        self.assertEqual(gmin.get_doomed_testcases({"1_0": 0.0}), set())
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -157,6 +157,17 @@ class TestGroupMul(ScoreTypeTestMixin, unittest.TestCase):
                                 s2 + s3 * 0.5 * 0.1, 0.0,
                                 [0, s2, s3 * 0.5 * 0.1])
 
+    def test_get_doomed_testcases(self):
+        parameters = [[10, "1_*"], [20, "2_*"], [30, "3_*"]]
+        gmul = GroupMul(parameters, self._public_testcases)
+
+        self.assertEqual(gmul.get_doomed_testcases({"3_0": 0.5}), set())
+        # The public testcases (1_1, 2_0) are not skipped.
+        self.assertEqual(
+            gmul.get_doomed_testcases({"1_0": 0.0, "2_0": 0.0,
+                                       "3_0": 0.0}),
+            {"2_1", "3_1"})
+
 
 if __name__ == "__main__":
     unittest.main()
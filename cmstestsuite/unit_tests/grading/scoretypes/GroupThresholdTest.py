@@ -173,6 +173,15 @@ class TestGroupThreshold(ScoreTypeTestMixin, unittest.TestCase):
         self.assertComputeScore(st.compute_score(sr),
                                 s2, 0.0, [0, s2, 0])
 
+    def test_get_doomed_testcases(self):
+        parameters = [[10, "2_*", 10], [20, "3_*", 20]]
+        st = GroupThreshold(parameters, self._public_testcases)
+
+        self.assertEqual(st.get_doomed_testcases({"3_0": 5}), set())
+        # Above the threshold, or zero.
+        self.assertEqual(st.get_doomed_testcases({"2_0": 11}), {"2_1"})
+        self.assertEqual(st.get_doomed_testcases({"3_1": 0.0}), {"3_0"})
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -18,12 +18,43 @@
 
 """Tests for whitediff.py."""
 
+import logging
+import os
+import random
+import time
 import unittest
 from io import BytesIO
+from unittest.mock import patch
 
 from cms.grading.steps import _WHITES, _white_diff
 
 
+logger = logging.getLogger(__name__)
+
+
+def _reference_white_diff(output, res):
+    """The previous, line by line, implementation of _white_diff."""
+    def canonicalize(string):
+        for char in _WHITES[1:]:
+            string = string.replace(char, _WHITES[0])
+        return _WHITES[0].join([x for x in string.split(_WHITES[0])
+                                if len(x) > 0])
+
+    while True:
+        lout = output.readline()
+        lres = res.readline()
+        if len(lres) == 0 and len(lout) == 0:
+            return True
+        elif len(lres) == 0 or len(lout) == 0:
+            lout = lout.strip(b''.join(_WHITES))
+            lres = lres.strip(b''.join(_WHITES))
+            if len(lout) > 0 or len(lres) > 0:
+                return False
+        else:
+            if canonicalize(lout) != canonicalize(lres):
+                return False
+
+
 class TestWhiteDiff(unittest.TestCase):
 
     WHITES_STR = "".join(c.decode('utf-8') for c in _WHITES)
@@ -67,6 +98,96 @@ class TestWhiteDiff(unittest.TestCase):
         self.assertFalse(self._diff("1 2", "1\n2"))
         self.assertFalse(self._diff("1\n\n2", "1\n2"))
 
+    def test_long_line(self):
+        line = " ".join(str(i) for i in range(100000))
+        self.assertTrue(self._diff(line + "\n", "  " + line))
+        self.assertFalse(self._diff(line, line + "1"))
+
+    @patch("cms.grading.steps.whitediff._CHUNK_SIZE", 4)
+    def test_token_longer_than_chunk(self):
+        token = "1234567890" * 5
+        self.assertTrue(self._diff("a " + token + "\nb",
+                                   "a\t" + token + "\n b"))
+        self.assertTrue(self._diff(token + token, token + token + "\n"))
+        self.assertFalse(self._diff(token + " " + token, token + token))
+        self.assertFalse(self._diff(token, token[:-1]))
+
+
+class TestWhiteDiffChunks(unittest.TestCase):
+    """Compare the chunked white diff with the line by line one."""
+
+    @staticmethod
+    def random_output(rng):
+        pieces = [rng.choice(["1", "2", "12", "a"] + [c.decode("utf-8")
+                                                      for c in _WHITES])
+                  for _ in range(rng.randint(0, 12))]
+        return "".join(pieces).encode("utf-8")
+
+    @patch("cms.grading.steps.whitediff._CHUNK_SIZE", 3)
+    def test_same_as_reference(self):
+        rng = random.Random(42)
+        for _ in range(5000):
+            s1 = self.random_output(rng)
+            s2 = self.random_output(rng) if rng.random() < 0.5 \
+                else s1.replace(b" ", rng.choice(_WHITES + [b"  "]))
+            self.assertEqual(
+                _white_diff(BytesIO(s1), BytesIO(s2)),
+                _reference_white_diff(BytesIO(s1), BytesIO(s2)),
+                (s1, s2))
+
+
+@unittest.skipUnless(os.environ.get("CMS_BENCHMARK"),
+                     "benchmarks are enabled by setting CMS_BENCHMARK")
+class TestWhiteDiffBenchmark(unittest.TestCase):
+    """Compare the speed of the chunked white diff with the line by
+    line one on large synthetic outputs.
+
+    The timings are logged (e.g., run pytest with --log-cli-level=INFO
+    to see them), and the chunked one is required not to be much
+    slower, with a bound loose enough for noisy machines.
+
+    """
+
+    # Number of runs of each diff, of which the fastest is taken.
+    RUNS = 3
+    # How many times slower than the line by line diff the chunked one
+    # is allowed to be.
+    MAX_RATIO = 2.0
+
+    @staticmethod
+    def time(diff, output, res):
+        """Return the result and the best time of some runs of diff."""
+        best = None
+        for _ in range(TestWhiteDiffBenchmark.RUNS):
+            start = time.perf_counter()
+            result = diff(BytesIO(output), BytesIO(res))
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return result, best
+
+    def test_benchmark(self):
+        rng = random.Random(0)
+        numbers = [str(rng.randint(0, 10 ** 9)) for _ in range(500000)]
+        lines = [" ".join(numbers[i:i + 10])
+                 for i in range(0, len(numbers), 10)]
+        s1 = "\n".join(lines).encode("utf-8")
+        s2 = "\r\n".join("  " + line.replace(" ", "\t")
+                          for line in lines).encode("utf-8")
+
+        for name, (output, res) in [("many lines", (s1, s2)),
+                                    ("one line", (s1.replace(b"\n", b" "),
+                                                  s2.replace(b"\n", b" ")))]:
+            result, elapsed = self.time(_white_diff, output, res)
+            reference_result, reference_elapsed = self.time(
+                _reference_white_diff, output, res)
+            ratio = elapsed / reference_elapsed
+            logger.info("White diff of %d bytes (%s): %.3fs chunked, "
+                        "%.3fs line by line (ratio %.2f).", len(output),
+                        name, elapsed, reference_elapsed, ratio)
+            self.assertTrue(result)
+            self.assertTrue(reference_result)
+            self.assertLess(ratio, TestWhiteDiffBenchmark.MAX_RATIO)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -19,9 +19,21 @@
 """Tests for the utilities for task types."""
 
 import unittest
+from collections import OrderedDict
+from unittest.mock import MagicMock, patch
 
+# Needs to be first to allow for monkey patching the DB connection string.
+from cmstestsuite.unit_tests.databasemixin import DatabaseMixin
+
+from cms import config
+from cms.db import Executable, Manager
 from cms.grading import Language
-from cms.grading.tasktypes import is_manager_for_compilation
+from cms.grading.Job import CompilationJob, EvaluationJob
+from cms.grading.tasktypes import is_manager_for_compilation, \
+    get_compilation_cache_key, load_cached_compilation, \
+    store_cached_compilation, eval_output
+from cmscommon.digest import bytes_digest
+from cmstestsuite.unit_tests.filesystemmixin import FileSystemMixin
 
 
 class TestLanguage(Language):
@@ -91,5 +103,162 @@ class TestIsManagerForCompilation(unittest.TestCase):
         self.assertIsNotForCompilation("test.srcext1.")
 
 
+class TestCompilationCache(DatabaseMixin, unittest.TestCase):
+    """Test the functions of the compilation cache."""
+
+    def setUp(self):
+        super().setUp()
+        patcher = patch.object(config, "compilation_cache", True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.language = TestLanguage()
+        self.commands = [["compile", "a.srcext1", "-o", "a"]]
+        self.files = {"a.srcext1": "1" * 40, "b.headext1": "2" * 40}
+
+    def tearDown(self):
+        self.delete_data()
+        super().tearDown()
+
+    def key(self, files=None):
+        return get_compilation_cache_key(
+            self.language, self.commands,
+            files if files is not None else self.files)
+
+    def compiled_job(self, success=True, compilation_success=True):
+        return CompilationJob(
+            language="TestLanguage", success=success,
+            compilation_success=compilation_success, text=["OK"],
+            plus={"execution_time": 1.5},
+            executables={"a": Executable("a", "3" * 40)})
+
+    def test_store_and_load(self):
+        store_cached_compilation(self.compiled_job(), self.key())
+        # Storing the same compilation again is harmless.
+        store_cached_compilation(self.compiled_job(), self.key())
+
+        job = CompilationJob(language="TestLanguage")
+        self.assertTrue(load_cached_compilation(job, self.key()))
+        self.assertTrue(job.success)
+        self.assertTrue(job.compilation_success)
+        self.assertEqual(job.text, ["OK"])
+        self.assertEqual(job.plus, {"execution_time": 1.5})
+        self.assertEqual(list(job.executables.keys()), ["a"])
+        self.assertEqual(job.executables["a"].digest, "3" * 40)
+
+    def test_key(self):
+        # The order of the files does not matter, their digests do.
+        self.assertEqual(
+            self.key(dict(reversed(list(self.files.items())))), self.key())
+        self.assertNotEqual(
+            self.key({"a.srcext1": "4" * 40, "b.headext1": "2" * 40}),
+            self.key())
+
+    def test_failed_job_not_stored(self):
+        store_cached_compilation(self.compiled_job(success=False),
+                                 self.key())
+        self.assertFalse(load_cached_compilation(
+            CompilationJob(language="TestLanguage"), self.key()))
+
+    def test_failed_compilation_not_stored(self):
+        # E.g., the compiler timed out on a loaded worker.
+        store_cached_compilation(
+            self.compiled_job(compilation_success=False), self.key())
+        self.assertFalse(load_cached_compilation(
+            CompilationJob(language="TestLanguage"), self.key()))
+
+    def test_disabled(self):
+        with patch.object(config, "compilation_cache", False):
+            self.assertIsNone(self.key())
+            self.assertFalse(load_cached_compilation(
+                CompilationJob(language="TestLanguage"), self.key()))
+
+
+class TestEvalOutput(FileSystemMixin, unittest.TestCase):
+    """Test the shortcuts of the function eval_output."""
+
+    def setUp(self):
+        super().setUp()
+        # The local copy of the correct output.
+        correct_path = self.get_path("correct.txt")
+        with open(correct_path, "wb") as f:
+            f.write(b"correct\n")
+        self.file_cacher = MagicMock()
+        self.file_cacher.get_file.side_effect = \
+            lambda digest: open(correct_path, "rb")
+        self.job = EvaluationJob(
+            input="1" * 40, output=bytes_digest(b"correct\n"),
+            managers={"checker": Manager("checker", "2" * 40)})
+        for name in ["create_sandbox", "delete_sandbox", "checker_step",
+                     "white_diff_fobj_step"]:
+            patcher = patch("cms.grading.tasktypes.util.%s" % name)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+        self.checker_step.return_value = True, 0.5, ["Partial"]
+        self.white_diff_fobj_step.return_value = 0.0, ["Wrong"]
+        patcher = patch("cms.grading.tasktypes.util._checker_outcomes",
+                        OrderedDict())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_identical_output(self):
+        path = self.get_path("output.txt")
+        with open(path, "wb") as f:
+            f.write(b"correct\n")
+        self.assertEqual(
+            eval_output(self.file_cacher, self.job, None,
+                        user_output_path=path),
+            (True, 1.0, ["Output is correct"]))
+        self.white_diff_fobj_step.assert_not_called()
+        self.file_cacher.get_size.assert_not_called()
+
+    def test_identical_output_digest(self):
+        self.assertEqual(
+            eval_output(self.file_cacher, self.job, None,
+                        user_output_digest=self.job.output),
+            (True, 1.0, ["Output is correct"]))
+        self.white_diff_fobj_step.assert_not_called()
+        self.file_cacher.get_file.assert_not_called()
+
+    @patch("cms.grading.tasktypes.util.path_digest")
+    def test_different_size_not_hashed(self, path_digest):
+        path = self.get_path("output.txt")
+        with open(path, "wb") as f:
+            f.write(b"wrong\n")
+        self.assertEqual(
+            eval_output(self.file_cacher, self.job, None,
+                        user_output_path=path),
+            (True, 0.0, ["Wrong"]))
+        path_digest.assert_not_called()
+        # The size of the correct output is taken from the local copy,
+        # not asked to the backend.
+        self.file_cacher.get_size.assert_not_called()
+        self.file_cacher.backend.get_size.assert_not_called()
+        self.file_cacher.backend.get_file.assert_not_called()
+
+    def test_different_output(self):
+        self.assertEqual(
+            eval_output(self.file_cacher, self.job, None,
+                        user_output_digest="3" * 40),
+            (True, 0.0, ["Wrong"]))
+        self.white_diff_fobj_step.assert_called_once()
+
+    def test_checker_outcome_reused(self):
+        for _ in range(2):
+            self.assertEqual(
+                eval_output(self.file_cacher, self.job, "checker",
+                            user_output_digest="3" * 40),
+                (True, 0.5, ["Partial"]))
+        self.checker_step.assert_called_once()
+
+        # A different output, or a failed run, is not reused.
+        self.checker_step.return_value = False, None, None
+        for _ in range(2):
+            self.assertEqual(
+                eval_output(self.file_cacher, self.job, "checker",
+                            user_output_digest="4" * 40),
+                (False, None, None))
+        self.assertEqual(self.checker_step.call_count, 3)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -175,6 +175,128 @@ class TestPriorityQueue(unittest.TestCase):
         self.assertFalse(self.item_b in self.queue)
         self.queue._verify()
 
+    def test_remove_matching(self):
+        """Test that items satisfying a predicate get removed."""
+        self.queue.push(self.item_a, PriorityQueue.PRIORITY_LOW)
+        self.queue.push(self.item_b, PriorityQueue.PRIORITY_MEDIUM)
+        self.queue.push(self.item_c, PriorityQueue.PRIORITY_HIGH)
+
+        removed = self.queue.remove_matching(
+            lambda item: item in (self.item_a, self.item_c))
+        self.assertCountEqual([entry.item for entry in removed],
+                              [self.item_a, self.item_c])
+        self.assertTrue(self.queue._verify())
+        self.assertEqual(self.queue.length(), 1)
+        self.assertEqual(self.queue.pop().item, self.item_b)
+
+        self.assertEqual(self.queue.remove_matching(lambda item: True), [])
+
+
+class TestFairPriorityQueue(unittest.TestCase):
+
+    def setUp(self):
+        # Items are grouped by their first letter.
+        self.queue = PriorityQueue(lambda item: str(item)[0])
+
+    def push(self, title, timestamp, priority=PriorityQueue.PRIORITY_MEDIUM):
+        self.queue.push(FakeQueueItem(title), priority,
+                        timestamp=make_datetime(timestamp))
+
+    def pop_all(self):
+        titles = []
+        while not self.queue.empty():
+            titles.append(str(self.queue.pop().item))
+        self.assertTrue(self.queue._verify())
+        return titles
+
+    def test_groups_in_turn(self):
+        for i in range(4):
+            self.push("a%d" % i, i)
+        self.push("b0", 10)
+        self.push("b1", 11)
+        self.push("c0", 20)
+
+        self.assertEqual(self.pop_all(),
+                         ["a0", "b0", "c0", "a1", "b1", "a2", "a3"])
+
+    def test_new_group_not_behind(self):
+        for i in range(10):
+            self.push("a%d" % i, i)
+        self.assertEqual(str(self.queue.pop().item), "a0")
+        self.assertEqual(str(self.queue.pop().item), "a1")
+        # A new group is served at the next turn, not after all the
+        # entries of the other group, nor before the current turn.
+        self.push("b0", 100)
+        self.assertEqual(self.pop_all()[:3], ["a2", "b0", "a3"])
+
+    def test_priority_first(self):
+        self.push("a0", 0)
+        self.push("a1", 1)
+        self.push("b0", 2, PriorityQueue.PRIORITY_LOW)
+
+        self.assertEqual(self.pop_all(), ["a0", "a1", "b0"])
+
+    def test_groups_status(self):
+        self.push("a0", 5)
+        self.push("a1", 3)
+        self.push("b0", 10)
+
+        self.assertEqual(self.queue.get_groups_status(), {
+            "a": {"length": 2, "oldest_timestamp": 3},
+            "b": {"length": 1, "oldest_timestamp": 10},
+        })
+        self.assertEqual(PriorityQueue().get_groups_status(), {})
+
+
+class TestIndexedPriorityQueue(unittest.TestCase):
+
+    def setUp(self):
+        # Items are indexed by their first letter, and those with a
+        # digit as second character also by it.
+        self.queue = PriorityQueue(index_keys={
+            "letter": lambda item: str(item)[0],
+            "digit": lambda item: str(item)[1]
+            if str(item)[1].isdigit() else None,
+        })
+        for i, title in enumerate(["a0", "a1", "ax", "b0", "b1", "c0"]):
+            self.queue.push(FakeQueueItem(title),
+                            timestamp=make_datetime(i))
+
+    def titles(self, items):
+        return sorted(str(item) for item in items)
+
+    def test_items_by(self):
+        self.assertEqual(self.titles(self.queue.items_by("letter", "a")),
+                         ["a0", "a1", "ax"])
+        self.assertEqual(self.titles(self.queue.items_by("digit", "0")),
+                         ["a0", "b0", "c0"])
+        self.assertEqual(self.queue.items_by("digit", "x"), set())
+        with self.assertRaises(KeyError):
+            self.queue.items_by("other", "a")
+
+    def test_index_follows_queue(self):
+        self.queue.pop()
+        self.queue.remove(FakeQueueItem("b0"))
+        self.assertTrue(self.queue._verify())
+        self.assertEqual(self.titles(self.queue.items_by("digit", "0")),
+                         ["c0"])
+
+    def test_remove_by(self):
+        removed = self.queue.remove_by("letter", "a")
+        self.assertEqual(self.titles(entry.item for entry in removed),
+                         ["a0", "a1", "ax"])
+        self.assertTrue(self.queue._verify())
+        self.assertEqual(self.queue.items_by("letter", "a"), set())
+        self.assertEqual(str(self.queue.pop().item), "b0")
+
+    def test_remove_by_predicate(self):
+        removed = self.queue.remove_by("digit", "1",
+                                       lambda item: str(item) != "a1")
+        self.assertEqual(self.titles(entry.item for entry in removed),
+                         ["b1"])
+        self.assertTrue(self.queue._verify())
+        self.assertIn(FakeQueueItem("a1"), self.queue)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -68,6 +68,12 @@ class FakeBatchExecutor(FakeExecutor):
         super().execute(operations[0])
 
 
+class FakeSplittingBatchExecutor(FakeBatchExecutor):
+    def can_be_batched(self, batch, entry):
+        # Start a new batch at each operation with title "split".
+        return entry.item != FakeQueueItem('split')
+
+
 class FakeTriggeredService(TriggeredService):
     def __init__(self, shard, timeout):
         super().__init__(shard)
@@ -170,6 +176,18 @@ class TestTriggeredService(unittest.TestCase):
         # Just one call to the batch executor.
         self.assertEqual(batch_notifier.get_notifications(), 1)
 
+    def test_batch_split(self):
+        """Test a batch executor refusing to batch some operations."""
+        self.setUpService()
+        batch_notifier = Notifier()
+        self.service.add_executor(FakeSplittingBatchExecutor(batch_notifier))
+        self.service.enqueue(FakeQueueItem('op 0'))
+        self.service.enqueue(FakeQueueItem('split'))
+        self.service.enqueue(FakeQueueItem('op 1'))
+        gevent.sleep(0.01)
+        # The batches are [op 0] and [split, op 1].
+        self.assertEqual(batch_notifier.get_notifications(), 2)
+
 
 if __name__ == "__main__":
     unittest.main()
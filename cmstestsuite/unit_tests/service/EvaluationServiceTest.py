@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+# Copyright © 2026 agent <agent@local>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the evaluation service.
+
+"""
+
+import unittest
+from unittest.mock import Mock, PropertyMock, patch
+
+import gevent.lock
+
+# Needs to be first to allow for monkey patching the DB connection string.
+from cmstestsuite.unit_tests.databasemixin import DatabaseMixin
+
+from cms.db import Evaluation, SubmissionResult
+from cms.grading.scoretypes.GroupMin import GroupMin
+from cms.service.EvaluationService import EvaluationExecutor, \
+    EvaluationService, Result
+from cms.service.esoperations import ESOperation
+
+
+class TestWriteResults(DatabaseMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.contest = self.add_contest()
+        participation = self.add_participation(contest=self.contest)
+        task = self.add_task(contest=self.contest)
+        self.dataset = self.add_dataset(task=task)
+        task.active_dataset = self.dataset
+        self.testcases = [self.add_testcase(self.dataset)
+                          for _ in range(3)]
+        self.submission, results = self.add_submission_with_results(
+            task, participation, compilation_outcome="ok")
+        self.submission_result = results[0]
+        self.session.commit()
+
+        # Avoid the initialization of the service, which needs to talk
+        # with the other services.
+        self.service = EvaluationService.__new__(EvaluationService)
+        self.service.post_finish_lock = gevent.lock.RLock()
+        self.service.journal = None
+        self.service.compilation_ended = Mock()
+        self.service.evaluation_ended = Mock()
+
+    def evaluation_result(self, testcase, success=True, outcome="1.0"):
+        operation = ESOperation(ESOperation.EVALUATION, self.submission.id,
+                                self.dataset.id, testcase.codename)
+        job = Mock()
+        job.operation = operation
+        job.get_evaluation_values.return_value = {
+            "text": ["ok"],
+            "outcome": outcome,
+            "execution_time": 0.5,
+            "execution_wall_clock_time": 0.6,
+            "execution_memory": 1024,
+            "evaluation_shard": 0,
+            "evaluation_sandbox": "/tmp/box",
+        }
+        job.plus = {}
+        return operation, Result(job, success)
+
+    def get_evaluations(self):
+        self.session.expire_all()
+        return self.session.query(Evaluation)\
+            .filter(Evaluation.submission_id == self.submission.id).all()
+
+    def test_partial(self):
+        self.service.write_results(
+            [self.evaluation_result(tc) for tc in self.testcases[:2]])
+
+        evaluations = self.get_evaluations()
+        self.assertCountEqual([e.testcase_id for e in evaluations],
+                              [tc.id for tc in self.testcases[:2]])
+        self.assertEqual(evaluations[0].outcome, "1.0")
+        self.assertEqual(evaluations[0].text, ["ok"])
+        self.assertFalse(self.submission_result.evaluated())
+        self.service.evaluation_ended.assert_not_called()
+
+    def test_complete(self):
+        self.service.write_results(
+            [self.evaluation_result(tc) for tc in self.testcases[:2]])
+        self.service.write_results(
+            [self.evaluation_result(self.testcases[2])])
+
+        self.assertEqual(len(self.get_evaluations()), 3)
+        self.assertTrue(self.submission_result.evaluated())
+        self.service.evaluation_ended.assert_called_once()
+
+    def test_failure_not_written(self):
+        self.service.write_results(
+            [self.evaluation_result(tc) for tc in self.testcases[:2]]
+            + [self.evaluation_result(self.testcases[2], success=False)])
+
+        self.assertEqual(len(self.get_evaluations()), 2)
+        self.assertEqual(self.submission_result.evaluation_tries, 1)
+        self.assertFalse(self.submission_result.evaluated())
+
+    def test_conflict(self):
+        # The first result was already written.
+        self.service.write_results(
+            [self.evaluation_result(self.testcases[0])])
+        self.service.write_results(
+            [self.evaluation_result(tc) for tc in self.testcases])
+
+        evaluations = self.get_evaluations()
+        self.assertCountEqual([e.testcase_id for e in evaluations],
+                              [tc.id for tc in self.testcases])
+        self.assertTrue(self.submission_result.evaluated())
+
+    def test_journal(self):
+        self.service.journal = Mock()
+        items = [self.evaluation_result(tc) for tc in self.testcases]
+        self.service.write_results(items)
+
+        removed = [call[0][0]
+                   for call in self.service.journal.remove.call_args_list]
+        self.assertCountEqual(removed, [operation for operation, _ in items])
+
+    def test_skip_doomed(self):
+        self.dataset.skip_doomed_subtasks = True
+        self.session.commit()
+        testcases = sorted(self.testcases, key=lambda tc: tc.codename)
+        patcher = patch("cms.db.Dataset.score_type_object",
+                        new_callable=PropertyMock)
+        patcher.start().return_value = GroupMin(
+            [[50, 2], [50, 1]], dict((tc.codename, False) for tc in testcases))
+        self.addCleanup(patcher.stop)
+        self.service.result_cache = set()
+        self.service.dequeue_by = Mock(return_value=set())
+        self.service.get_executor = Mock()
+        self.service.get_executor().pool.ignore_operations_matching\
+            .return_value = []
+
+        self.service.write_results(
+            [self.evaluation_result(testcases[0], outcome="0.0")])
+
+        # The other testcase of the first subtask is skipped.
+        evaluations = dict((e.testcase_id, e) for e in self.get_evaluations())
+        self.assertCountEqual(evaluations.keys(),
+                              [testcases[0].id, testcases[1].id])
+        self.assertEqual(evaluations[testcases[1].id].outcome, "0.0")
+        self.assertEqual(evaluations[testcases[1].id].text,
+                         ["Not evaluated"])
+        self.service.dequeue_by.assert_called_once()
+        self.assertEqual(self.service.dequeue_by.call_args[0][:2],
+                         ("submission", self.submission.id))
+
+        self.service.write_results(
+            [self.evaluation_result(testcases[2])])
+        self.assertTrue(self.submission_result.evaluated())
+
+    def test_compilation_creates_result(self):
+        submission = self.add_submission(self.dataset.task,
+                                         self.submission.participation)
+        self.session.commit()
+        operation = ESOperation(ESOperation.COMPILATION, submission.id,
+                                self.dataset.id)
+        job = Mock()
+
+        self.service.write_results([(operation, Result(job, True))])
+
+        self.session.expire_all()
+        submission_result = SubmissionResult.get_from_id(
+            (submission.id, self.dataset.id), self.session)
+        self.assertIsNotNone(submission_result)
+        job.to_submission.assert_called_once()
+        self.service.compilation_ended.assert_called_once()
+
+
+class TestMissingOperations(DatabaseMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.contest = self.add_contest()
+        self.participation = self.add_participation(contest=self.contest)
+        self.task = self.add_task(contest=self.contest)
+        dataset = self.add_dataset(task=self.task)
+        self.task.active_dataset = dataset
+        self.session.commit()
+
+        self.service = EvaluationService.__new__(EvaluationService)
+        self.service.contest_id = self.contest.id
+        self.service.post_finish_lock = gevent.lock.RLock()
+        self.service._sweeper_event = Mock()
+        self.service._full_sweep_needed = True
+        self.service._sweep_watermarks = {"submissions": 0, "user_tests": 0}
+        self.service._sweep_max_ids = {"submissions": None,
+                                       "user_tests": None}
+        self.service._last_sweep = None
+        self.service.enqueue = Mock(return_value=True)
+
+    def add_new_submission(self):
+        submission = self.add_submission(self.task, self.participation)
+        self.session.commit()
+        return submission
+
+    def swept_submissions(self):
+        self.service.enqueue.reset_mock()
+        self.service._missing_operations()
+        return set(call[0][0].object_id
+                   for call in self.service.enqueue.call_args_list)
+
+    def mark_compiled(self, submission):
+        self.add_submission_result(submission, self.task.active_dataset,
+                                   compilation_outcome="fail")
+        self.session.commit()
+
+    def test_incremental(self):
+        old = self.add_new_submission()
+        self.assertEqual(self.swept_submissions(), {old.id})
+        self.assertTrue(self.service._last_sweep["full"])
+        self.mark_compiled(old)
+
+        new = self.add_new_submission()
+        self.assertEqual(self.swept_submissions(), {new.id})
+        self.assertFalse(self.service._last_sweep["full"])
+        self.assertEqual(self.service._last_sweep["rows"], 1)
+        self.mark_compiled(new)
+
+        # The old submission needs operations again, but it has gone
+        # past the watermark: only a full sweep finds it.
+        self.session.delete(old.get_result())
+        self.session.commit()
+        self.assertEqual(self.swept_submissions(), set())
+        self.service.search_operations_not_done()
+        self.assertEqual(self.swept_submissions(), {old.id})
+
+    def test_pending_operations_rescanned(self):
+        submission = self.add_new_submission()
+        self.swept_submissions()
+        self.add_new_submission()
+        self.swept_submissions()
+        # The first submission still has operations to do (e.g., they
+        # are in the queue), so it is looked at again.
+        self.assertIn(submission.id, self.swept_submissions())
+
+    def test_late_submission_seen_twice(self):
+        self.swept_submissions()
+        submission = self.add_new_submission()
+        self.mark_compiled(submission)
+        self.swept_submissions()
+        self.session.delete(submission.get_result())
+        self.session.commit()
+        self.assertEqual(self.swept_submissions(), {submission.id})
+        self.assertEqual(self.service._sweep_watermarks["submissions"],
+                         submission.id)
+
+
+class TestEvaluationExecutor(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch("cms.service.EvaluationService.WorkerPool")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.executor = EvaluationExecutor(Mock())
+
+    @staticmethod
+    def operation(object_id, dataset_id, codename="0",
+                  type_=ESOperation.EVALUATION):
+        return ESOperation(type_, object_id, dataset_id, codename)
+
+    def test_dequeue_by(self):
+        operations = [self.operation(1, 1), self.operation(1, 2),
+                      self.operation(2, 1),
+                      self.operation(1, 1, "0",
+                                     ESOperation.USER_TEST_EVALUATION)]
+        for operation in operations:
+            self.executor.enqueue(operation)
+
+        self.assertCountEqual(
+            self.executor.dequeue_by("submission", 1),
+            operations[:2])
+        self.assertCountEqual(
+            self.executor.dequeue_by("dataset", 1), operations[2:])
+        self.assertEqual(len(self.executor._operation_queue), 0)
+
+    def test_dequeue_currently_executing(self):
+        executing = self.operation(1, 1)
+        other = self.operation(2, 1)
+        self.executor._currently_executing = {executing: None, other: None}
+        self.executor.enqueue(self.operation(1, 1, "1"))
+        self.assertIn(executing, self.executor)
+
+        self.assertCountEqual(self.executor.dequeue_by("submission", 1),
+                              [executing, self.operation(1, 1, "1")])
+        self.assertNotIn(executing, self.executor)
+        self.assertIn(other, self.executor)
+        self.executor.dequeue(other)
+        self.assertNotIn(other, self.executor)
+        with self.assertRaises(KeyError):
+            self.executor.dequeue(other)
+
+
+if __name__ == "__main__":
+    unittest.main()
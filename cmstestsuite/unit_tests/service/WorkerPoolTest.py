@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+# Copyright © 2026 agent <agent@local>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the worker pool.
+
+"""
+
+import unittest
+from datetime import timedelta
+from unittest.mock import MagicMock, Mock, patch
+
+from cms import ServiceCoord, config
+from cms.grading.Job import EvaluationJob, JobGroup
+from cms.service.esoperations import ESOperation
+from cms.service.workerpool import WorkerPool
+from cmscommon.datetime import make_datetime
+
+
+class TestWorkerPool(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch("cms.service.workerpool.SessionGen", MagicMock())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch("cms.service.workerpool.JobGroup")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.service = Mock()
+        self.service.contest_id = None
+        self.service.connect_to.side_effect = lambda *args, **kwargs: Mock()
+        self.pool = WorkerPool(self.service)
+        for shard in range(4):
+            self.pool.add_worker(ServiceCoord("Worker", shard))
+
+    @staticmethod
+    def operation(dataset_id, object_id, codename="0"):
+        return ESOperation(ESOperation.EVALUATION,
+                           object_id, dataset_id, codename)
+
+    def run_on_worker(self, operations):
+        shard = self.pool.acquire_worker(operations)
+        self.pool.release_worker(shard)
+        return shard
+
+    # Testing acquire_worker.
+
+    def test_acquire_prefers_workers_with_dataset(self):
+        shard_a = self.run_on_worker([self.operation(1, 10)])
+        shard_b = (shard_a + 1) % 4
+        self.pool._remember_locality(shard_b, [self.operation(2, 20)])
+
+        for _ in range(5):
+            self.assertEqual(
+                self.run_on_worker([self.operation(1, 11)]), shard_a)
+            self.assertEqual(
+                self.run_on_worker([self.operation(2, 21)]), shard_b)
+
+    def test_acquire_prefers_workers_with_submission(self):
+        shard_a = self.run_on_worker([self.operation(1, 10)])
+        # Another worker also has the dataset, but not the submission.
+        shard_b = (shard_a + 1) % 4
+        self.pool._remember_locality(shard_b, [self.operation(1, 11)])
+
+        for _ in range(5):
+            self.assertEqual(
+                self.run_on_worker([self.operation(1, 10, "1")]), shard_a)
+
+    def test_acquire_falls_back_to_other_workers(self):
+        shard_a = self.run_on_worker([self.operation(1, 10)])
+        # Keep the preferred worker busy.
+        self.pool._add_operations(shard_a, [self.operation(2, 20)])
+        other = self.pool.acquire_worker([self.operation(1, 11)])
+        self.assertIsNotNone(other)
+        self.assertNotEqual(other, shard_a)
+
+    def test_acquire_skips_disconnected(self):
+        shard_a = self.run_on_worker([self.operation(1, 10)])
+        self.pool._worker[shard_a].connected = False
+        self.assertNotEqual(self.run_on_worker([self.operation(1, 11)]),
+                            shard_a)
+
+    def test_acquire_none_available(self):
+        for shard in range(4):
+            self.pool._worker[shard].connected = False
+        self.assertIsNone(self.pool.acquire_worker([self.operation(1, 10)]))
+
+
+    # Testing ignore_operations_matching.
+
+    def test_ignore_operations_matching(self):
+        operations = [self.operation(1, 10, str(i)) for i in range(3)]
+        shard = self.pool.acquire_worker(operations)
+        other = self.pool.acquire_worker([self.operation(2, 20)])
+
+        ignored = self.pool.ignore_operations_matching(
+            lambda operation: operation.testcase_codename != "1")
+        self.assertCountEqual(ignored, [operations[0], operations[2],
+                                        self.operation(2, 20)])
+        self.assertCountEqual(self.pool._operations_to_ignore[shard],
+                              [operations[0], operations[2]])
+        self.assertEqual(self.pool._operations_to_ignore[other],
+                         [self.operation(2, 20)])
+        # Operations already ignored are not returned again.
+        self.assertEqual(
+            self.pool.ignore_operations_matching(lambda operation: True),
+            [operations[1]])
+
+    # Testing the batch durations.
+
+    def test_batch_durations_in_status(self):
+        operations = [self.operation(1, 10, str(i)) for i in range(3)]
+        shard = self.pool.acquire_worker(operations)
+        status = self.pool.get_status()["%d" % shard]
+        self.assertAlmostEqual(status["predicted_duration"], 3.0)
+        self.assertIsNone(status["last_batch"])
+
+        self.pool.release_worker(shard)
+        status = self.pool.get_status()["%d" % shard]
+        self.assertIsNone(status["predicted_duration"])
+        self.assertEqual(status["last_batch"]["size"], 3)
+        self.assertAlmostEqual(status["last_batch"]["predicted_duration"],
+                               3.0)
+        # The batch took (almost) no time.
+        self.assertLess(
+            self.pool.durations.estimate(self.operation(1, 11)), 0.1)
+
+    # Testing the late workers.
+
+    def make_late(self, shard):
+        self.pool._start_time[shard] = \
+            make_datetime() - timedelta(seconds=1000)
+
+    def test_expected_batch_duration(self):
+        operations = [self.operation(1, 10, str(i)) for i in range(2)]
+        job_group = JobGroup([EvaluationJob(operation=operations[0],
+                                            time_limit=2.0)])
+        expected = (5.0 + WorkerPool.STRAGGLER_FACTOR * 1.0) \
+            / min(config.worker_parallel_jobs, 2) \
+            + WorkerPool.STRAGGLER_OVERHEAD
+        self.assertAlmostEqual(
+            self.pool._expected_batch_duration(operations, job_group),
+            expected)
+
+    def test_stragglers_speculated(self):
+        operations = [self.operation(1, 10, str(i)) for i in range(2)]
+        shard = self.pool.acquire_worker(list(operations))
+        self.assertEqual(self.pool.check_stragglers(), 0)
+        self.make_late(shard)
+        # The first operation was already completed.
+        self.pool.operation_finished(shard, operations[0])
+
+        self.assertEqual(self.pool.check_stragglers(), 1)
+        other = (self.pool._operations_reverse[operations[1]] - {shard}).pop()
+        self.assertEqual(self.pool._operations[other], [operations[1]])
+        # Each batch is given to another worker only once.
+        self.make_late(other)
+        self.assertEqual(self.pool.check_stragglers(), 0)
+
+        # The second worker wins, the result of the first is ignored.
+        self.pool.release_worker(other)
+        self.assertTrue(self.pool.claim_result(other, operations[1], True))
+        self.assertIn(operations[1], self.pool.release_worker(shard))
+        self.assertEqual(self.pool.get_speculation_status(),
+                         {"dispatches": 1, "wins": 1})
+        self.assertNotIn(operations[1], self.pool)
+
+    def test_stragglers_failure_waits(self):
+        operation = self.operation(1, 10)
+        shard = self.pool.acquire_worker([operation])
+        self.make_late(shard)
+        self.pool.check_stragglers()
+        other = (self.pool._operations_reverse[operation] - {shard}).pop()
+
+        # A failure is not used while the other worker may succeed.
+        self.pool.release_worker(other)
+        self.assertFalse(self.pool.claim_result(other, operation, False))
+        self.assertEqual(self.pool.release_worker(shard), False)
+        self.assertTrue(self.pool.claim_result(shard, operation, True))
+        self.assertEqual(self.pool.get_speculation_status(),
+                         {"dispatches": 1, "wins": 0})
+
+    def test_stragglers_no_idle_worker(self):
+        shard = self.pool.acquire_worker([self.operation(1, 10)])
+        for other in range(4):
+            if other != shard:
+                self.pool._worker[other].connected = False
+        self.make_late(shard)
+        self.assertEqual(self.pool.check_stragglers(), 0)
+
+    def test_active_workers_count(self):
+        self.assertEqual(self.pool.get_active_workers_count(), 4)
+        self.pool._worker[0].connected = False
+        self.pool.disable_worker(1)
+        self.assertEqual(self.pool.get_active_workers_count(), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -21,8 +21,9 @@
 
 """
 
+import time
 import unittest
-from unittest.mock import Mock, call
+from unittest.mock import MagicMock, Mock, call, patch
 
 import gevent
 
@@ -249,6 +250,133 @@ class TestWorker(unittest.TestCase):
             JobGroup.import_from_dict(
                 self.service.execute_job_group(job_groups[0].export_to_dict()))
 
+    def test_execute_job_group_parallel(self):
+        """Executes a job group on three concurrent slots.
+
+        """
+        with patch.object(cms.service.Worker.config,
+                          "worker_parallel_jobs", 3):
+            self.service = Worker(0)
+        n_jobs = 6
+        job_groups, calls = TestWorker.new_job_groups([n_jobs])
+        task_type = FakeTaskType([0.2] * n_jobs)
+        cms.service.Worker.get_task_type = Mock(return_value=task_type)
+
+        start = time.monotonic()
+        result = JobGroup.import_from_dict(
+            self.service.execute_job_group(job_groups[0].export_to_dict()))
+        elapsed = time.monotonic() - start
+
+        self.assertTrue(all(job.success for job in result.jobs))
+        self.assertEqual(task_type.call_count, n_jobs)
+        # Two rounds of three jobs each.
+        self.assertLess(elapsed, 0.2 * n_jobs / 2)
+
+    def test_execute_job_group_failure_lets_running_jobs_finish(self):
+        """After a failure, running jobs finish and the others are
+        skipped.
+
+        """
+        with patch.object(cms.service.Worker.config,
+                          "worker_parallel_jobs", 2):
+            self.service = Worker(0)
+        job_groups, unused_calls = TestWorker.new_job_groups([4])
+        task_type = FakeTaskType([0.1, Exception(), True, True])
+        cms.service.Worker.get_task_type = Mock(return_value=task_type)
+
+        start = time.monotonic()
+        with self.assertRaises(JobException):
+            self.service.execute_job_group(job_groups[0].export_to_dict())
+        elapsed = time.monotonic() - start
+
+        # The first job was not killed.
+        self.assertGreaterEqual(elapsed, 0.1)
+        self.assertEqual(task_type.call_count, 2)
+        self.assertEqual(self.service._free_slots.qsize(), 2)
+
+    def test_execute_job_group_streams_results(self):
+        """Results of groups with many jobs are sent one by one.
+
+        """
+        self.service.evaluation_service = Mock()
+        job_groups, unused_calls = TestWorker.new_job_groups([1, 3])
+        task_type = FakeTaskType([True] * 4)
+        cms.service.Worker.get_task_type = Mock(return_value=task_type)
+
+        self.service.execute_job_group(job_groups[0].export_to_dict())
+        self.service.evaluation_service.job_finished.assert_not_called()
+
+        self.service.execute_job_group(job_groups[1].export_to_dict())
+        self.assertEqual(
+            [c[1]["job"]["info"] for c in self.service.evaluation_service
+             .job_finished.call_args_list],
+            [job.info for job in job_groups[1].jobs])
+
+    def test_execute_job_provisioning_stats(self):
+        """The provisioning stats of the job are sent with its results.
+
+        """
+        jobs, unused_calls = TestWorker.new_jobs(1)
+        stats = {"copied_bytes": 0, "linked_bytes": 0, "reflinked_bytes": 0}
+
+        def execute_job(job, file_cacher):
+            stats["copied_bytes"] += 10
+            stats["linked_bytes"] += 20
+            job.success = True
+            job.plus = {"execution_time": 1.0}
+
+        task_type = Mock()
+        task_type.execute_job.side_effect = execute_job
+        cms.service.Worker.get_task_type = Mock(return_value=task_type)
+
+        with patch("cms.service.Worker.collect_provisioning_stats",
+                   return_value=stats):
+            ret_job_group = JobGroup.import_from_dict(
+                self.service.execute_job_group(
+                    JobGroup(jobs).export_to_dict()))
+
+        self.assertEqual(ret_job_group.jobs[0].plus, {
+            "execution_time": 1.0,
+            "provisioning_stats": {
+                "copied_bytes": 10,
+                "linked_bytes": 20,
+                "reflinked_bytes": 0,
+            },
+        })
+
+    # Testing precache_files.
+
+    def test_precache_files_judged_datasets_first(self):
+        """Files of the judged datasets are downloaded first, and
+        missing files do not stop the precaching.
+
+        """
+        enumerate_files = Mock(side_effect=[{"b", "c"}, {"a", "b", "c", "d"}])
+        loaded = []
+
+        def load_many(digests, if_needed=False):
+            self.assertTrue(if_needed)
+            loaded.extend(digests)
+            # File c cannot be found.
+            return {digest: 10 for digest in digests if digest != "c"}
+
+        self.service.file_cacher.load_many = Mock(side_effect=load_many)
+        with patch("cms.service.Worker.SessionGen", MagicMock()), \
+                patch("cms.service.Worker.Contest"), \
+                patch("cms.service.Worker.enumerate_files", enumerate_files), \
+                patch.object(Worker, "PRECACHE_BATCH_SIZE", 3), \
+                patch.object(cms.service.Worker.config,
+                             "precache_concurrency", 1):
+            self.service.precache_files(contest_id=1)
+
+        self.assertEqual(loaded, ["b", "c", "a", "d"])
+        self.assertEqual(self.service.file_cacher.load_many.call_count, 2)
+        progress = self.service.cache_status()["precache"]
+        self.assertEqual(progress["total"], 4)
+        self.assertEqual(progress["done"], 4)
+        self.assertEqual(progress["downloaded"], 3)
+        self.assertEqual(progress["downloaded_bytes"], 30)
+
     @staticmethod
     def new_jobs(number_of_jobs, prefix=None):
         prefix = prefix if prefix is not None else ""
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+# Copyright © 2026 agent <agent@local>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the duration estimator module."""
+
+import unittest
+
+from cms.service.durationestimator import DurationEstimator
+from cms.service.esoperations import ESOperation
+
+
+def evaluation(dataset_id, codename="0"):
+    return ESOperation(ESOperation.EVALUATION, 1, dataset_id, codename)
+
+
+def compilation(dataset_id):
+    return ESOperation(ESOperation.COMPILATION, 1, dataset_id)
+
+
+class TestDurationEstimator(unittest.TestCase):
+
+    def setUp(self):
+        self.estimator = DurationEstimator()
+
+    def test_defaults(self):
+        self.assertEqual(
+            self.estimator.estimate(evaluation(1)),
+            DurationEstimator.DEFAULT_DURATIONS[ESOperation.EVALUATION])
+        self.assertEqual(
+            self.estimator.estimate(compilation(1)),
+            DurationEstimator.DEFAULT_DURATIONS[ESOperation.COMPILATION])
+
+    def test_estimate_batch(self):
+        operations = [evaluation(1, str(i)) for i in range(4)]
+        self.assertAlmostEqual(
+            self.estimator.estimate_batch(operations), 4.0)
+        self.assertAlmostEqual(
+            self.estimator.estimate_batch(operations, parallelism=2), 2.0)
+        self.assertAlmostEqual(
+            self.estimator.estimate_batch(operations, parallelism=8), 1.0)
+        self.assertEqual(self.estimator.estimate_batch([]), 0.0)
+
+    def test_update_new_dataset(self):
+        """The first measurement of a dataset is taken as it is."""
+        operations = [evaluation(1, str(i)) for i in range(4)]
+        self.estimator.update(operations, 12.0)
+        self.assertAlmostEqual(self.estimator.estimate(evaluation(1)), 3.0)
+        # Other datasets only move towards the new value.
+        estimate = self.estimator.estimate(evaluation(2))
+        self.assertGreater(estimate, 1.0)
+        self.assertLess(estimate, 3.0)
+        # Other operation types are not affected.
+        self.assertEqual(
+            self.estimator.estimate(compilation(1)),
+            DurationEstimator.DEFAULT_DURATIONS[ESOperation.COMPILATION])
+
+    def test_update_converges(self):
+        for _ in range(50):
+            self.estimator.update([evaluation(1)], 2.0)
+            self.estimator.update([evaluation(1)], 4.0)
+        self.assertAlmostEqual(self.estimator.estimate(evaluation(1)), 3.0,
+                               delta=0.5)
+
+    def test_update_mixed_batch(self):
+        """The duration is split according to the estimates."""
+        self.estimator.update([compilation(1), evaluation(1)], 12.0)
+        self.assertAlmostEqual(self.estimator.estimate(compilation(1)),
+                               10.0)
+        self.assertAlmostEqual(self.estimator.estimate(evaluation(1)), 2.0)
+
+    def test_update_parallel(self):
+        operations = [evaluation(1, str(i)) for i in range(4)]
+        self.estimator.update(operations, 3.0, parallelism=4)
+        self.assertAlmostEqual(self.estimator.estimate(evaluation(1)), 3.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
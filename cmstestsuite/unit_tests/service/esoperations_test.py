@@ -115,6 +115,20 @@ class TestESOperations(DatabaseMixin, unittest.TestCase):
             set(get_submissions_operations(self.session, self.contest.id)),
             expected_operations)
 
+    def test_get_submissions_operations_participation(self):
+        """Test that operations know the participation of the object."""
+        submission, results = self.add_submission_with_results(
+            self.tasks[0], self.participation, True)
+        self.add_submission(self.tasks[0], self.participation)
+        self.session.flush()
+
+        operations = list(
+            get_submissions_operations(self.session, self.contest.id))
+        self.assertGreater(len(operations), 0)
+        for operation, _, _ in operations:
+            self.assertEqual(operation.participation_id,
+                             self.participation.id)
+
     def test_get_submissions_operations_with_results(self):
         """Test for a submission with submission results."""
         submission, results = self.add_submission_with_results(
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+# Contest Management System - http://cms-dev.github.io/
+# Copyright © 2026 agent <agent@local>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the operation journal module."""
+
+import unittest
+from datetime import datetime
+from unittest.mock import patch
+
+from cms.io import PriorityQueue
+from cms.service.esoperations import ESOperation
+from cms.service.operationjournal import OperationJournal
+from cmstestsuite.unit_tests.filesystemmixin import FileSystemMixin
+
+
+def evaluation(object_id, codename="0"):
+    return ESOperation(ESOperation.EVALUATION, object_id, 1, codename)
+
+
+class TestOperationJournal(FileSystemMixin, unittest.TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.path = self.get_path("journal")
+        self.journal = OperationJournal(self.path)
+        self.assertEqual(self.journal.load(), [])
+        self.timestamp = datetime(2020, 1, 2, 3, 4, 5, 678000)
+
+    def tearDown(self):
+        self.journal.close()
+        super().tearDown()
+
+    def reload(self):
+        self.journal.close()
+        self.journal = OperationJournal(self.path)
+        return self.journal.load()
+
+    def test_add_remove(self):
+        self.journal.add(evaluation(1), PriorityQueue.PRIORITY_HIGH,
+                         self.timestamp)
+        self.journal.add(evaluation(2), PriorityQueue.PRIORITY_LOW,
+                         self.timestamp)
+        self.journal.remove(evaluation(1))
+        # Removing a non-pending operation is a no-op.
+        self.journal.remove(evaluation(3))
+
+        self.assertEqual(
+            self.reload(),
+            [(evaluation(2), PriorityQueue.PRIORITY_LOW, self.timestamp)])
+
+    def test_truncated_record(self):
+        self.journal.add(evaluation(1), PriorityQueue.PRIORITY_HIGH,
+                         self.timestamp)
+        self.journal.close()
+        # Simulate a crash while writing a record.
+        with open(self.path, "at") as f:
+            f.write('{"action": "remove", "oper')
+
+        self.assertEqual(
+            self.reload(),
+            [(evaluation(1), PriorityQueue.PRIORITY_HIGH, self.timestamp)])
+        # The journal is usable after the recovery.
+        self.journal.add(evaluation(2), PriorityQueue.PRIORITY_HIGH,
+                         self.timestamp)
+        self.assertEqual(len(self.reload()), 2)
+
+    @patch.object(OperationJournal, "COMPACTION_MIN_RECORDS", 10)
+    def test_compaction(self):
+        for i in range(100):
+            self.journal.add(evaluation(i), PriorityQueue.PRIORITY_HIGH,
+                             self.timestamp)
+            self.journal.remove(evaluation(i))
+        self.journal.add(evaluation(100), PriorityQueue.PRIORITY_HIGH,
+                         self.timestamp)
+
+        with open(self.path, "rt") as f:
+            self.assertLessEqual(len(f.readlines()), 10)
+        self.assertEqual(
+            self.reload(),
+            [(evaluation(100), PriorityQueue.PRIORITY_HIGH, self.timestamp)])
+
+
+if __name__ == "__main__":
+    unittest.main()